@@ -0,0 +1,83 @@
+"""
+Startup import cost of the entry points, measured with `python -X importtime`
+in fresh interpreters. Fails (exit code 1) when a module pulls in a dependency
+it must not import at load time, or when its best time exceeds its budget by
+more than --tolerance.
+
+The web server module itself mounts the built UI on import, so its import
+graph is covered through the modules it loads.
+
+Usage: python -m hivemind_exp.benchmarks.import_time [--repeats 3 --tolerance 1.5]
+"""
+
+import argparse
+import subprocess
+import sys
+
+TRAINING_STACK = ("torch", "transformers", "trl", "datasets", "peft", "hivemind")
+CHAIN_STACK = ("web3", "eth_account")
+
+# Module: (budget in ms, top-level packages it must not import).
+TARGETS = {
+    "hivemind_exp.dht_utils": (50, TRAINING_STACK + CHAIN_STACK),
+    "hivemind_exp.name_utils": (50, TRAINING_STACK + CHAIN_STACK),
+    "web.api.server_cache": (1000, TRAINING_STACK + CHAIN_STACK),
+    "web.api.dht_pub": (1000, TRAINING_STACK + CHAIN_STACK),
+    "web.api.global_dht": (1000, TRAINING_STACK + CHAIN_STACK),
+    "hivemind_exp.gsm8k.train_single_gpu": (10000, CHAIN_STACK),
+}
+
+
+def import_profile(module: str) -> tuple[float, set[str]]:
+    """Cumulative import time of `module` in ms, and every module it loaded."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    total, loaded = None, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue  # Header line.
+        name = name.strip()
+        loaded.add(name)
+        if name == module:
+            total = int(cumulative) / 1000
+    assert total is not None, f"{module} missing from -X importtime output"
+    return total, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':40s} {'best ms':>9s} {'budget':>8s}  forbidden imports")
+    for module, (budget, forbidden) in TARGETS.items():
+        runs = [import_profile(module) for _ in range(args.repeats)]
+        best = min(t for t, _ in runs)
+        loaded = runs[0][1]
+        leaked = sorted(
+            f for f in forbidden if any(m == f or m.startswith(f + ".") for m in loaded)
+        )
+        print(f"{module:40s} {best:9.0f} {budget:8d}  {', '.join(leaked) or '-'}")
+        if leaked:
+            failures.append(f"{module} imports {', '.join(leaked)}")
+        if best > budget * args.tolerance:
+            failures.append(f"{module} took {best:.0f} ms (budget {budget} ms)")
+
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
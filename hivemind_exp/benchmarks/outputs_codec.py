@@ -0,0 +1,101 @@
+"""
+Size and encode/decode time of published stage outputs: hivemind's msgpack
+serialization of the raw `(timestamp, outputs)` value (what peers published
+before outputs_codec) against outputs_codec, with and without its preset
+dictionary, and with shared texts published as blobs ("refs": the size of
+the outputs alone, which every peer publishes). Stage 2/3 outputs embed
+prompts rendered from `--peers` answers.
+
+Usage: python -m hivemind_exp.benchmarks.outputs_codec [--peers 15]
+"""
+
+import argparse
+import copy
+import time
+import zlib
+
+import msgpack
+from hivemind.utils.serializer import MSGPackSerializer
+
+from hivemind_exp import outputs_codec
+from hivemind_exp.gsm8k import generate_prompts
+from hivemind_exp.tests.fake_data import (
+    STAGE_1_MERGED,
+    STAGE_1_OUTPUTS,
+    STAGE_2_MERGED,
+    STAGE_2_OUTPUTS,
+    STAGE_3_OUTPUTS,
+)
+
+
+def with_peers(merged, field, n_peers):
+    # Peers' texts differ, if only slightly; identical ones would flatter zlib.
+    texts = list(merged[field].values())
+    merged = copy.deepcopy(merged)
+    merged[field] = {f"peer{i}": f"{texts[i % len(texts)]} ({i})" for i in range(n_peers)}
+    return merged
+
+
+def render(merged, render_fn):
+    return render_fn(next(generate_prompts.stage_generator([merged])))
+
+
+def stage_outputs(n_peers):
+    stage1 = next(iter(STAGE_1_OUTPUTS.values()))
+    stage2 = dict(next(iter(STAGE_2_OUTPUTS.values())))
+    stage2["stage2_prompt"] = render(
+        with_peers(STAGE_1_MERGED, "agent_answers", n_peers),
+        generate_prompts.generate_stage2_user_prompt,
+    )
+    stage3 = dict(next(iter(STAGE_3_OUTPUTS.values())))
+    merged = with_peers(STAGE_2_MERGED, "agent_opinion", n_peers)
+    merged["stage2_prompt"] = stage2["stage2_prompt"]
+    stage3["stage3_prompt"] = render(merged, generate_prompts.generate_stage3_user_prompt)
+    return {"stage1": stage1, "stage2": stage2, "stage3": stage3}
+
+
+def encode_without_dictionary(value):
+    return zlib.compress(msgpack.packb(value), outputs_codec.COMPRESS_LEVEL)
+
+
+def encode_with_refs(value):
+    outputs, _ = outputs_codec.extract_blobs(value[1])
+    return outputs_codec.encode_outputs((value[0], outputs))
+
+
+CODECS = {
+    "raw": (MSGPackSerializer.dumps, MSGPackSerializer.loads),
+    "zlib": (encode_without_dictionary, lambda b: msgpack.unpackb(zlib.decompress(b))),
+    "codec": (outputs_codec.encode_outputs, outputs_codec.decode_outputs),
+    "refs": (encode_with_refs, outputs_codec.decode_outputs),
+}
+
+
+def timed(fn, arg, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(arg)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, default=15)
+    parser.add_argument("--repeats", type=int, default=1000)
+    args = parser.parse_args()
+
+    for stage, outputs in stage_outputs(args.peers).items():
+        value = (time.time(), outputs)
+        raw_size = None
+        for name, (encode, decode) in CODECS.items():
+            data = encode(value)
+            raw_size = raw_size or len(data)
+            print(
+                f"{stage} {name}: {len(data)} bytes ({len(data) / raw_size:.0%}), "
+                f"encode {timed(encode, value, args.repeats) * 1e6:.0f} us, "
+                f"decode {timed(decode, data, args.repeats) * 1e6:.0f} us"
+            )
+
+
+if __name__ == "__main__":
+    main()
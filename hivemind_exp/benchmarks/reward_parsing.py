@@ -0,0 +1,114 @@
+"""
+Per-batch reward time before/after the shared completion parser.
+
+Usage: python -m hivemind_exp.benchmarks.reward_parsing [--num-generations 8]
+"""
+
+import argparse
+import random
+import re
+import time
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.completion_parser import parse_completion
+
+MAX_COMPLETION_LENGTH = 1024  # Tokens; see configs/*/grpo-qwen-2.5-0.5b-deepseek-r1.yaml
+CHARS_PER_TOKEN = 4
+
+WORDS = "the total is so we add then subtract each of and 12 7 45 dollars apples".split()
+
+
+def filler(rng, n_chars):
+    words = []
+    while sum(len(w) + 1 for w in words) < n_chars:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)
+
+
+def make_completion(rng, tags):
+    budget = MAX_COMPLETION_LENGTH * CHARS_PER_TOKEN // len(tags)
+    body = "".join(f"<{t}>\n{filler(rng, budget)}\n</{t}>\n" for t in tags)
+    return body + filler(rng, rng.randint(0, 64))  # Trailing garbage.
+
+
+def legacy_extract(text, tag):
+    return text.split(f"<{tag}>")[-1].split(f"</{tag}>")[0].strip()
+
+
+def legacy_count(text, tags, last):
+    count = 0.0
+    for tag in tags:
+        count += 0.125 * (text.count(f"<{tag}>\n") == 1)
+        count += 0.125 * (text.count(f"\n</{tag}>\n") == 1)
+    if text.count(f"\n<{last}>\n") == 1:
+        count += 0.125 - len(text.split(f"\n</{last}>\n")[-1]) * 0.001
+    if text.count(f"\n</{last}>") == 1:
+        count += 0.125 - (len(text.split(f"\n</{last}>")[-1]) - 1) * 0.001
+    return count
+
+
+def legacy_batch(schema, tags, last, extracted, texts):
+    # One scan per reward function, as the split/regex implementations did, and
+    # then every scan again for hivemind_cumulative_reward.
+    for _ in range(2):
+        for text in texts:
+            for tag in extracted:
+                legacy_extract(text, tag)
+            re.match(schema.strict.pattern, text)
+            re.match(schema.soft.pattern, text)
+            legacy_count(text, tags, last)
+
+
+def parsed_batch(module, extracted, texts):
+    for _ in range(2):
+        for parsed in module.parse_completions([[{"content": t}] for t in texts]):
+            for tag in extracted:
+                parsed.extract(tag)
+            parsed.strict, parsed.soft, parsed.xml_count
+
+
+STAGES = [
+    ("stage1", stage1_rewards, ("think",), "answer", ("answer", "answer")),
+    ("stage2", stage2_rewards, ("compare", "explain"), "identify", ("identify", "identify")),
+    (
+        "stage3",
+        stage3_rewards,
+        ("summarize_feedback", "majority", "question", "think"),
+        "answer",
+        ("majority", "majority", "question", "answer"),
+    ),
+]
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parse_completion.cache_clear()  # Each batch is new text.
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-generations", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"max_completion_length={MAX_COMPLETION_LENGTH} num_generations={args.num_generations}")
+    for name, module, tags, last, extracted in STAGES:
+        texts = [make_completion(rng, tags + (last,)) for _ in range(args.num_generations)]
+        before = timed(
+            lambda: legacy_batch(module.XML_SCHEMA, tags, last, extracted, texts), args.repeats
+        )
+        after = timed(lambda: parsed_batch(module, extracted, texts), args.repeats)
+        print(
+            f"{name}: before {before * 1e3:.3f} ms/batch, after {after * 1e3:.3f} ms/batch "
+            f"({before / after:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
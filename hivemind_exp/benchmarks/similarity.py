@@ -0,0 +1,71 @@
+"""
+question_recreation_reward_func similarity backends on adversarially long
+<question> blocks: completions that spend the whole token budget on text that
+keeps partially matching the original question.
+
+Usage: python -m hivemind_exp.benchmarks.similarity [--num-generations 8]
+"""
+
+import argparse
+import random
+import time
+
+from hivemind_exp.benchmarks.reward_parsing import CHARS_PER_TOKEN, MAX_COMPLETION_LENGTH
+from hivemind_exp.gsm8k.similarity import SIMILARITY_BACKENDS
+
+QUESTION = (
+    "Carl is taking a class where the whole grade is based on four tests that are "
+    "graded out of 100. He got an 80, a 75 and a 90 on his first three tests. If he "
+    "wants an 85 average for the class, what is the minimum grade he needs to get on "
+    "his last test?"
+)
+
+
+def shuffled_words(rng, n_chars):
+    # Every word occurs in the question, so difflib finds many short matches.
+    words = QUESTION.split()
+    out = []
+    while sum(len(w) + 1 for w in out) < n_chars:
+        out.append(rng.choice(words))
+    return " ".join(out)
+
+
+def repeated_question(rng, n_chars):
+    return (QUESTION + " ") * (n_chars // (len(QUESTION) + 1) + 1)
+
+
+def char_soup(rng, n_chars):
+    return "".join(rng.choice(QUESTION) for _ in range(n_chars))
+
+
+CASES = [shuffled_words, repeated_question, char_soup]
+
+
+def timed(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-generations", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    n_chars = MAX_COMPLETION_LENGTH * CHARS_PER_TOKEN
+    print(f"completion_chars={n_chars} num_generations={args.num_generations}")
+    for case in CASES:
+        candidates = [case(rng, n_chars) for _ in range(args.num_generations)]
+        results = []
+        for name, backend in SIMILARITY_BACKENDS.items():
+            elapsed = timed(lambda: backend(candidates, QUESTION), args.repeats)
+            score = backend(candidates, QUESTION)[0]
+            results.append(f"{name} {elapsed * 1e3:.2f} ms/batch (ratio {score:.3f})")
+        print(f"{case.__name__}: " + ", ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Stage 2/3 dataset construction: the wide layout built with
+Dataset.from_generator (one agent_answers_<peer> column per peer, missing cells
+filled with placeholders) against the sparse in-memory layout. Reports build
+time, Arrow table size and files left in the datasets cache, plus the time of
+the full get_stage{2,3}_samples including prompt rendering.
+
+Usage: python -m hivemind_exp.benchmarks.stage_datasets [--questions 50 --peers 50]
+"""
+
+import argparse
+import copy
+import os
+import tempfile
+import time
+
+import datasets
+
+from hivemind_exp.gsm8k import generate_prompts
+from hivemind_exp.tests.fake_data import STAGE_1_MERGED, STAGE_2_MERGED
+
+UNKNOWN_ANSWER = "No answer received..."
+
+
+def legacy_wide_rows(values, fields):
+    agents = set()
+    for val in values:
+        for field in fields:
+            agents |= val[field].keys()
+    for val in values:
+        output = {}
+        for field in val:
+            if field in fields:
+                for agent in sorted(agents):
+                    output[f"{field}_{agent}"] = val[field].get(agent, UNKNOWN_ANSWER)
+            else:
+                output[field] = val[field]
+        yield output
+
+
+def legacy_build(values, field):
+    rows = list(legacy_wide_rows(values, (field,)))
+    return datasets.Dataset.from_generator(lambda: iter(rows))
+
+
+def sparse_build(values, field):
+    return generate_prompts.in_memory_dataset(generate_prompts.stage_generator(values))
+
+
+def make_values(template, field, n_questions, n_peers):
+    values = []
+    for q in range(n_questions):
+        v = copy.deepcopy(template)
+        v["question"] = f"{v['question']} ({q})"
+        text = next(iter(template[field].values()))
+        # Each question is answered by a different tenth of the swarm.
+        v[field] = {str(p): text for p in range(n_peers) if (p + q) % 10 == 0}
+        values.append(v)
+    return values
+
+
+def count_files(root):
+    return sum(len(files) for _, _, files in os.walk(root))
+
+
+def measure(fn, repeats):
+    # Every round brings new values, so each run starts from an empty cache.
+    best, nbytes, files = float("inf"), 0, 0
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            datasets.config.HF_DATASETS_CACHE = cache_dir
+            start = time.perf_counter()
+            dataset = fn()
+            best = min(best, time.perf_counter() - start)
+            nbytes, files = dataset.data.nbytes, count_files(cache_dir)
+    return best, nbytes, files
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--peers", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"questions={args.questions} peers={args.peers}")
+    cases = [
+        (2, "agent_answers", make_values(STAGE_1_MERGED, "agent_answers", args.questions, args.peers)),
+        (3, "agent_opinion", make_values(STAGE_2_MERGED, "agent_opinion", args.questions, args.peers)),
+    ]
+    for stage, field, values in cases:
+        results = []
+        for name, build in [("wide", legacy_build), ("sparse", sparse_build)]:
+            elapsed, nbytes, files = measure(lambda: build(values, field), args.repeats)
+            results.append(
+                f"{name} {elapsed * 1e3:.0f} ms, {nbytes / 2**20:.1f} MiB, {files} cache files"
+            )
+        samples_fn = getattr(generate_prompts, f"get_stage{stage}_samples")
+        elapsed, _, _ = measure(lambda: samples_fn(copy.deepcopy(values))[0], args.repeats)
+        results.append(f"get_stage{stage}_samples {elapsed * 1e3:.0f} ms")
+        print(f"stage{stage}: " + ", ".join(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Latency, payload size, beam size and empty-result counts of DHT operations,
+by operation and key family (the key prefixes in dht_utils).
+
+InstrumentedDHT records every get and store made through it, and the batched
+lookups of dht_utils.get_dht_values key by key, each with the latency of its
+batch. Wrap a DHT once where it is created; everything else is passed through.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable
+
+from hivemind_exp.dht_utils import KEY_FAMILIES, batch_get_args
+from hivemind_exp.outputs_cache import approx_size
+
+if TYPE_CHECKING:
+    from hivemind.dht import DHT
+
+# Upper bounds of the latency histogram buckets; slower calls go in an extra one.
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+METRICS_LOG_INTERVAL = 300  # Seconds.
+
+
+def key_family(key: Any) -> str:
+    key = str(key)
+    for prefix in KEY_FAMILIES:
+        if key == prefix or key.startswith(prefix + "_"):
+            return prefix
+    return "other"
+
+
+def payload_size(value: Any) -> int:
+    """approx_size of a value, unwrapping the DHT's ValueWithExpiration."""
+    if hasattr(value, "expiration_time"):
+        return payload_size(value.value)
+    if isinstance(value, dict):
+        return sum(approx_size(k) + payload_size(v) for k, v in value.items())
+    return 0 if value is None else approx_size(value)
+
+
+@dataclass
+class OpStats:
+    count: int = 0
+    empty: int = 0  # Gets that found nothing; stores the DHT rejected.
+    errors: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    latency: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS_MS) + 1))
+    beam_sizes: Counter = field(default_factory=Counter)
+
+    def add(self, seconds, nbytes, empty, error, beam_size):
+        self.count += 1
+        self.empty += empty
+        self.errors += error
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        ms = seconds * 1000
+        self.latency[next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if ms <= b), -1)] += 1
+        self.beam_sizes[beam_size] += 1
+
+    def quantile_ms(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile."""
+        seen = 0
+        for i, n in enumerate(self.latency):
+            seen += n
+            if n and seen >= q * self.count:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else self.max_seconds * 1000
+        return 0.0
+
+    def rollup(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "empty": self.empty,
+            "empty_rate": self.empty / self.count if self.count else 0.0,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "mean_ms": self.seconds * 1000 / self.count if self.count else 0.0,
+            "p50_ms": self.quantile_ms(0.5),
+            "p95_ms": self.quantile_ms(0.95),
+            "max_ms": self.max_seconds * 1000,
+            "beam_sizes": dict(self.beam_sizes),
+        }
+
+
+class DHTMetrics:
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self._stats: dict[tuple[str, str], OpStats] = defaultdict(OpStats)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        op: str,
+        key: Any,
+        seconds: float,
+        nbytes: int = 0,
+        empty: bool = False,
+        error: bool = False,
+        beam_size: int | None = None,
+    ):
+        with self._lock:
+            self._stats[(op, key_family(key))].add(seconds, nbytes, empty, error, beam_size)
+
+    def rollup(self, reset=False) -> dict[str, dict[str, dict[str, Any]]]:
+        """Stats by operation and key family, since creation or the last reset."""
+        result = defaultdict(dict)
+        with self._lock:
+            for (op, family), stats in sorted(self._stats.items()):
+                result[op][family] = stats.rollup()
+            if reset:
+                self._stats.clear()
+        return dict(result)
+
+    def log(self, logger: logging.Logger, reset=True):
+        """One line per operation and key family, with the rollup as `extra`."""
+        for op, families in self.rollup(reset=reset).items():
+            for family, stats in families.items():
+                logger.info(
+                    f"DHT {op} {family}: {stats['count']} calls, p50 {stats['p50_ms']:.0f} ms, "
+                    f"p95 {stats['p95_ms']:.0f} ms, {stats['empty_rate']:.0%} empty, "
+                    f"{stats['bytes']} bytes",
+                    extra={"dht_op": op, "key_family": family, **stats},
+                )
+
+    def start_logging(
+        self, logger: logging.Logger, interval: float = METRICS_LOG_INTERVAL
+    ) -> threading.Thread:
+        """Logs (and resets) the rollup every `interval` seconds from a daemon thread."""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.log(logger)
+
+        thread = threading.Thread(target=run, name="dht-metrics", daemon=True)
+        thread.start()
+        return thread
+
+
+dht_metrics = DHTMetrics()
+
+
+class InstrumentedDHT:
+    """
+    Wraps a hivemind DHT, recording its get and store calls (and batched gets
+    from dht_utils) into `metrics`.
+    """
+
+    def __init__(self, dht: "DHT", metrics: DHTMetrics = dht_metrics):
+        self.dht = dht
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set here. copy and pickle look up
+        # dunders on an instance whose __init__ has not run, without self.dht.
+        if name == "dht" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.dht, name)
+
+    def get(self, key, latest=False, return_future=False, **kwargs):
+        if return_future:
+            return self.dht.get(key, latest, return_future, **kwargs)
+        start = self.metrics.clock()
+        result, error = None, True
+        try:
+            result = self.dht.get(key, latest, **kwargs)
+            error = False
+            return result
+        finally:
+            self.metrics.record(
+                "get",
+                key,
+                self.metrics.clock() - start,
+                payload_size(result),
+                empty=not error and result is None,
+                error=error,
+                beam_size=kwargs.get("beam_size"),
+            )
+
+    def store(self, key, value, expiration_time, subkey=None, return_future=False, **kwargs):
+        if return_future:
+            return self.dht.store(key, value, expiration_time, subkey, return_future, **kwargs)
+        start = self.metrics.clock()
+        result, error = None, True
+        try:
+            result = self.dht.store(key, value, expiration_time, subkey, **kwargs)
+            error = False
+            return result
+        finally:
+            self.metrics.record(
+                "store",
+                key,
+                self.metrics.clock() - start,
+                payload_size(value),
+                empty=not error and not result,
+                error=error,
+            )
+
+    def run_coroutine(self, coro, return_future=False):
+        args = batch_get_args(coro)
+        if return_future or args is None:
+            return self.dht.run_coroutine(coro, return_future)
+        start = self.metrics.clock()
+        wrappers, error = {}, True
+        try:
+            wrappers = self.dht.run_coroutine(coro)
+            error = False
+            return wrappers
+        finally:
+            seconds = self.metrics.clock() - start
+            for key in args["keys"]:
+                wrapper = wrappers.get(key)
+                self.metrics.record(
+                    "get_many",
+                    key,
+                    seconds,
+                    payload_size(wrapper),
+                    empty=not error and wrapper is None,
+                    error=error,
+                    beam_size=args["beam_size"],
+                )
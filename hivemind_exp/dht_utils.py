@@ -1,11 +1,21 @@
+import asyncio
 import hashlib
-from functools import lru_cache
-from typing import Any
-
-from hivemind.dht import DHT
-from hivemind.utils import ValueWithExpiration
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Hashable, Sequence
 
 from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.outputs_cache import blob_cache, outputs_cache
+from hivemind_exp.outputs_codec import blob_digest, blob_refs, decode_outputs, expand_blobs
+
+if TYPE_CHECKING:
+    # hivemind pulls in torch; key helpers here are also used by the web server.
+    from hivemind.dht import DHT, DHTNode
+
+DHT_BATCH_TIMEOUT = 30  # Seconds; keys not found by then are returned as None.
+BLOB_LOOKUP_TIMEOUT = 2  # Seconds; publish_blobs() waits this long for existing copies.
 
 ROUND_STAGE_NUMBER_KEY = "rl_swarm_rs"  # No subkeys. Coordinator publishes.
 
@@ -18,6 +28,22 @@ REWARDS_KEY = "rl_swarm_rewards"  # Subkey = Metric. Everyone publishes.
 # Node key, round, and stage (e.g. abcde_0_0) appended.
 OUTPUTS_KEY_PREFIX = "rl_swarm_outputs"  # Subkey = Example Hash. Everyone publishes.
 
+# Text digest appended.
+BLOB_KEY_PREFIX = "rl_swarm_blob"  # No subkeys. First writer publishes.
+# Seconds a newly published blob outlives the outputs referencing it; it is
+# republished when newer outputs would outlive it.
+BLOB_EXPIRATION_SLACK = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+KEY_FAMILIES = (
+    ROUND_STAGE_NUMBER_KEY,
+    LEADERBOARD_KEY_PREFIX,
+    REWARDS_KEY,
+    OUTPUTS_KEY_PREFIX,
+    BLOB_KEY_PREFIX,
+)
+
 
 def leaderboard_key(round_num, stage) -> str:
     return f"{LEADERBOARD_KEY_PREFIX}_{round_num}_{stage}"
@@ -35,20 +61,27 @@ def node_outputs_key(node: HivemindNode) -> str:
     return outputs_key(node.key, node.round_num, node.stage_num)
 
 
+def blob_key(digest: str) -> str:
+    return f"{BLOB_KEY_PREFIX}_{digest}"
+
+
 def hash_keys(outputs):
-    # Handles older versions of the trainer that did not hash question keys.
+    # Handles older versions of the trainer that did not hash question keys,
+    # or published outputs without outputs_codec.
     result = {}
     for k, v in outputs.items():
         if len(k) != 32:  # Not perfect, but good enough.
             k = hashlib.md5(k.encode()).hexdigest()
-        result[k] = v
+        try:
+            result[k] = decode_outputs(v)
+        except ValueError:
+            continue  # Encoded by a newer peer.
 
     return result
 
 
-@lru_cache
 def get_outputs(
-    dht: DHT, node_key: str, r, s, get_cached_fn=None
+    dht: "DHT", node_key: str, r, s, get_cached_fn=None, refresh=False
 ) -> dict[str, tuple[float, dict]]:  # Q: (timestamp, outputs)
     # Try provided cache function first.
     if get_cached_fn:
@@ -56,16 +89,60 @@ def get_outputs(
             return hash_keys(outputs)
 
     # Try from DHT next to include peered outputs.
+    key = (node_key, r, s)
+    if not refresh and (outputs := outputs_cache.get(key)) is not None:
+        return outputs
     if outputs := get_dht_value(dht, key=outputs_key(node_key, r, s), latest=False):
-        return hash_keys(outputs)
+        outputs = hash_keys(outputs)
+        resolved = resolve_blobs(dht, {key: outputs})[key]
+        if len(resolved) == len(outputs):  # Texts not found yet are looked up again next time.
+            outputs_cache.put(key, resolved)
+        return resolved
 
     raise ValueError(
         f"could not retrieve stage outputs for {node_key} at round {r} stage {s}"
     )
 
 
+def get_outputs_many(
+    dht: "DHT",
+    node_keys: Sequence[str],
+    r,
+    s,
+    refresh=False,
+    timeout: float = DHT_BATCH_TIMEOUT,
+) -> dict[str, dict[str, tuple[float, dict]]]:
+    """
+    get_outputs for many peers, with one DHT lookup for all that are not
+    cached. Peers without outputs (or not found in time) are left out.
+    """
+    deadline = time.monotonic() + timeout
+    results = {}
+    missing = []
+    for node_key in node_keys:
+        cached = None if refresh else outputs_cache.get((node_key, r, s))
+        if cached is not None:
+            results[node_key] = cached
+        else:
+            missing.append(node_key)
+
+    keys = {outputs_key(node_key, r, s): node_key for node_key in missing}
+    fetched = {
+        keys[key]: hash_keys(outputs)
+        for key, outputs in get_dht_values(dht, list(keys), timeout=timeout).items()
+        if outputs
+    }
+    timeout = max(deadline - time.monotonic(), 0)
+    for node_key, outputs in resolve_blobs(dht, fetched, timeout=timeout).items():
+        if len(outputs) == len(fetched[node_key]):
+            outputs_cache.put((node_key, r, s), outputs)
+        if outputs:
+            results[node_key] = outputs
+    return {k: results[k] for k in node_keys if k in results}
+
+
 def get_round_and_stage(
-    dht: DHT,
+    dht: "DHT",
 ) -> tuple[int, int]:
     value = get_dht_value(dht, key=ROUND_STAGE_NUMBER_KEY, latest=True)
     if not value:
@@ -75,8 +152,9 @@ def get_round_and_stage(
     return round_num, stage
 
 
-def get_dht_value(dht: DHT, **kwargs) -> Any | None:
-    wrapper = dht.get(**kwargs)
+def unwrap_dht_value(wrapper) -> Any | None:
+    from hivemind.utils import ValueWithExpiration
+
     if not wrapper:
         return None
 
@@ -86,3 +164,161 @@ def get_dht_value(dht: DHT, **kwargs) -> Any | None:
         # Subkeys exist; unwrap ValueWithExpiration.
         return {k: v.value for k, v in value.items()}
     return value
+
+
+def get_dht_value(dht: "DHT", **kwargs) -> Any | None:
+    return unwrap_dht_value(dht.get(**kwargs))
+
+
+async def _get_many(
+    _dht: "DHT",
+    node: "DHTNode",
+    keys: tuple,
+    latest: bool,
+    beam_size: int | None,
+    timeout: float,
+) -> dict:
+    # Runs inside the DHT process: one traversal for all keys, sharing the
+    # nearest peers found for one key with the others.
+    futures = await node.get_many(
+        keys,
+        sufficient_expiration_time=float("inf") if latest else None,
+        beam_size=beam_size,
+        return_futures=True,
+    )
+    done, pending = await asyncio.wait(futures.values(), timeout=timeout)
+    for future in pending:
+        future.cancel()  # Stops the search for that key.
+    return {
+        key: future.result()
+        for key, future in futures.items()
+        if future in done and not future.cancelled() and future.exception() is None
+    }
+
+
+def get_dht_values(
+    dht: "DHT",
+    keys: Sequence[Hashable],
+    latest: bool = False,
+    beam_size: int | None = None,
+    timeout: float = DHT_BATCH_TIMEOUT,
+) -> dict[Hashable, Any | None]:
+    """
+    get_dht_value for many keys in one DHT traversal. Keys not found within
+    `timeout` seconds map to None.
+    """
+    keys = tuple(dict.fromkeys(keys))
+    wrappers = _get_dht_wrappers(dht, keys, latest, beam_size, timeout)
+    return {key: unwrap_dht_value(wrappers.get(key)) for key in keys}
+
+
+def batch_get_args(coro) -> dict[str, Any] | None:
+    """
+    The arguments (keys, latest, beam_size, timeout) of a batched lookup that
+    get_dht_values() passes to dht.run_coroutine(), or None for any other
+    coroutine. Lets DHT wrappers (see dht_metrics) tell the lookups apart.
+    """
+    if isinstance(coro, partial) and coro.func is _get_many:
+        return coro.keywords
+    return None
+
+
+def _get_dht_wrappers(dht, keys, latest=False, beam_size=None, timeout=DHT_BATCH_TIMEOUT):
+    if not keys:
+        return {}
+    return dht.run_coroutine(
+        partial(_get_many, keys=tuple(keys), latest=latest, beam_size=beam_size, timeout=timeout)
+    )
+
+
+def publish_blobs(
+    dht: "DHT",
+    blobs: dict[str, str],
+    expiration_time: float,
+    timeout: float = BLOB_LOOKUP_TIMEOUT,
+):
+    """
+    Publishes texts by digest (see outputs_codec.extract_blobs) for outputs
+    expiring at `expiration_time`. First writer wins: texts already in the
+    DHT until then are not stored again. Only the lookup of existing copies
+    blocks, for up to `timeout`; texts not found by then are stored without
+    waiting for the stores to complete.
+    """
+    stale = [d for d in blobs if blob_cache.expiration(d) < expiration_time]
+    wrappers = _get_dht_wrappers(dht, [blob_key(d) for d in stale], timeout=timeout)
+    for digest in stale:
+        wrapper = wrappers.get(blob_key(digest))
+        if wrapper is not None and wrapper.expiration_time >= expiration_time:
+            blob_cache.put(digest, blobs[digest], wrapper.expiration_time)
+            continue
+        blob_expiration = expiration_time + BLOB_EXPIRATION_SLACK
+        dht.store(
+            key=blob_key(digest),
+            value=blobs[digest],
+            expiration_time=blob_expiration,
+            return_future=True,
+        )
+        blob_cache.put(digest, blobs[digest], blob_expiration)
+
+
+# One publish at a time, so each sees the blob_cache updates of the last.
+_blob_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob-publisher")
+
+
+def _log_publish_error(future: Future):
+    if (e := future.exception()) is not None:
+        logger.warning(f"Failed to publish blobs: {e!r}")
+
+
+def publish_blobs_async(dht: "DHT", blobs: dict[str, str], expiration_time: float) -> Future:
+    """
+    publish_blobs() on a background thread, for callers that must not wait
+    on the DHT (e.g. training steps). Peers skip outputs whose texts they
+    can't find yet and fetch them again later.
+    """
+    future = _blob_publisher.submit(publish_blobs, dht, blobs, expiration_time)
+    future.add_done_callback(_log_publish_error)
+    return future
+
+
+def resolve_blobs(
+    dht: "DHT",
+    outputs_by_key: dict[Hashable, dict[str, tuple[float, dict]]],
+    timeout: float = DHT_BATCH_TIMEOUT,
+) -> dict[Hashable, dict[str, tuple[float, dict]]]:
+    """
+    Expands the blob references in decoded outputs, e.g. keyed by peer.
+    Texts not in blob_cache are looked up in one batch; outputs entries
+    referencing texts that are not found (or don't match their digest) are
+    left out.
+    """
+    digests = set().union(*map(blob_refs, outputs_by_key.values()))
+    if not digests:
+        return outputs_by_key
+
+    texts = {}
+    missing = []
+    for digest in digests:
+        if (text := blob_cache.get(digest)) is not None:
+            texts[digest] = text
+        else:
+            missing.append(digest)
+    wrappers = _get_dht_wrappers(dht, [blob_key(d) for d in missing], timeout=timeout)
+    for digest in missing:
+        wrapper = wrappers.get(blob_key(digest))
+        if wrapper is not None and isinstance(wrapper.value, str):
+            if blob_digest(wrapper.value) == digest:
+                texts[digest] = wrapper.value
+                blob_cache.put(digest, wrapper.value, wrapper.expiration_time)
+    return {k: expand_blobs(outputs, texts) for k, outputs in outputs_by_key.items()}
+
+
+def get_dht_versions(dht: "DHT", **kwargs) -> dict[Any, float]:
+    """
+    Expiration time of each subkey under a key. Storing a subkey again moves
+    it forward, so it tells whether a peer has published since.
+    """
+    wrapper = dht.get(**kwargs)
+    if not wrapper or not isinstance(wrapper.value, dict):
+        return {}
+    return {k: v.expiration_time for k, v in wrapper.value.items()}
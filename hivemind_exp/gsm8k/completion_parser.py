@@ -0,0 +1,152 @@
+import re
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+
+# A count rule pattern is a single tag with optional leading/trailing newlines,
+# e.g. "\n</answer>\n". This covers every str.count() the reward functions use.
+_RULE_PATTERN = re.compile(r"^(\n?)<(/?)(\w+)>(\n?)$")
+
+PARSE_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class _Rule:
+    tag: str
+    is_close: bool
+    lead: int
+    trail: int
+
+    @staticmethod
+    def from_pattern(pattern: str) -> "_Rule":
+        m = _RULE_PATTERN.match(pattern)
+        if not m:
+            raise ValueError(f"unsupported count pattern: {pattern!r}")
+        lead, close, tag, trail = m.groups()
+        return _Rule(tag, bool(close), len(lead), len(trail))
+
+
+class XmlSchema:
+    """
+    Describes the XML response format of a single stage.
+
+    count_rules mirrors the old count_xml() implementations: each entry is
+    (pattern, tail_pattern, tail_offset). A pattern that occurs exactly once adds
+    0.125; if tail_pattern is set, (len(text.split(tail_pattern)[-1]) - tail_offset)
+    * 0.001 is then subtracted to penalise trailing garbage.
+    """
+
+    def __init__(
+        self,
+        tags: tuple[str, ...],
+        count_rules: tuple[tuple[str, str | None, int], ...],
+        strict_pattern: str,
+        soft_pattern: str,
+    ):
+        self.tags = tags
+        self.count_rules = tuple(
+            (
+                _Rule.from_pattern(pattern),
+                _Rule.from_pattern(tail) if tail else None,
+                offset,
+            )
+            for pattern, tail, offset in count_rules
+        )
+        self.strict = re.compile(strict_pattern)
+        self.soft = re.compile(soft_pattern)
+        self.tag_re = re.compile(
+            "<(/?)(" + "|".join(re.escape(t) for t in tags) + ")>"
+        )
+
+
+@dataclass
+class ParsedCompletion:
+    text: str
+    # Tag: sorted (start, end) spans of every <tag> / </tag> occurrence.
+    opens: dict[str, list[tuple[int, int]]]
+    closes: dict[str, list[tuple[int, int]]]
+    # Rule pattern: (non-overlapping count, end of last counted match).
+    counts: dict[_Rule, tuple[int, int]]
+    xml_count: float
+    strict: bool
+    soft: bool
+
+    def count(self, rule: _Rule) -> int:
+        return self.counts[rule][0]
+
+    def tail(self, rule: _Rule) -> int:
+        """Equivalent to len(text.split(pattern)[-1])."""
+        n, last_end = self.counts[rule]
+        return len(self.text) - last_end if n else len(self.text)
+
+    def extract(self, tag: str) -> str:
+        """Equivalent to text.split("<tag>")[-1].split("</tag>")[0].strip()."""
+        opens = self.opens[tag]
+        start = opens[-1][1] if opens else 0
+        return self.text[start : self._close_before(tag, start, len(self.text))].strip()
+
+    def extract_all(self, tag: str) -> list[str]:
+        """Equivalent to [s.split("</tag>")[0].strip() for s in text.split("<tag>")[1:]]."""
+        opens = self.opens[tag]
+        result = []
+        for i, (_, start) in enumerate(opens):
+            stop = opens[i + 1][0] if i + 1 < len(opens) else len(self.text)
+            result.append(self.text[start : self._close_before(tag, start, stop)].strip())
+        return result
+
+    def _close_before(self, tag, start, stop) -> int:
+        closes = self.closes[tag]
+        i = bisect_left(closes, (start, start))
+        if i < len(closes) and closes[i][0] < stop:
+            return closes[i][0]
+        return stop
+
+
+def _count(text: str, spans: list[tuple[int, int]], rule: _Rule) -> tuple[int, int]:
+    # Same leftmost, non-overlapping semantics as str.count / str.split.
+    n, last_end = 0, 0
+    for start, end in spans:
+        if rule.lead and (start == 0 or text[start - 1] != "\n"):
+            continue
+        if rule.trail and (end >= len(text) or text[end] != "\n"):
+            continue
+        if start - rule.lead < last_end:
+            continue
+        n, last_end = n + 1, end + rule.trail
+    return n, last_end
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_completion(text: str, schema: XmlSchema) -> ParsedCompletion:
+    """Scans text once for the schema's tags and derives every reward feature."""
+    opens: dict[str, list[tuple[int, int]]] = {t: [] for t in schema.tags}
+    closes: dict[str, list[tuple[int, int]]] = {t: [] for t in schema.tags}
+    for m in schema.tag_re.finditer(text):
+        (closes if m.group(1) else opens)[m.group(2)].append(m.span())
+
+    counts = {}
+    for rules in schema.count_rules:
+        for rule in rules[:2]:
+            if rule and rule not in counts:
+                spans = closes[rule.tag] if rule.is_close else opens[rule.tag]
+                counts[rule] = _count(text, spans, rule)
+
+    parsed = ParsedCompletion(
+        text=text,
+        opens=opens,
+        closes=closes,
+        counts=counts,
+        xml_count=0.0,
+        strict=schema.strict.match(text) is not None,
+        soft=schema.soft.match(text) is not None,
+    )
+
+    # Keep the original accumulation order so scores are bit-for-bit identical.
+    count = 0.0
+    for rule, tail, offset in schema.count_rules:
+        if parsed.count(rule) == 1:
+            count += 0.125
+            if tail:
+                count -= (parsed.tail(tail) - offset) * 0.001
+    parsed.xml_count = count
+    return parsed
@@ -1,12 +1,27 @@
 #For geting top-k ranking for subsampling
 import hashlib
+import heapq
+import logging
 import os
 import random
+import threading
+from functools import lru_cache
 
 from datasets import Dataset, load_dataset
+from datasets.fingerprint import generate_random_fingerprint
+from datasets.table import InMemoryTable
 
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
 import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+from hivemind_exp.gsm8k.stage1_cache import (
+    cache_key,
+    load_stage1_splits,
+    resolve_revision,
+    stage1_cache_dir,
+    stage1_refresh,
+)
+
+logger = logging.getLogger(__name__)
 
 #############################################################################################################
 # TODO: Lots of repitition across stages, so would be good to fold them into one another and simplify things.#
@@ -72,6 +87,10 @@ PROMPT_ROLES = {
 }
 
 
+# Resolved to a commit (once, then recorded) before keying the stage 1 cache; a pinned commit is used as is.
+GSM8K_REVISION = "main"
+
+
 def extract_hash_answer(text: str) -> str | None:
     if "####" not in text:
         return None
@@ -91,125 +110,347 @@ def generate_system_prompt(default_sys_prompt):
         return default_sys_prompt
 
 
-def stage2_generator(values):
-    # TODO: A bit hacky/ugly. Should come back and clean up a bit
-    for val in values:
-        output = {}
-        for field in val:
-            if field not in ["agent_answers"]:
-                output[field] = val[field]
-            else:
-                for subfield in val[field]:
-                    output[f"{field}_{subfield}"] = val[field][subfield]
-        yield output
+# Per-agent fields of stage outputs. In stage datasets each is a list of
+# {"agent": ..., "text": ...} entries holding only the agents that answered
+# that question, instead of one column per agent in the swarm.
+AGENT_FIELDS = ("agent_answers", "agent_opinion")
 
 
-def stage3_generator(values):
-    # TODO: A bit hacky/ugly. Should come back and clean up a bit
+def stage_generator(values):
     for val in values:
         output = {}
         for field in val:
-            if field not in {"agent_answers", "agent_opinion"}:
-                output[field] = val[field]
+            if field in AGENT_FIELDS:
+                output[field] = [
+                    {"agent": agent, "text": text} for agent, text in val[field].items()
+                ]
             else:
-                for subfield in val[field]:
-                    output[f"{field}_{subfield}"] = val[field][subfield]
+                output[field] = val[field]
         yield output
 
 
-def sorted_agent_ids(cols, prefix):
-    # Undos the _ encoding.
-    agent_ids = []
-    for c in cols:
-        if c.startswith(prefix):
-            agent_ids.append(c[len(prefix) :])
-    agent_ids.sort(reverse=False)
-    return agent_ids
+def agent_texts(datum, field):
+    """{agent: text} for one row of a stage dataset."""
+    entries = datum.get(field) or []
+    if isinstance(entries, dict):
+        # Older datasets versions return list-of-struct columns as a struct of lists.
+        return dict(zip(entries["agent"], entries["text"]))
+    return {e["agent"]: e["text"] for e in entries}
+
+
+def in_memory_dataset(rows):
+    # Stage 2/3 datasets are rebuilt every stage of every round. Building them
+    # as an in-memory Arrow table skips the Arrow cache files, generator
+    # fingerprinting and from_dict's per-value type inference.
+    rows = list(rows)
+    if not rows:
+        # Dataset.from_generator failed here too; callers rely on it.
+        raise ValueError("No samples to build a stage dataset from")
+    columns = {}
+    for row in rows:
+        for field in row:
+            columns.setdefault(field, None)
+    columns = {field: [row.get(field) for row in rows] for field in columns}
+    return Dataset(InMemoryTable.from_pydict(columns))
 
 
 # Generating unique student ids here to ensure consistency in future rounds with the same agents.
 # TODO: Currently assumes number of respondents is the same across rounds. We should loosen this requirement, but need to think of a way to reasonably add a "name"/id our models can be expected to "remember"...
-def get_unique_student_ids(cols):
-    return {a: i for i, a in enumerate(sorted_agent_ids(cols, "agent_answers_"))}
+def get_unique_student_ids(agent_ids):
+    return {a: i for i, a in enumerate(sorted(agent_ids))}
+
+def get_unique_critic_ids(agent_ids):
+    return {a: i for i, a in enumerate(sorted(agent_ids))}
+
+@lru_cache(maxsize=4096)
+def column_tiebreaker(col):
+    #Agent column names repeat across rows (and rounds), so each is hashed once.
+    return hashlib.md5(str.encode(col)).hexdigest()
+
+# Per-answer prompt overhead besides the answer text itself, see generate_stage{2,3}_user_prompt.
+FRAGMENT_TEMPLATES = {
+    2: "<student>Student #0</student> said \n\n\n\n",
+    3: "<criticism>Criticism #0</criticism> was \n\n\n\n",
+}
 
-def get_unique_critic_ids(cols):
-    return {a: i for i, a in enumerate(sorted_agent_ids(cols, "agent_opinion_"))}
 
-def pick_k_cols(cols, datum, current_stage, default_k=15, method='top_k'):
-    #Filter columns according to current round
+STAGE_SYSTEM_PROMPTS = {2: STAGE2_SYSTEM_PROMPT, 3: STAGE3_SYSTEM_PROMPT}
+
+
+class PromptBudget:
+    """
+    Per-stage token budgets for the answers (stage 2) and critiques (stage 3)
+    packed into a prompt, measured with the training tokenizer.
+
+    With `max_prompt_length`, a prompt's budget is what is left of it after
+    the parts every answer comes with: the system prompt and chat template,
+    and the prompt's header (the question; in stage 3, the stage-2 prompt).
+    Explicit `budgets` cap that further. Without a tokenizer, or for a stage
+    without either, pick_k_cols takes its k candidates as before. Packing
+    statistics accumulate per stage until log_stats is called.
+    """
+
+    def __init__(
+        self, tokenizer=None, budgets: dict[int, int] | None = None, max_prompt_length: int = 0
+    ):
+        self.tokenizer = tokenizer
+        self.budgets = {s: b for s, b in (budgets or {}).items() if b and b > 0}
+        self.max_prompt_length = max_prompt_length or 0
+        self._count = lru_cache(maxsize=4096)(self._tokens)
+        self._system_tokens: dict[int, int] = {}
+        self.reset_stats()
+
+    def _tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def system_tokens(self, stage) -> int:
+        """Tokens of the stage's system prompt and chat template around an empty user message."""
+        if stage not in self._system_tokens:
+            sys_prompt = generate_system_prompt(STAGE_SYSTEM_PROMPTS[stage])
+            if getattr(self.tokenizer, "chat_template", None):
+                messages = [
+                    {"role": "system", "content": sys_prompt},
+                    {"role": "user", "content": ""},
+                ]
+                tokens = len(
+                    self.tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+                )
+            else:
+                tokens = self._count(sys_prompt)
+            self._system_tokens[stage] = tokens
+        return self._system_tokens[stage]
+
+    def limits(self, stage) -> bool:
+        return self.tokenizer is not None and (stage in self.budgets or self.max_prompt_length > 0)
+
+    def budget(self, stage, header="") -> float:
+        """Answer tokens a prompt starting with `header` has room for."""
+        budget = self.budgets.get(stage, float("inf"))
+        if self.max_prompt_length > 0:
+            fixed = self.system_tokens(stage) + self._count(header)
+            budget = min(budget, self.max_prompt_length - fixed)
+        return budget
+
+    def pack(self, stage, ranked, texts, k, header=""):
+        """Greedily takes up to k of `ranked` (best first) that fit the prompt's budget."""
+        budget = self.budget(stage, header)
+        overhead = self._count(FRAGMENT_TEMPLATES[stage])
+        picked, used = [], 0
+        for agent in ranked:
+            if len(picked) == k:
+                break
+            cost = self._count(texts[agent]) + overhead
+            if used + cost <= budget:
+                picked.append(agent)
+                used += cost
+
+        stats = self.stats.setdefault(stage, dict.fromkeys(("prompts", "truncated", "answers", "tokens"), 0))
+        stats["prompts"] += 1
+        stats["truncated"] += len(picked) < min(k, len(ranked))
+        stats["answers"] += len(picked)
+        stats["tokens"] += used
+        return picked
+
+    def reset_stats(self):
+        self.stats: dict[int, dict[str, int]] = {}
+
+    def log_stats(self, stage):
+        stats = self.stats.pop(stage, None)
+        if not stats:
+            return
+        n = stats["prompts"]
+        logger.info(
+            f"Stage {stage} prompt packing: {stats['truncated']}/{n} prompts hit their "
+            f"token budget; {stats['answers'] / n:.1f} answers "
+            f"and {stats['tokens'] / n:.0f} tokens per prompt"
+        )
+
+
+prompt_budget = PromptBudget()
+
+
+def set_prompt_budget(tokenizer, budgets: dict[int, int], max_prompt_length: int = 0):
+    """
+    Per-stage answer token budgets, e.g. {2: 192, 3: 192}; 0 disables a stage's
+    budget. With max_prompt_length, prompts are packed to fit it.
+    """
+    global prompt_budget
+    prompt_budget = PromptBudget(tokenizer, budgets, max_prompt_length)
+    prompt_fragments.clear()
+
+
+def pick_k_cols(datum, current_stage, default_k=15, method='top_k', budget=None, header=""):
+    #Pick the agents whose answers (stage 2) or opinions (stage 3) go into the prompt after `header`
+    if budget is None:
+        budget = prompt_budget
     if current_stage == 2:
-        prefix = 'agent_answers'
+        field = 'agent_answers'
     elif current_stage == 3:
-        prefix = 'agent_opinion'
-    valid_cols = [c for c in cols if c.startswith(prefix)]
+        field = 'agent_opinion'
+    texts = agent_texts(datum, field)
+    agents = list(texts)
     #Set k to appropriate length if too large
-    k = min(default_k, len(valid_cols))
+    k = min(default_k, len(agents))
     #Subsample according to chosen method
     if method == 'uniform_random':
-        #Random sample k cols without replacement
-        subsampled_cols = random.sample(valid_cols, k)
-    elif method == 'top_k': #TODO: Clean this up. Super ugly way of doing this, but too jet-lagged to optimize...
-        #Find total reward per answer and map in dict for easy sorting/filtering
-        question, completions, answer = [[{'content':datum['question']}]], [[{'content':datum[c]}] for c in valid_cols], [datum['answer'] for _ in valid_cols] #Weird formatting is for compatability with stage reward functions
-        if current_stage == 2:
-            total_rewards = stage1_rewards.top_k_cumulative_reward(question, completions, answer)
-        elif current_stage == 3:
-            total_rewards = stage2_rewards.top_k_cumulative_reward(question, completions, answer)
-        reward_per_col = {c:{} for c in valid_cols}
-        for idx,c in enumerate(valid_cols):
-            #First hash column name for tiebreaker. Note: Only needed in experimental setting since we don't have a consistent numerical ID per model output.
-            hash_fxn = hashlib.md5()
-            hash_fxn.update(str.encode(c))
-            reward_per_col[c]['tiebreaker'] = int(hash_fxn.hexdigest(),16)
-            #Add reward for this answer
-            reward_per_col[c]['reward'] = total_rewards[idx]
-        #Pick top k and resolve ties deterministically using the hashed tiebreakers
-        to_sort = [(reward_per_col[c]['reward'], reward_per_col[c]['tiebreaker'], c) for c in reward_per_col]
-        to_sort.sort(key=lambda x: (x[0], x[1], x[2]))
-        _, _, valid_cols = zip(*to_sort)
-        subsampled_cols = valid_cols[-k:]
+        #Random sample k agents without replacement
+        if budget.limits(current_stage):
+            subsampled_cols = budget.pack(current_stage, random.sample(agents, len(agents)), texts, k, header)
+        else:
+            subsampled_cols = random.sample(agents, k)
+    elif method == 'top_k':
+        #Find total reward per answer
+        question, completions, answer = [[{'content':datum['question']}]], [[{'content':texts[a]}] for a in agents], [datum['answer'] for _ in agents] #Weird formatting is for compatability with stage reward functions
+        total_rewards = []
+        if agents:
+            if current_stage == 2:
+                total_rewards = stage1_rewards.top_k_cumulative_reward(question, completions, answer)
+            elif current_stage == 3:
+                total_rewards = stage2_rewards.top_k_cumulative_reward(question, completions, answer)
+        scores = dict(zip(agents, total_rewards))
+        #Pick top k and resolve ties deterministically using hashed (per-agent column) names. Note: Only needed in experimental setting since we don't have a consistent numerical ID per model output.
+        key = lambda a: (scores[a], column_tiebreaker(f"{field}_{a}"), a)
+        if budget.limits(current_stage):
+            #Best answers first, skipping any that no longer fit the token budget
+            top = budget.pack(current_stage, sorted(agents, key=key, reverse=True), texts, k, header)
+        else:
+            top = heapq.nlargest(k, agents, key=key)
+        subsampled_cols = tuple(reversed(top))
     return subsampled_cols
 
-def generate_stage2_user_prompt(datum, cols):
-    sp = []
-    sp.append(f"The question we were given is: {datum['question']}" + "  \n\n")
-    sp.append(f"The following answers to this question were suggested:" + " \n")
-    subsampled_cols = pick_k_cols(cols, datum, 2) #Subsample columns to stop prompt bloating
-    agentID_to_studentID = get_unique_student_ids(subsampled_cols)
-    for agentID in agentID_to_studentID:
-        feature = f"agent_answers_{agentID}"
-        if feature in datum:
+def question_hash(question):
+    #Same key the trainer publishes stage outputs under
+    return hashlib.md5(question.encode()).hexdigest()
+
+
+def text_digest(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+class PromptFragmentCache:
+    """
+    Rendered prompt fragments of the current round, keyed by
+    (round, stage, agent, question hash).
+
+    Each entry is tagged with what it was rendered from, including digests of
+    the answer/opinion texts, since peers republish their outputs during a
+    stage. A `<student>`/`<criticism>` fragment is rendered again only when its
+    text or number changes, however often that round's stage datasets are
+    rebuilt. The stage-2 prompt of a question is kept too (under agent None),
+    for stage 3 to build on. Starting a new round drops the previous round's
+    entries. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.round_num = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, round_num, stage, agent, q_hash, tag, render):
+        """Cached render() for the key, re-rendered if stored with a different tag."""
+        key = (round_num, stage, agent, q_hash)
+        with self._lock:
+            if round_num != self.round_num:
+                self._entries.clear()
+                self.round_num = round_num
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == tag:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Rendered unlocked: whole prompts render their fragments through here.
+        value = render()
+        with self._lock:
+            if round_num == self.round_num:
+                self._entries[key] = (tag, value)
+        return value
+
+    def lookup(self, round_num, stage, agent, q_hash):
+        with self._lock:
+            entry = self._entries.get((round_num, stage, agent, q_hash))
+        return entry[1] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.round_num = None
+
+
+prompt_fragments = PromptFragmentCache()
+
+
+def _render(fragments, round_num, stage, q_hash, agent, index, render):
+    if round_num is None:
+        return render()
+    return fragments.get(round_num, stage, agent, q_hash, index, render)
+
+
+def generate_stage2_user_prompt(datum, round_num=None, fragments=prompt_fragments):
+    #Fragments are only cached when the round is known
+    q_hash = question_hash(datum['question'])
+    answers = agent_texts(datum, "agent_answers")
+
+    def render_prompt():
+        header = (
+            f"The question we were given is: {datum['question']}" + "  \n\n"
+            + f"The following answers to this question were suggested:" + " \n"
+        )
+        subsampled_agents = pick_k_cols(datum, 2, header=header) #Subsample agents to stop prompt bloating
+        agentID_to_studentID = get_unique_student_ids(subsampled_agents)
+        sp = [header]
+        for agentID, studentID in agentID_to_studentID.items():
             sp.append(
-                f"<student>Student #{agentID_to_studentID[agentID]}</student> said \n"
+                _render(
+                    fragments, round_num, 2, q_hash, agentID,
+                    (studentID, text_digest(answers[agentID])),
+                    lambda: f"<student>Student #{studentID}</student> said \n" + answers[agentID] + "\n\n\n",
+                )
             )
-            sp.append(datum[feature])
-            sp.append("\n\n\n")
-    return "".join(sp)
-
-
-def generate_stage3_user_prompt(datum, cols):
-    sp = []
-    sp.append(f"{datum['stage2_prompt']}" + "  \n")
-    sp.append(
-        f"After comparing these answers, the following feedback was given about which answer is best:"
-        + " \n"
-    )
-    subsampled_cols = pick_k_cols(cols, datum, 3) #Subsample columns to stop prompt bloating
-    # TODO: Why is this different from shared_fs_experiments?
-    agentID_to_criticID = get_unique_critic_ids(subsampled_cols)
-    for agentID in agentID_to_criticID:
-        feature = f"agent_opinion_{agentID}"
-        if feature in datum:
+        return "".join(sp)
+
+    #The same answering agents give the same subsample, so a cached prompt skips pick_k_cols too
+    tag = tuple((agent, text_digest(text)) for agent, text in answers.items())
+    return _render(fragments, round_num, 2, q_hash, None, tag, render_prompt)
+
+
+def generate_stage3_user_prompt(datum, round_num=None, fragments=prompt_fragments):
+    q_hash = question_hash(datum['question'])
+    #Build on the stage-2 prompt as published; fall back to this node's own rendering of it this round
+    stage2_prompt = datum.get('stage2_prompt')
+    if stage2_prompt is None and round_num is not None:
+        stage2_prompt = fragments.lookup(round_num, 2, None, q_hash)
+    opinions = agent_texts(datum, "agent_opinion")
+
+    def render_prompt():
+        header = (
+            f"{stage2_prompt}"
+            + "  \n"
+            + f"After comparing these answers, the following feedback was given about which answer is best:"
+            + " \n"
+        )
+        subsampled_agents = pick_k_cols(datum, 3, header=header) #Subsample agents to stop prompt bloating
+        # TODO: Why is this different from shared_fs_experiments?
+        agentID_to_criticID = get_unique_critic_ids(subsampled_agents)
+        sp = [header]
+        for agentID, criticID in agentID_to_criticID.items():
             sp.append(
-                f"<criticism>Criticism #{agentID_to_criticID[agentID]}</criticism> was \n"
+                _render(
+                    fragments, round_num, 3, q_hash, agentID,
+                    (criticID, text_digest(opinions[agentID])),
+                    lambda: f"<criticism>Criticism #{criticID}</criticism> was \n" + opinions[agentID] + "\n\n\n",
+                )
             )
-            sp.append(datum[feature])
-            sp.append("\n\n\n")
-    return "".join(sp)
+        return "".join(sp)
 
+    tag = (stage2_prompt, tuple((agent, text_digest(text)) for agent, text in opinions.items()))
+    return _render(fragments, round_num, 3, q_hash, None, tag, render_prompt)
 
-def get_gsm8k_questions(data) -> Dataset:
-    sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
+
+def get_gsm8k_questions(data, sys_prompt=None) -> Dataset:
+    if sys_prompt is None:
+        sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
 
     data = data.map(
         lambda x: {
@@ -223,91 +464,86 @@ def get_gsm8k_questions(data) -> Dataset:
     return data
 
 
-def get_gsm8k_questions_with_stage1_answers(data) -> Dataset:
+def get_gsm8k_questions_with_stage1_answers(data, round_num=None) -> Dataset:
     sys_prompt = generate_system_prompt(STAGE2_SYSTEM_PROMPT)
-    cols = data.column_names
     data = data.map(
         lambda x: {  # type: ignore
             "prompt": [
                 {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": generate_stage2_user_prompt(x, cols)},
+                {"role": "user", "content": generate_stage2_user_prompt(x, round_num)},
             ],
             "answer": x["answer"],
-        }
+        },
+        # Ephemeral per-round datasets: nothing to reuse from a cache, so
+        # hashing the closure for a fingerprint is wasted work.
+        keep_in_memory=True,
+        new_fingerprint=generate_random_fingerprint(),
     )
     return data
 
 
-def get_gsm8k_questions_with_stage1and2_answers(data) -> Dataset:
+def get_gsm8k_questions_with_stage1and2_answers(data, round_num=None) -> Dataset:
     sys_prompt = generate_system_prompt(STAGE3_SYSTEM_PROMPT)
-    cols = data.column_names
     data = data.map(
         lambda x: {  # type: ignore
             "prompt": [
                 {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": generate_stage3_user_prompt(x, cols)},
+                {"role": "user", "content": generate_stage3_user_prompt(x, round_num)},
             ],
             "answer": x["answer"],
-        }
+        },
+        # Ephemeral per-round datasets: nothing to reuse from a cache, so
+        # hashing the closure for a fingerprint is wasted work.
+        keep_in_memory=True,
+        new_fingerprint=generate_random_fingerprint(),
     )
     return data
 
 
-def get_stage1_samples():
-    # Load dataset from Hugging Face Hub
+def get_stage1_samples(revision=GSM8K_REVISION):
     dataset_id = "openai/gsm8k"
-    train_dataset = load_dataset(dataset_id, "main")["train"]
-    test_dataset = load_dataset(dataset_id, "main")["test"]
-    # #TODO: Add ability to select a random subset of num_samples samples if desired
-    # if num_samples != -1:
-    #   dataset = dataset.shuffle(seed=42).select(range(num_samples))
-
-    # convert our dataset to the r1 prompt
-    train_dataset = get_gsm8k_questions(train_dataset)
-    test_dataset = get_gsm8k_questions(test_dataset)
-    return train_dataset, test_dataset
-
-
-def fill_unknown_answers_opinions(values):
-    FILLED_FIELDS = ("agent_answers", "agent_opinion")
-
-    # Collect all agent keys
-    agent_set = set()
-    for val in values:
-        for field in val:
-            if field in FILLED_FIELDS:
-                agent_set |= val[field].keys()
-
-    # Fill in empty agent_answers + agent_opinions
-    for val in values:
-        for field in val:
-            if field in FILLED_FIELDS:
-                diff_keys = agent_set - val[field].keys()
-                for agent in (
-                    diff_keys
-                ):  # Fill with default values. TODO: Decide if this is a good choice.
-                    val[field].update({agent: "No answer received..."})
-
-
-def get_stage2_samples(values, test_size=0.1):
-    fill_unknown_answers_opinions(values)
-    dataset = Dataset.from_generator(stage2_generator, gen_kwargs={"values": values})
+    sys_prompt = generate_system_prompt(STAGE1_SYSTEM_PROMPT)
+    root = stage1_cache_dir()
+    # Keyed by commit: the one recorded for the branch by the first cold start.
+    sha = resolve_revision(dataset_id, revision, root, refresh=stage1_refresh()) if root else None
+    if sha is None:
+        root = None
+
+    def build():
+        # Load dataset from Hugging Face Hub
+        dataset = load_dataset(dataset_id, "main", revision=sha or revision)
+        # #TODO: Add ability to select a random subset of num_samples samples if desired
+        # if num_samples != -1:
+        #   dataset = dataset.shuffle(seed=42).select(range(num_samples))
+
+        # convert our dataset to the r1 prompt
+        return {split: get_gsm8k_questions(dataset[split], sys_prompt) for split in ("train", "test")}
+
+    # Warm starts memory-map the prepared splits instead of downloading and mapping again.
+    key = cache_key(dataset_id, "main", sha, sys_prompt)
+    splits = load_stage1_splits(key, build, root)
+    return splits["train"], splits["test"]
+
+
+def get_stage2_samples(values, test_size=0.1, round_num=None):
+    dataset = in_memory_dataset(stage_generator(values))
     # #TODO: Add ability to select a random subset of num_samples samples if desired
     # if num_samples != -1:
     #   dataset = dataset.shuffle(seed=42).select(range(num_samples))
 
     # convert our dataset to the r1 prompt
-    dataset = get_gsm8k_questions_with_stage1_answers(dataset)
+    dataset = get_gsm8k_questions_with_stage1_answers(dataset, round_num)
+    prompt_budget.log_stats(2)
     return dataset, dataset
 
 
-def get_stage3_samples(values, test_size=0.1):
-    fill_unknown_answers_opinions(values)
-    dataset = Dataset.from_generator(stage3_generator, gen_kwargs={"values": values})
+def get_stage3_samples(values, test_size=0.1, round_num=None):
+    dataset = in_memory_dataset(stage_generator(values))
     # #TODO: Add ability to select a random subset of num_samples samples if desired
     # if num_samples != -1:
     #   dataset = dataset.shuffle(seed=42).select(range(num_samples))
 
     # convert our dataset to the r1 prompt
-    dataset = get_gsm8k_questions_with_stage1and2_answers(dataset)
+    dataset = get_gsm8k_questions_with_stage1and2_answers(dataset, round_num)
+    prompt_budget.log_stats(3)
     return dataset, dataset
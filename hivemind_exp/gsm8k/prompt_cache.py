@@ -0,0 +1,86 @@
+from dataclasses import dataclass, field
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+
+# Every completion of a GRPO group shares one prompt, and stage 2/3 prompts
+# embed up to a whole swarm's worth of answers and critiques. Stage modules
+# parse each prompt once into a PromptRecord, cached by prompt text.
+PROMPT_CACHE_SIZE = 256
+
+# Choices that claim no student answer was correct.
+NO_CORRECT_ANSWER = (
+    "None",
+    "No one",
+    "All answers are wrong",
+    "All answers were wrong",
+    "All are wrong",
+    "All were wrong",
+    "None are correct",
+    "None were correct",
+    "No one is correct",
+)
+
+
+def _answer_score(parsed, correct: bool):
+    # Same terms, in the same order, as the original inline scoring.
+    score = 0
+    if correct:
+        score += 1.0
+    if parsed.extract("answer").isdigit():
+        score += 0.5
+    if parsed.strict:
+        score += 0.5
+    if parsed.soft:
+        score += 0.5
+    score += parsed.xml_count
+    return score
+
+
+@dataclass(frozen=True)
+class StudentAnswer:
+    text: str
+    final_answer: str
+    score_if_correct: float
+    score_if_wrong: float
+
+    @classmethod
+    def from_text(cls, text: str) -> "StudentAnswer":
+        parsed = stage1_rewards.parse(text)
+        return cls(
+            text=text,
+            final_answer=parsed.extract("answer"),
+            score_if_correct=_answer_score(parsed, True),
+            score_if_wrong=_answer_score(parsed, False),
+        )
+
+
+@dataclass(frozen=True)
+class PromptRecord:
+    """Everything reward functions read from a stage 2/3 prompt. Shared; do not mutate."""
+
+    question: str
+    student_ids: tuple[str, ...] = ()
+    students: dict[str, StudentAnswer] = field(default_factory=dict)
+    critic_choices: tuple[str, ...] = ()
+    majority: tuple[str, ...] = ()
+
+
+def student_answers(answers: dict[str, str]) -> dict[str, StudentAnswer]:
+    return {id: StudentAnswer.from_text(text) for id, text in answers.items()}
+
+
+def choice_reward(choice: str, students: dict[str, StudentAnswer], answer) -> float:
+    """Reward for picking `choice` among `students` when the answer is `answer[0]`."""
+    if choice in students:
+        student = students[choice]
+        if student.final_answer == answer[0]:
+            return student.score_if_correct
+        return student.score_if_wrong
+    if choice in NO_CORRECT_ANSWER:
+        # Student answers are matched positionally against the answer column.
+        check_submissions = [
+            s.final_answer == a for s, a in zip(students.values(), answer)
+        ]
+        if all(check_submissions):
+            return 10
+    return 0
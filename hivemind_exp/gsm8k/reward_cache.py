@@ -0,0 +1,84 @@
+import inspect
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+# TRL calls every reward function of a stage with the same `completions` list,
+# and hivemind_cumulative_reward then calls them again. Scores are keyed by the
+# identity of that list, so the second call is a lookup.
+MAX_CACHED_BATCHES = 4  # Per thread.
+
+
+class BatchRewardCache:
+    """
+    Scores by completions batch, kept separately for every thread: batches
+    scored in the background (pick_k_cols ranking peers' answers while a
+    stage dataset tops up) never evict the training step's batch.
+    """
+
+    def __init__(self, max_batches=MAX_CACHED_BATCHES):
+        self.max_batches = max_batches
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # Guards the shared counters.
+        self._local = threading.local()
+
+    @property
+    def _batches(self) -> OrderedDict[int, tuple[list, dict]]:
+        # id(completions): (completions, {(fn, weighting): scores}).
+        if not hasattr(self._local, "batches"):
+            self._local.batches = OrderedDict()
+        return self._local.batches
+
+    def get(self, completions, key):
+        entry = self._batches.get(id(completions))
+        # Holding a reference to the batch keeps its id from being reused.
+        hit = entry is not None and entry[0] is completions and key in entry[1]
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1][key] if hit else None
+
+    def put(self, completions, key, scores):
+        batches = self._batches
+        entry = batches.get(id(completions))
+        if not entry or entry[0] is not completions:
+            entry = (completions, {})
+            batches[id(completions)] = entry
+            while len(batches) > self.max_batches:
+                batches.popitem(last=False)
+        entry[1][key] = scores
+
+    def clear(self):
+        """Drops the calling thread's batches."""
+        self._batches.clear()
+
+
+batch_reward_cache = BatchRewardCache()
+
+
+def clear_batch_cache():
+    """Called by the trainer at the end of every step; clears that thread's batches."""
+    batch_reward_cache.clear()
+
+
+def batch_memoized(fn):
+    """Memoizes a component reward function for the current completions batch."""
+    sig = inspect.signature(fn)
+
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+        completions = bound.arguments["completions"]
+        key = (fn, bound.arguments.get("weighting"))
+
+        scores = batch_reward_cache.get(completions, key)
+        if scores is None:
+            scores = fn(*args, **kwargs)
+            batch_reward_cache.put(completions, key, scores)
+        return list(scores)
+
+    return wrapped
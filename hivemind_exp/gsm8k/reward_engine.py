@@ -0,0 +1,70 @@
+from functools import update_wrapper
+from typing import Callable, Sequence
+
+import numpy as np
+
+from hivemind_exp.gsm8k.reward_cache import batch_reward_cache
+from hivemind_exp.gsm8k.reward_executor import get_reward_executor, prompt_groups, slice_call
+
+
+class RewardEngine:
+    """
+    Scores a completions batch with all component rewards of a stage at once.
+
+    The scores are held as a (completions x reward funcs) matrix, memoized for
+    the current batch, so totals and selections are single NumPy operations and
+    the per-function rewards TRL asks for are column views.
+    """
+
+    def __init__(self, reward_funcs: Sequence[Callable], weights=None):
+        self.reward_funcs = list(reward_funcs)
+        if weights is None:
+            weights = np.ones(len(self.reward_funcs))
+        self.weights = np.asarray(weights, dtype=np.float64)
+        assert self.weights.shape == (len(self.reward_funcs),)
+
+    def score(self, prompts, completions, **kwargs) -> np.ndarray:
+        key = (self, "matrix")
+        matrix = batch_reward_cache.get(completions, key)
+        if matrix is None:
+            matrix = np.empty((len(completions), len(self.reward_funcs)))
+            executor = get_reward_executor()
+            if executor is None:
+                # Reward functions score a call against its first prompt and
+                # answer; score each prompt group on its own, as the executor does.
+                for s in prompt_groups(prompts, len(completions), **kwargs):
+                    group_prompts, group_completions, group_kwargs = slice_call(
+                        s, prompts, completions, kwargs
+                    )
+                    for i, fn in enumerate(self.reward_funcs):
+                        matrix[s, i] = fn(
+                            prompts=group_prompts, completions=group_completions, **group_kwargs
+                        )
+            else:
+                columns = executor.map(self.reward_funcs, prompts, completions, **kwargs)
+                for i, column in enumerate(columns):
+                    matrix[:, i] = column
+            batch_reward_cache.put(completions, key, matrix)
+        return matrix
+
+    def totals(self, prompts, completions, **kwargs) -> np.ndarray:
+        return self.score(prompts, completions, **kwargs) @ self.weights
+
+    def best(self, prompts, completions, **kwargs) -> int:
+        return int(np.argmax(self.totals(prompts, completions, **kwargs)))
+
+    def view(self, i: int) -> Callable:
+        """TRL-compatible reward function returning column i of the matrix."""
+
+        def column(prompts, completions, **kwargs) -> list[float]:
+            return self.score(prompts, completions, **kwargs)[:, i].tolist()
+
+        return update_wrapper(column, self.reward_funcs[i])
+
+    def views(self) -> list[Callable]:
+        return [self.view(i) for i in range(len(self.reward_funcs))]
+
+
+def rank(totals: np.ndarray, tiebreakers: np.ndarray, names: np.ndarray) -> np.ndarray:
+    """Ascending order by (total, tiebreaker, name); the best entries are last."""
+    return np.lexsort((names, tiebreakers, totals))
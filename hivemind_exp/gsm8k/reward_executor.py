@@ -0,0 +1,140 @@
+import importlib
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Callable, Sequence
+
+import hivemind_exp.gsm8k.sample_logger as sample_logger
+from hivemind_exp.gsm8k.sample_logger import sample_rates, set_sample_rates
+
+
+def _close_sample_writer():
+    sample_logger.sample_writer.close()
+
+
+def _warm_up(module_name: str, rates: dict[int, float]):
+    # Import the reward module (and its parse caches) before the first batch.
+    importlib.import_module(module_name)
+    set_sample_rates(rates)
+    # Workers exit without running atexit hooks, but do run multiprocessing's
+    # finalizers: write out the samples still queued when the pool shuts down.
+    Finalize(None, _close_sample_writer, exitpriority=10)
+
+
+def _call(fn: Callable, prompts, completions, kwargs) -> list[float]:
+    return list(fn(prompts=prompts, completions=completions, **kwargs))
+
+
+def _per_completion(value, n: int) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) == n
+
+
+def _group_cuts(prompts, n: int, kwargs) -> set[int]:
+    # A new prompt group starts wherever a per-completion column changes.
+    columns = [v for v in (prompts, *kwargs.values()) if _per_completion(v, n)]
+    return {0} | {i for i in range(1, n) if any(c[i] != c[i - 1] for c in columns)}
+
+
+def _slices(cuts: set[int], n: int) -> list[slice]:
+    if n == 0:
+        return []
+    cuts = sorted(cuts)
+    return [slice(a, b) for a, b in zip(cuts, cuts[1:] + [n])]
+
+
+def prompt_groups(prompts, n: int, **kwargs) -> list[slice]:
+    """Runs of the n completions sharing their prompt, answer and other per-completion columns."""
+    return _slices(_group_cuts(prompts, n, kwargs), n)
+
+
+def slice_call(s: slice, prompts, completions, kwargs) -> tuple[list, list, dict]:
+    """The (prompts, completions, kwargs) of a reward call for rows `s` of a batch."""
+    n = len(completions)
+    if s == slice(0, n):
+        # The batch itself, so memoized scores (keyed by the list) are reused.
+        return prompts, completions, kwargs
+
+    def sliced(value):
+        # Per-completion columns (prompts, answer, ...) are split with the
+        # completions; everything else is passed to each part unchanged.
+        return value[s] if _per_completion(value, n) else value
+
+    return sliced(prompts), completions[s], {k: sliced(v) for k, v in kwargs.items()}
+
+
+class ProcessPoolRewardExecutor:
+    """
+    Evaluates component reward functions in persistent worker processes.
+
+    Every reward function gets its own pool, so its module stays imported and
+    its caches stay warm across steps. A batch is split into contiguous
+    completion chunks, about one per worker, and the scores are concatenated
+    in chunk order, so results do not depend on scheduling.
+
+    Reward functions score a call against its first prompt and answer
+    (`prompts[0]`, `answer[0]`), so chunks never span two prompt groups:
+    every completion is scored against its own prompt. RewardEngine splits
+    in-process scoring the same way (see prompt_groups), so both give the
+    same scores.
+
+    Only stateless component rewards belong here; hivemind_cumulative_reward
+    writes to the node and keeps running in the training process.
+    """
+
+    def __init__(self, workers_per_func: int = 1, mp_context: str = "spawn"):
+        assert workers_per_func >= 1
+        self.workers_per_func = workers_per_func
+        # CUDA state does not survive fork, so workers start fresh by default.
+        self._mp_context = multiprocessing.get_context(mp_context)
+        self._pools: dict[Callable, ProcessPoolExecutor] = {}
+
+    def _pool(self, fn: Callable) -> ProcessPoolExecutor:
+        if fn not in self._pools:
+            self._pools[fn] = ProcessPoolExecutor(
+                max_workers=self.workers_per_func,
+                mp_context=self._mp_context,
+                initializer=_warm_up,
+                initargs=(fn.__module__, sample_rates()),
+            )
+        return self._pools[fn]
+
+    def _chunks(self, prompts, n: int, kwargs) -> list[slice]:
+        """About workers_per_func slices of n rows, also cut between prompt groups."""
+        if n == 0:
+            return []
+        size = -(-n // self.workers_per_func)  # Ceiling division.
+        return _slices(set(range(0, n, size)) | _group_cuts(prompts, n, kwargs), n)
+
+    def map(
+        self, reward_funcs: Sequence[Callable], prompts, completions, **kwargs
+    ) -> list[list[float]]:
+        """Scores of every function on the batch, in reward_funcs order."""
+        calls = [
+            slice_call(s, prompts, completions, kwargs)
+            for s in self._chunks(prompts, len(completions), kwargs)
+        ]
+        futures: list[list[Future]] = []
+        for fn in reward_funcs:
+            pool = self._pool(fn)
+            futures.append([pool.submit(_call, fn, *call) for call in calls])
+        return [[x for f in chunks for x in f.result()] for chunks in futures]
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown()
+        self._pools.clear()
+
+
+_reward_executor: ProcessPoolRewardExecutor | None = None
+
+
+def get_reward_executor() -> ProcessPoolRewardExecutor | None:
+    return _reward_executor
+
+
+def set_reward_executor(executor: ProcessPoolRewardExecutor | None):
+    """Installs the executor RewardEngine uses; None evaluates in-process."""
+    global _reward_executor
+    if _reward_executor is not None and _reward_executor is not executor:
+        _reward_executor.shutdown()
+    _reward_executor = executor
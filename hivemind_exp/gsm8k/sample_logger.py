@@ -0,0 +1,135 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_ROOT = "model_output_samples"
+DEFAULT_SAMPLE_RATE = 0.01  # Fraction of reward calls that log a sample.
+MAX_QUEUED_SAMPLES = 1024  # Samples beyond this are dropped, never waited on.
+MAX_FILE_BYTES = 16 * 1024 * 1024
+BACKUP_COUNT = 3
+
+
+class SampleLogWriter:
+    """
+    Appends reward samples to files under `root` from a background thread.
+
+    Reward functions only enqueue. The thread drains whatever is queued, groups
+    it by file and writes each file once per batch, rotating it to
+    `<file>.1` ... `<file>.<backup_count>` when it would exceed `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        root=SAMPLES_ROOT,
+        max_queued=MAX_QUEUED_SAMPLES,
+        max_bytes=MAX_FILE_BYTES,
+        backup_count=BACKUP_COUNT,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(max_queued)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._dirs: set[str] = set()
+
+    def submit(self, subdir: str, filename: str, text: str):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((os.path.join(self.root, subdir, filename), text))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Blocks until everything submitted so far is on disk."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout=5.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="sample-log-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            by_path: dict[str, list[str]] = {}
+            for item in batch:
+                if item is not None:
+                    by_path.setdefault(item[0], []).append(item[1])
+            for path, texts in by_path.items():
+                try:
+                    self._write(path, "".join(texts))
+                except OSError as e:
+                    logger.warning(f"Could not write samples to {path}: {e}")
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                return
+
+    def _write(self, path: str, data: str):
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size and size + len(data.encode()) > self.max_bytes:
+            self._rotate(path)
+        with open(path, "a") as f:
+            f.write(data)
+
+    def _rotate(self, path: str):
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+
+
+sample_writer = SampleLogWriter()
+atexit.register(sample_writer.close)
+
+_sample_rates: dict[int, float] = {}
+
+
+def set_sample_rates(rates: dict[int, float]):
+    """Per-stage sampling rates, e.g. {1: 0.01, 3: 0.05}."""
+    _sample_rates.update(rates)
+
+
+def sample_rates() -> dict[int, float]:
+    return dict(_sample_rates)
+
+
+def should_sample(stage: int) -> bool:
+    return random.random() < _sample_rates.get(stage, DEFAULT_SAMPLE_RATE)
+
+
+def log_sample(subdir: str, filename: str, text: str):
+    sample_writer.submit(subdir, filename, text)
@@ -0,0 +1,73 @@
+import os
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Callable, Sequence
+
+# Picks the backend question_recreation_reward_func scores with, e.g.
+# HIVEMIND_SIMILARITY_BACKEND=ngram. Defaults to difflib, the original scorer.
+SIMILARITY_BACKEND_ENV = "HIVEMIND_SIMILARITY_BACKEND"
+DEFAULT_SIMILARITY_BACKEND = "difflib"
+
+# 5-grams track difflib most closely on recreated GSM8K questions; shorter
+# n-grams barely penalize reordered words. See tests/test_similarity.py.
+NGRAM_SIZE = 5
+
+SimilarityBackend = Callable[[Sequence[str], str], list[float]]
+
+
+def difflib_similarity(candidates: Sequence[str], reference: str) -> list[float]:
+    """SequenceMatcher ratios. Quadratic in the worst case on long candidates."""
+    # SequenceMatcher indexes its second sequence, so the reference is indexed
+    # once per batch instead of once per candidate.
+    matcher = SequenceMatcher(None)
+    matcher.set_seq2(reference)
+    ratios = []
+    for c in candidates:
+        matcher.set_seq1(c)
+        ratios.append(matcher.ratio())
+    return ratios
+
+
+def _ngrams(text: str, n: int) -> Counter:
+    if len(text) < n:
+        return Counter([text]) if text else Counter()
+    return Counter(text[i : i + n] for i in range(len(text) - n + 1))
+
+
+def ngram_similarity(
+    candidates: Sequence[str], reference: str, n: int = NGRAM_SIZE
+) -> list[float]:
+    """
+    Dice coefficient over character n-gram multisets, in [0, 1] like difflib's
+    ratio. Linear in the length of each candidate.
+    """
+    ref = _ngrams(reference, n)
+    ref_total = sum(ref.values())
+    ratios = []
+    for c in candidates:
+        grams = _ngrams(c, n)
+        total = ref_total + sum(grams.values())
+        if not total:
+            ratios.append(1.0)  # Both empty, as SequenceMatcher would say.
+            continue
+        # The reference is the short side; walk its n-grams, not the candidate's.
+        common = sum(min(count, grams[g]) for g, count in ref.items())
+        ratios.append(2.0 * common / total)
+    return ratios
+
+
+SIMILARITY_BACKENDS: dict[str, SimilarityBackend] = {
+    "difflib": difflib_similarity,
+    "ngram": ngram_similarity,
+}
+
+
+def get_similarity_backend(name: str | None = None) -> SimilarityBackend:
+    if name is None:
+        name = os.getenv(SIMILARITY_BACKEND_ENV, DEFAULT_SIMILARITY_BACKEND)
+    try:
+        return SIMILARITY_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown similarity backend {name!r}; expected one of {sorted(SIMILARITY_BACKENDS)}"
+        ) from None
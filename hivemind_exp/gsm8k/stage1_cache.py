@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Callable
+
+from datasets import Dataset, DatasetDict, load_from_disk
+from huggingface_hub import HfApi
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored columns or their preparation change.
+CACHE_VERSION = 2
+STAGE1_CACHE_ENV = "HIVEMIND_STAGE1_CACHE"  # Set to "" to disable the cache.
+STAGE1_REFRESH_ENV = "HIVEMIND_STAGE1_REFRESH"  # Set to "1" to re-resolve the dataset revision.
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "hivemind_exp", "stage1"
+)
+REVISION_TIMEOUT = 10  # Seconds to resolve a dataset revision on the Hub.
+
+
+def stage1_cache_dir() -> str | None:
+    root = os.getenv(STAGE1_CACHE_ENV, DEFAULT_CACHE_DIR)
+    return root or None
+
+
+def stage1_refresh() -> bool:
+    return os.getenv(STAGE1_REFRESH_ENV, "") not in ("", "0")
+
+
+def cache_key(dataset_id, config, revision, sys_prompt) -> str:
+    parts = [CACHE_VERSION, dataset_id, config, revision, sys_prompt]
+    return hashlib.md5(json.dumps(parts).encode()).hexdigest()
+
+
+def is_commit_sha(revision: str) -> bool:
+    return len(revision) == 40 and all(c in "0123456789abcdef" for c in revision)
+
+
+def _read_ref(ref_path: str | None) -> str | None:
+    try:
+        with open(ref_path) as f:
+            sha = f.read().strip()
+    except (OSError, TypeError):
+        return None
+    return sha if is_commit_sha(sha) else None
+
+
+def resolve_revision(
+    dataset_id: str, revision: str, root: str | None = None, refresh: bool = False
+) -> str | None:
+    """
+    The commit a dataset revision (e.g. the "main" branch) points to, so that
+    caches keyed by it are reproducible. The commit is recorded under `root`
+    the first time, and warm starts use the recorded one without asking the
+    Hub; `refresh` asks again, to pick up a branch that moved. None if it
+    cannot be resolved.
+    """
+    if is_commit_sha(revision):
+        return revision
+    ref = hashlib.md5(json.dumps([dataset_id, revision]).encode()).hexdigest()
+    ref_path = os.path.join(root, "refs", ref) if root else None
+    recorded = _read_ref(ref_path)
+    if recorded is not None and not refresh:
+        return recorded
+    try:
+        sha = HfApi().dataset_info(dataset_id, revision=revision, timeout=REVISION_TIMEOUT).sha
+    except Exception as e:  # Offline, or the Hub is unreachable.
+        if recorded is not None:
+            logger.warning(f"Could not resolve {dataset_id}@{revision} ({e}); using {recorded}")
+        else:
+            logger.warning(f"Could not resolve {dataset_id}@{revision}: {e}")
+        return recorded
+    if ref_path:
+        try:
+            os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+            with open(ref_path, "w") as f:
+                f.write(sha)
+        except OSError as e:
+            logger.warning(f"Could not record {dataset_id}@{revision} commit: {e}")
+    return sha
+
+
+def load_stage1_splits(
+    key: str,
+    build_fn: Callable[[], DatasetDict | dict[str, Dataset]],
+    root: str | None = None,
+) -> dict[str, Dataset]:
+    """
+    Memory-maps the stage-1 splits cached under `key`, building and saving
+    them with build_fn first if they are not on disk yet.
+    """
+    if root is None:
+        return dict(build_fn())
+
+    path = os.path.join(root, key)
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path) as f:
+                splits = json.load(f)["splits"]
+            return {s: load_from_disk(os.path.join(path, s)) for s in splits}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable stage 1 cache at {path}: {e}")
+
+    datasets = dict(build_fn())
+    try:
+        os.makedirs(root, exist_ok=True)
+        # Written next to the final path and renamed, so readers never see a partial cache.
+        tmp = tempfile.mkdtemp(prefix=f".{key}-", dir=root)
+        for split, data in datasets.items():
+            data.save_to_disk(os.path.join(tmp, split))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": CACHE_VERSION, "splits": list(datasets)}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not write stage 1 cache to {path}: {e}")
+        return datasets
+    # Serve the memory-mapped copy, same as a warm start.
+    return {s: load_from_disk(os.path.join(path, s)) for s in datasets}
@@ -1,84 +1,101 @@
 import os
-import random
-import re
 
 import numpy as np
 
+from hivemind_exp.gsm8k.completion_parser import (
+    ParsedCompletion,
+    XmlSchema,
+    parse_completion,
+)
+from hivemind_exp.gsm8k.reward_cache import batch_memoized
+from hivemind_exp.gsm8k.reward_engine import RewardEngine
+from hivemind_exp.gsm8k.sample_logger import log_sample, should_sample
 from hivemind_exp.hivemind_utils import HivemindNode
 
+STAGE = 1
+SAMPLES_DIR = f"gsm8k_samples_from_{os.getenv('HOSTNAME')}"
+
+XML_SCHEMA = XmlSchema(
+    tags=("think", "answer"),
+    count_rules=(
+        ("<think>\n", None, 0),
+        ("\n</think>\n", None, 0),
+        ("\n<answer>\n", "\n</answer>\n", 0),
+        ("\n</answer>", "\n</answer>", 1),
+    ),
+    strict_pattern=r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$",
+    soft_pattern=r"<think>.*?</think>\s*<answer>.*?</answer>",
+)
+
+
+def parse(text: str) -> ParsedCompletion:
+    return parse_completion(text, XML_SCHEMA)
+
+
+def parse_completions(completions) -> list[ParsedCompletion]:
+    return [parse(completion[0]["content"]) for completion in completions]
+
 
 def extract_xml_answer(text: str) -> str:
-    answer = text.split("<answer>")[-1]
-    answer = answer.split("</answer>")[0]
-    return answer.strip()
+    return parse(text).extract("answer")
 
 
 def count_xml(text) -> float:
-    count = 0.0
-    if text.count("<think>\n") == 1:
-        count += 0.125
-    if text.count("\n</think>\n") == 1:
-        count += 0.125
-    if text.count("\n<answer>\n") == 1:
-        count += 0.125
-        count -= len(text.split("\n</answer>\n")[-1]) * 0.001
-    if text.count("\n</answer>") == 1:
-        count += 0.125
-        count -= (len(text.split("\n</answer>")[-1]) - 1) * 0.001
-    return count
+    return parse(text).xml_count
 
 
 # Reward functions
+@batch_memoized
 def correctness_reward_func(
     prompts, completions, answer, weighting=2.0, logging=False, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [p.text for p in parsed]
     q = prompts[0][-1]["content"]
-    extracted_responses = [extract_xml_answer(r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "correctness_samples.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"Question:\n{q}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
-            f.write(out_line)
+    extracted_responses = [p.extract("answer") for p in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"Question:\n{q}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
+        log_sample(SAMPLES_DIR, "correctness_samples.txt", "-" * 20 + out_line)
     return [
         1.0 * weighting if r == a else 0.0 for r, a in zip(extracted_responses, answer)
     ]
 
 
+@batch_memoized
 def int_reward_func(completions, weighting=0.5, **kwargs) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
-    extracted_responses = [extract_xml_answer(r) for r in responses]
+    extracted_responses = [p.extract("answer") for p in parse_completions(completions)]
     return [1.0 * weighting if r.isdigit() else 0.0 for r in extracted_responses]
 
 
+@batch_memoized
 def strict_format_reward_func(completions, weighting=0.5, **kwargs) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
+    matches = [p.strict for p in parse_completions(completions)]
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def soft_format_reward_func(completions, weighting=0.5, **kwargs) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
+    matches = [p.soft for p in parse_completions(completions)]
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def xmlcount_reward_func(completions, weighting=1.0, **kwargs) -> list[float]:
-    contents = [completion[0]["content"] for completion in completions]
-    return [count_xml(c) * weighting for c in contents]
+    return [p.xml_count * weighting for p in parse_completions(completions)]
+
+
+REWARD_ENGINE = RewardEngine(
+    [
+        correctness_reward_func,
+        int_reward_func,
+        strict_format_reward_func,
+        soft_format_reward_func,
+        xmlcount_reward_func,
+    ]
+)
+
 
 def top_k_cumulative_reward(
     prompts,
@@ -86,28 +103,11 @@ def top_k_cumulative_reward(
     answer,
     logging=False,
     **kwargs,
-) -> list[float]:
+) -> np.ndarray:
     """
     Dummy reward function that accumulates all rewards into one for prompt generation's top_k selector
     """
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    int_reward = int_reward_func(completions)
-    strict_format_reward = strict_format_reward_func(completions)
-    soft_format_reward = soft_format_reward_func(completions)
-    xmlcount_reward = xmlcount_reward_func(completions)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            correctness_reward,
-            int_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-    return total_reward
+    return REWARD_ENGINE.totals(prompts, completions, answer=answer, logging=logging)
 
 
 def hivemind_cumulative_reward(
@@ -122,23 +122,9 @@ def hivemind_cumulative_reward(
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
+    total_reward = REWARD_ENGINE.totals(
+        prompts, completions, answer=answer, logging=logging
     )
-    int_reward = int_reward_func(completions)
-    strict_format_reward = strict_format_reward_func(completions)
-    soft_format_reward = soft_format_reward_func(completions)
-    xmlcount_reward = xmlcount_reward_func(completions)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            correctness_reward,
-            int_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
 
     if output_signal_selector == "max":
         # Generate output line
@@ -154,6 +140,6 @@ def hivemind_cumulative_reward(
 
     if output_signal_selector != None:
         node.outputs = output_data
-        node.rewards = total_reward
+        node.rewards = total_reward.tolist()
 
     return [0.0 for _ in total_reward]
@@ -1,23 +1,55 @@
 import os
-import random
-import re
+from functools import lru_cache
 
 import numpy as np
 
-import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.completion_parser import (
+    ParsedCompletion,
+    XmlSchema,
+    parse_completion,
+)
+from hivemind_exp.gsm8k.prompt_cache import (
+    PROMPT_CACHE_SIZE,
+    PromptRecord,
+    choice_reward,
+    student_answers,
+)
+from hivemind_exp.gsm8k.reward_cache import batch_memoized
+from hivemind_exp.gsm8k.reward_engine import RewardEngine
+from hivemind_exp.gsm8k.sample_logger import log_sample, should_sample
 from hivemind_exp.hivemind_utils import HivemindNode
 
+STAGE = 2
+SAMPLES_DIR = f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}"
+
+XML_SCHEMA = XmlSchema(
+    tags=("compare", "explain", "identify"),
+    count_rules=(
+        ("<compare>\n", None, 0),
+        ("\n</compare>\n", None, 0),
+        ("<explain>\n", None, 0),
+        ("\n</explain>\n", None, 0),
+        ("\n<identify>\n", "\n</identify>\n", 0),
+        ("\n</identify>", "\n</identify>", 1),
+    ),
+    strict_pattern=r"^<compare>\n.*?\n</compare>\n<explain>\n.*?\n</explain>\n<identify>\n.*?\n</identify>\n$",
+    soft_pattern=r"<compare>.*?</compare>\s*<explain>.*?</explain>\s*<identify>.*?</identify>",
+)
+
+
+def parse(text: str) -> ParsedCompletion:
+    return parse_completion(text, XML_SCHEMA)
+
+
+def parse_completions(completions) -> list[ParsedCompletion]:
+    return [parse(completion[0]["content"]) for completion in completions]
+
 
 def extract_xml_identity(text: str) -> str:
     if text is None:
         return ""
-    
-    try:
-        id = text.split("<identify>")[-1]
-        id = id.split("</identify>")[0]
-        return id.strip()
-    except Exception:
-        return ""
+
+    return parse(text).extract("identify")
 
 
 def extract_xml_ids(text: str) -> str:
@@ -59,188 +91,109 @@ def extract_answers(text: str) -> str:
         return answers
 
 
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def parse_prompt(text: str) -> PromptRecord:
+    return PromptRecord(
+        question=extract_original_question(text),
+        student_ids=tuple(extract_xml_ids(text)),
+        students=student_answers(extract_answers(text)),
+    )
+
+
 def count_xml(text) -> float:
-    count = 0.0
     if text is None:
-        return count
-    
-    try:
-        if text.count("<compare>\n") == 1:
-            count += 0.125
-        if text.count("\n</compare>\n") == 1:
-            count += 0.125
-        if text.count("<explain>\n") == 1:
-            count += 0.125
-        if text.count("\n</explain>\n") == 1:
-            count += 0.125
-        if text.count("\n<identify>\n") == 1:
-            count += 0.125
-            count -= len(text.split("\n</identify>\n")[-1]) * 0.001
-        if text.count("\n</identify>") == 1:
-            count += 0.125
-            count -= (len(text.split("\n</identify>")[-1]) - 1) * 0.001
-        return count
-    except Exception:
-        return count
+        return 0.0
+
+    return parse(text).xml_count
 
 
 # Reward functions
+@batch_memoized
 def proper_id_reward_func(
     prompts, completions, answer, weighting=2.0, logging=True, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    agent_ids = extract_xml_ids(p)
-    extracted_responses = [extract_xml_identity(r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "id_extact_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nValid IDs:\n{agent_ids}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in agent_ids}"
-            f.write(out_line)
+    agent_ids = parse_prompt(p).student_ids
+    extracted_responses = [c.extract("identify") for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nValid IDs:\n{agent_ids}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in agent_ids}"
+        log_sample(SAMPLES_DIR, "id_extact_samps.txt", "-" * 20 + out_line)
     return [1.0 * weighting if r in agent_ids else 0.0 for r in extracted_responses]
 
 
+@batch_memoized
 def correctness_reward_func(
     prompts, completions, answer, weighting=2.0, logging=True, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    agent_answers = extract_answers(p)
-    extracted_responses = [extract_xml_identity(r) for r in responses]
-    chosen_rewards = []
-    for r in extracted_responses:
-        cur_reward = 0
-        if r in agent_answers:
-            if stage1_rewards.extract_xml_answer(agent_answers[r]) == answer[0]:
-                cur_reward += 1.0
-            if stage1_rewards.extract_xml_answer(agent_answers[r]).isdigit():
-                cur_reward += 0.5
-            pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-            if re.match(pattern, agent_answers[r]):
-                cur_reward += 0.5
-            pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-            if re.match(pattern, agent_answers[r]):
-                cur_reward += 0.5
-            cur_reward += stage1_rewards.count_xml(agent_answers[r])
-        elif r in [
-            "None",
-            "No one",
-            "All answers are wrong",
-            "All answers were wrong",
-            "All are wrong",
-            "All were wrong",
-            "None are correct",
-            "None were correct",
-            "No one is correct",
-        ]:
-            agent_as = [
-                stage1_rewards.extract_xml_answer(agent_answers[id])
-                for id in agent_answers
-            ]
-            check_submissions = [
-                True if r == a else False for r, a in zip(agent_as, answer)
-            ]
-            if all(check_submissions):
-                cur_reward += 10
-        chosen_rewards += [cur_reward]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        if extracted_responses[0] in agent_answers:
-            os.makedirs(
-                f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                exist_ok=True,
-            )
-            log_file = os.path.join(
-                "model_output_samples",
-                f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                "correctness_samps.txt",
-            )
-            with open(log_file, "a") as f:
-                f.write("-" * 20)
-                out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}"
-                f.write(out_line)
+    record = parse_prompt(p)
+    extracted_responses = [c.extract("identify") for c in parsed]
+    chosen_rewards = [
+        choice_reward(r, record.students, answer) for r in extracted_responses
+    ]
+    if logging and should_sample(STAGE):
+        if extracted_responses[0] in record.students:
+            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{record.students[extracted_responses[0]].text}\n\nReward for choice: {chosen_rewards[0]}"
+            log_sample(SAMPLES_DIR, "correctness_samps.txt", "-" * 20 + out_line)
     return [r * weighting for r in chosen_rewards]
 
 
+@batch_memoized
 def strict_format_reward_func(
     completions, weighting=0.5, logging=True, **kwargs
 ) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"^<compare>\n.*?\n</compare>\n<explain>\n.*?\n</explain>\n<identify>\n.*?\n</identify>\n$"
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "s2_strict_format_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
+    matches = [c.strict for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
+        log_sample(SAMPLES_DIR, "s2_strict_format_samps.txt", "-" * 20 + out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def soft_format_reward_func(
     completions, weighting=0.5, logging=True, **kwargs
 ) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = (
-        r"<compare>.*?</compare>\s*<explain>.*?</explain>\s*<identify>.*?</identify>"
-    )
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "s2_soft_format_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
+    matches = [c.soft for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
+        log_sample(SAMPLES_DIR, "s2_soft_format_samps.txt", "-" * 20 + out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def xmlcount_reward_func(
     completions, weighting=1.0, logging=True, **kwargs
 ) -> list[float]:
-    contents = [completion[0]["content"] for completion in completions]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "strict_format_samps.txt",
+    parsed = parse_completions(completions)
+    contents = [c.text for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = (
+            f"\nResponse:\n{contents[0]}\n\nCount reward: {parsed[0].xml_count}"
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = (
-                f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}"
-            )
-            f.write(out_line)
-    return [count_xml(c) * weighting for c in contents]
+        log_sample(SAMPLES_DIR, "strict_format_samps.txt", "-" * 20 + out_line)
+    return [c.xml_count * weighting for c in parsed]
+
+
+REWARD_ENGINE = RewardEngine(
+    [
+        proper_id_reward_func,
+        correctness_reward_func,
+        strict_format_reward_func,
+        soft_format_reward_func,
+        xmlcount_reward_func,
+    ]
+)
+
 
 def top_k_cumulative_reward(
     prompts,
@@ -248,30 +201,11 @@ def top_k_cumulative_reward(
     answer,
     logging=False,
     **kwargs,
-) -> list[float]:
+) -> np.ndarray:
     """
     Dummy reward function that accumulates all rewards into one for prompt generation's top_k selector
     """
-    proper_id_reward = proper_id_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            proper_id_reward,
-            correctness_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
-    return total_reward
+    return REWARD_ENGINE.totals(prompts, completions, answer=answer, logging=logging)
 
 
 def hivemind_cumulative_reward(
@@ -286,27 +220,11 @@ def hivemind_cumulative_reward(
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    proper_id_reward = proper_id_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    correctness_reward = correctness_reward_func(
-        prompts, completions, answer, logging=logging
+    total_reward = REWARD_ENGINE.totals(
+        prompts, completions, answer=answer, logging=logging
     )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            proper_id_reward,
-            correctness_reward,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
 
-    question = extract_original_question(prompts[0][-1]["content"])
+    question = parse_prompt(prompts[0][-1]["content"]).question
     if output_signal_selector == "max":
         # Generate output line
         maximal_reward_idx, responses = (
@@ -322,6 +240,6 @@ def hivemind_cumulative_reward(
 
     if output_signal_selector != None:
         node.outputs = output_data
-        node.rewards = total_reward
+        node.rewards = total_reward.tolist()
 
     return [0.0 for _ in total_reward]
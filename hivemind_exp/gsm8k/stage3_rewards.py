@@ -1,30 +1,66 @@
 import os
-import random
-import re
-from difflib import SequenceMatcher
+from collections import defaultdict
+from functools import lru_cache
 
 import numpy as np
 
-import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.completion_parser import (
+    ParsedCompletion,
+    XmlSchema,
+    parse_completion,
+)
+from hivemind_exp.gsm8k.prompt_cache import (
+    PROMPT_CACHE_SIZE,
+    PromptRecord,
+    choice_reward,
+    student_answers,
+)
+from hivemind_exp.gsm8k.reward_cache import batch_memoized
+from hivemind_exp.gsm8k.reward_engine import RewardEngine
+from hivemind_exp.gsm8k.sample_logger import log_sample, should_sample
+from hivemind_exp.gsm8k.similarity import get_similarity_backend
 from hivemind_exp.hivemind_utils import HivemindNode
 
+STAGE = 3
+SAMPLES_DIR = f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}"
+
+XML_SCHEMA = XmlSchema(
+    tags=("summarize_feedback", "majority", "question", "think", "answer"),
+    count_rules=(
+        ("<summarize_feedback>\n", None, 0),
+        ("\n</summarize_feedback>\n", None, 0),
+        ("<majority>\n", None, 0),
+        ("\n</majority>\n", None, 0),
+        ("<question>\n", None, 0),
+        ("\n</question>\n", None, 0),
+        ("<think>\n", None, 0),
+        ("\n</think>\n", None, 0),
+        ("\n<answer>\n", "\n</answer>\n", 0),
+        ("\n</answer>", "\n</answer>", 1),
+    ),
+    strict_pattern=r"^<summarize_feedback>\n.*?\n</summarize_feedback>\n<majority>\n.*?\n</majority>\n<question>\n.*?\n</question>\n<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$",
+    soft_pattern=r"<summarize_feedback>.*?</summarize_feedback>\s*<majority>.*?</majority>\s*<question>.*?</question>\s*<think>.*?</think>\s*<answer>.*?</answer>",
+)
+
+
+def parse(text: str) -> ParsedCompletion:
+    return parse_completion(text, XML_SCHEMA)
+
+
+def parse_completions(completions) -> list[ParsedCompletion]:
+    return [parse(completion[0]["content"]) for completion in completions]
+
 
 def extract_xml_identity(text: str) -> str:
-    id = text.split("<majority>")[-1]
-    id = id.split("</majority>")[0]
-    return id.strip()
+    return parse(text).extract("majority")
 
 
 def extract_xml_final_answer(text: str) -> str:
-    answer = text.split("<answer>")[-1]
-    answer = answer.split("</answer>")[0]
-    return answer.strip()
+    return parse(text).extract("answer")
 
 
 def extract_xml_question(text: str) -> str:
-    question = text.split("<question>")[-1]
-    question = question.split("</question>")[0]
-    return question.strip()
+    return parse(text).extract("question")
 
 
 def extract_xml_ids(text: str) -> str:
@@ -63,30 +99,7 @@ def extract_answers(text: str) -> str:
 
 
 def count_xml(text) -> float:
-    count = 0.0
-    if text.count("<summarize_feedback>\n") == 1:
-        count += 0.125
-    if text.count("\n</summarize_feedback>\n") == 1:
-        count += 0.125
-    if text.count("<majority>\n") == 1:
-        count += 0.125
-    if text.count("\n</majority>\n") == 1:
-        count += 0.125
-    if text.count("<question>\n") == 1:
-        count += 0.125
-    if text.count("\n</question>\n") == 1:
-        count += 0.125
-    if text.count("<think>\n") == 1:
-        count += 0.125
-    if text.count("\n</think>\n") == 1:
-        count += 0.125
-    if text.count("\n<answer>\n") == 1:
-        count += 0.125
-        count -= len(text.split("\n</answer>\n")[-1]) * 0.001
-    if text.count("\n</answer>") == 1:
-        count += 0.125
-        count -= (len(text.split("\n</answer>")[-1]) - 1) * 0.001
-    return count
+    return parse(text).xml_count
 
 
 def swarm_majority(choices):
@@ -106,213 +119,140 @@ def swarm_majority(choices):
     return majority
 
 
+@lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def parse_prompt(text: str) -> PromptRecord:
+    critic_choices = extract_xml_choices(text)
+    return PromptRecord(
+        question=extract_original_question(text),
+        students=student_answers(extract_answers(text)),
+        critic_choices=tuple(critic_choices),
+        majority=tuple(swarm_majority(critic_choices)),
+    )
+
+
 # Reward functions
+@batch_memoized
 def consensus_reward_func(
     prompts, completions, weighting=2.0, logging=False, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    critic_choices = extract_xml_choices(p)
-    majority_choices = swarm_majority(critic_choices)
-    extracted_responses = [extract_xml_identity(r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "consensus_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nCritic Choice Distribution:\n{critic_choices}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in majority_choices}"
-            f.write(out_line)
+    record = parse_prompt(p)
+    critic_choices, majority_choices = record.critic_choices, record.majority
+    extracted_responses = [c.extract("majority") for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nCritic Choice Distribution:\n{critic_choices}\n\nExtracted:\n{extracted_responses[0]}\n\nGot reward? {extracted_responses[0] in majority_choices}"
+        log_sample(SAMPLES_DIR, "consensus_samps.txt", "-" * 20 + out_line)
     return [
         1.0 * weighting if r in majority_choices else 0.0 for r in extracted_responses
     ]
 
 
+@batch_memoized
 def question_recreation_reward_func(
     prompts, completions, weighting=1.0, logging=False, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    q = extract_original_question(p)
-    recreated_qs = [extract_xml_question(r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "question_recreation_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nOriginal Question:\n{q}\n\nExtracted recreation:\n{recreated_qs[0]}\n\nGot reward? {SequenceMatcher(None, recreated_qs[0], q).ratio()}"
-            f.write(out_line)
-    return [SequenceMatcher(None, r, q).ratio() * weighting for r in recreated_qs]
+    q = parse_prompt(p).question
+    recreated_qs = [c.extract("question") for c in parsed]
+    ratios = get_similarity_backend()(recreated_qs, q)
+    if logging and should_sample(STAGE):
+        out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nOriginal Question:\n{q}\n\nExtracted recreation:\n{recreated_qs[0]}\n\nGot reward? {ratios[0]}"
+        log_sample(SAMPLES_DIR, "question_recreation_samps.txt", "-" * 20 + out_line)
+    return [r * weighting for r in ratios]
 
 
+@batch_memoized
 def concensus_correctness_reward_func(
     prompts, completions, answer, weighting=2.0, logging=False, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    agent_answers = extract_answers(p)
-    extracted_responses = [extract_xml_identity(r) for r in responses]
-    chosen_rewards = []
-    for r in extracted_responses:
-        cur_reward = 0
-        if r in agent_answers:
-            if stage1_rewards.extract_xml_answer(agent_answers[r]) == answer[0]:
-                cur_reward += 1.0
-            if stage1_rewards.extract_xml_answer(agent_answers[r]).isdigit():
-                cur_reward += 0.5
-            pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-            if re.match(pattern, agent_answers[r]):
-                cur_reward += 0.5
-            pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
-            if re.match(pattern, agent_answers[r]):
-                cur_reward += 0.5
-            cur_reward += stage1_rewards.count_xml(agent_answers[r])
-        elif r in [
-            "None",
-            "No one",
-            "All answers are wrong",
-            "All answers were wrong",
-            "All are wrong",
-            "All were wrong",
-            "None are correct",
-            "None were correct",
-            "No one is correct",
-        ]:
-            agent_as = [
-                stage1_rewards.extract_xml_answer(agent_answers[id])
-                for id in agent_answers
-            ]
-            check_submissions = [
-                True if r == a else False for r, a in zip(agent_as, answer)
-            ]
-            if all(check_submissions):
-                cur_reward += 10
-        chosen_rewards += [cur_reward]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        if extracted_responses[0] in agent_answers:
-            os.makedirs(
-                f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                exist_ok=True,
-            )
-            log_file = os.path.join(
-                "model_output_samples",
-                f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-                "correctness_samps.txt",
-            )
-            with open(log_file, "a") as f:
-                f.write("-" * 20)
-                out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{agent_answers[extracted_responses[0]]}\n\nReward for choice: {chosen_rewards[0]}"
-                f.write(out_line)
+    record = parse_prompt(p)
+    extracted_responses = [c.extract("majority") for c in parsed]
+    chosen_rewards = [
+        choice_reward(r, record.students, answer) for r in extracted_responses
+    ]
+    if logging and should_sample(STAGE):
+        if extracted_responses[0] in record.students:
+            out_line = f"\nPrompt:\n{p}\n\nResponse:\n{responses[0]}\n\nChosen answer ID:\n{extracted_responses[0]}\n\nExtracted:\n{record.students[extracted_responses[0]].text}\n\nReward for choice: {chosen_rewards[0]}"
+            log_sample(SAMPLES_DIR, "correctness_samps.txt", "-" * 20 + out_line)
     return [r * weighting for r in chosen_rewards]
 
 
+@batch_memoized
 def final_correctness_reward_func(
     prompts, completions, answer, weighting=2.0, logging=False, **kwargs
 ) -> list[float]:
-    responses = [completion[0]["content"] for completion in completions]
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
     p = prompts[0][-1]["content"]
-    extracted_responses = [extract_xml_final_answer(r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "final_answer_correctness_samples.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"Prompt:\n{p}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
-            f.write(out_line)
+    extracted_responses = [c.extract("answer") for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"Prompt:\n{p}\n\nAnswer:\n{answer[0]}\n\nResponse:\n{responses[0]}\n\nExtracted:\n{extracted_responses[0]}"
+        log_sample(SAMPLES_DIR, "final_answer_correctness_samples.txt", "-" * 20 + out_line)
     return [
         1.0 * weighting if r == a else 0.0 for r, a in zip(extracted_responses, answer)
     ]
 
 
+@batch_memoized
 def strict_format_reward_func(
     completions, weighting=0.5, logging=False, **kwargs
 ) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"^<summarize_feedback>\n.*?\n</summarize_feedback>\n<majority>\n.*?\n</majority>\n<question>\n.*?\n</question>\n<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "s3_strict_format_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
+    matches = [c.strict for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
+        log_sample(SAMPLES_DIR, "s3_strict_format_samps.txt", "-" * 20 + out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def soft_format_reward_func(
     completions, weighting=0.5, logging=False, **kwargs
 ) -> list[float]:
     """Reward function that checks if the completion has a specific format."""
-    pattern = r"<summarize_feedback>.*?</summarize_feedback>\s*<majority>.*?</majority>\s*<question>.*?</question>\s*<think>.*?</think>\s*<answer>.*?</answer>"
-    responses = [completion[0]["content"] for completion in completions]
-    matches = [re.match(pattern, r) for r in responses]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "s3_soft_format_samps.txt",
-        )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
-            f.write(out_line)
+    parsed = parse_completions(completions)
+    responses = [c.text for c in parsed]
+    matches = [c.soft for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = f"\nResponse:\n{responses[0]}\n\nMatches? {matches[0]}"
+        log_sample(SAMPLES_DIR, "s3_soft_format_samps.txt", "-" * 20 + out_line)
     return [1.0 * weighting if match else 0.0 for match in matches]
 
 
+@batch_memoized
 def xmlcount_reward_func(
     completions, weighting=1.0, logging=False, **kwargs
 ) -> list[float]:
-    contents = [completion[0]["content"] for completion in completions]
-    if (random.random() < 0.01) and logging:  # 1% chance to write samples into a file
-        os.makedirs(
-            f"model_output_samples/multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            exist_ok=True,
-        )
-        log_file = os.path.join(
-            "model_output_samples",
-            f"multi_stage_gsm8k_samples_from_{os.getenv('HOSTNAME')}",
-            "count_xml_samps.txt",
+    parsed = parse_completions(completions)
+    contents = [c.text for c in parsed]
+    if logging and should_sample(STAGE):
+        out_line = (
+            f"\nResponse:\n{contents[0]}\n\nCount reward: {parsed[0].xml_count}"
         )
-        with open(log_file, "a") as f:
-            f.write("-" * 20)
-            out_line = (
-                f"\nResponse:\n{contents[0]}\n\nCount reward: {count_xml(contents[0])}"
-            )
-            f.write(out_line)
-    return [count_xml(c) * weighting for c in contents]
+        log_sample(SAMPLES_DIR, "count_xml_samps.txt", "-" * 20 + out_line)
+    return [c.xml_count * weighting for c in parsed]
+
+
+REWARD_ENGINE = RewardEngine(
+    [
+        consensus_reward_func,
+        concensus_correctness_reward_func,
+        question_recreation_reward_func,
+        final_correctness_reward_func,
+        strict_format_reward_func,
+        soft_format_reward_func,
+        xmlcount_reward_func,
+    ]
+)
 
 
 def hivemind_cumulative_reward(
@@ -327,34 +267,12 @@ def hivemind_cumulative_reward(
     """
     Dummy reward function that accumulates all rewards into one + saves JSON to node.outputs
     """
-    consensus_reward = consensus_reward_func(prompts, completions, logging=logging)
-    concensus_correctness = concensus_correctness_reward_func(
-        prompts, completions, answer, logging=logging
-    )
-    question_recreation_reward = question_recreation_reward_func(
-        prompts, completions, logging=logging
-    )
-    final_correctness = final_correctness_reward_func(
-        prompts, completions, answer, logging=logging
+    total_reward = REWARD_ENGINE.totals(
+        prompts, completions, answer=answer, logging=logging
     )
-    strict_format_reward = strict_format_reward_func(completions, logging=logging)
-    soft_format_reward = soft_format_reward_func(completions, logging=logging)
-    xmlcount_reward = xmlcount_reward_func(completions, logging=logging)
-    total_reward = [
-        sum(tup)
-        for tup in zip(
-            consensus_reward,
-            concensus_correctness,
-            question_recreation_reward,
-            final_correctness,
-            strict_format_reward,
-            soft_format_reward,
-            xmlcount_reward,
-        )
-    ]
 
     prompt = prompts[0][-1]["content"]
-    question = extract_original_question(prompt)
+    question = parse_prompt(prompt).question
     if output_signal_selector == "max":
         # Generate output line
         maximal_reward_idx, responses = (
@@ -370,6 +288,60 @@ def hivemind_cumulative_reward(
 
     if output_signal_selector != None:
         node.outputs = output_data
-        node.rewards = total_reward
+        node.rewards = total_reward.tolist()
 
     return [0.0 for _ in total_reward]
+
+
+class FinalOutputScores:
+    """
+    Per-peer table of scores for published final-stage outputs, used to pick
+    round winners.
+
+    Each (peer, question) output is scored once with REWARD_ENGINE. Outputs
+    that share a stage 3 prompt are scored as one batch, since the reward
+    functions read the prompt of the batch. Scoring does not touch node state.
+    The table is reset when the round changes.
+    """
+
+    def __init__(self, engine: RewardEngine = REWARD_ENGINE):
+        self.engine = engine
+        self.round_num = None
+        self.scores: dict[tuple[str, str], float] = {}  # (node key, question): total.
+
+    def update(self, round_num, q_to_keyed_outputs) -> int:
+        """Scores outputs ({node key: output} per question) not scored yet. Returns how many."""
+        if round_num != self.round_num:
+            self.round_num = round_num
+            self.scores = {}
+
+        batches = defaultdict(list)
+        for keyed_outputs in q_to_keyed_outputs:
+            for node_key, output in keyed_outputs.items():
+                if (node_key, output["question"]) in self.scores:
+                    continue
+                final_answer = next(iter(output["final_agent_decision"].values()))
+                batches[(output["stage3_prompt"], output["answer"])].append(
+                    (node_key, output["question"], final_answer)
+                )
+
+        for (prompt, answer), entries in batches.items():
+            prompts = [[{"role": "system", "content": prompt}]] * len(entries)
+            completions = [[{"role": "assistant", "content": e[2]}] for e in entries]
+            totals = self.engine.totals(
+                prompts, completions, answer=[answer] * len(entries)
+            )
+            for (node_key, question, _), total in zip(entries, totals):
+                self.scores[(node_key, question)] = float(total)
+        return sum(len(entries) for entries in batches.values())
+
+    def totals(self) -> dict[str, float]:
+        totals = defaultdict(float)
+        for (node_key, _), score in self.scores.items():
+            totals[node_key] += score
+        return dict(totals)
+
+    def winners(self, limit=10) -> list[str]:
+        """Node keys by total score, best first; ties by key."""
+        totals = self.totals()
+        return sorted(totals, key=lambda k: (-totals[k], k))[:limit]
@@ -9,10 +9,7 @@ def merge_stage1_question(outputs: dict[str, dict[str, Any]]):
         merged["question"] = o["question"]
         merged["answer"] = o["answer"]
         merged["agent_answers"].update(o["agent_answers"])
-    # Fill with default values. TODO: Decide if this is a good choice.
-    for agent in outputs:
-        if agent not in merged["agent_answers"]:
-            merged["agent_answers"].update({agent: "No answer received..."})
+    # Agents without an answer are left out; stage datasets are sparse.
     return merged
 
 
@@ -31,8 +28,5 @@ def merge_stage2_question(outputs: dict[str, dict[str, Any]]):
                 merged[col] = o[col]
         if "agent_opinion" in o:
             merged["agent_opinion"].update(o["agent_opinion"])
-    # Fill with default values. TODO: Decide if this is a good choice.
-    for agent in outputs:
-        if agent not in merged["agent_opinion"]:
-            merged["agent_opinion"].update({agent: "No feedback received..."})
+    # Agents without an opinion are left out; stage datasets are sparse.
     return merged
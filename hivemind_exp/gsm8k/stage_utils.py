@@ -1,16 +1,24 @@
 import logging
+import sys
+import threading
 import time
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
 from typing import Sequence
 
+from hivemind.dht import DHT
+
 import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
 import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
 import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
 from hivemind_exp.dht_utils import (
-    DHT,
     HivemindNode,
     get_dht_value,
+    get_dht_versions,
     get_outputs,
+    get_outputs_many,
     rewards_key,
 )
 from hivemind_exp.gsm8k.generate_prompts import get_stage2_samples, get_stage3_samples
@@ -20,6 +28,319 @@ from hivemind_exp.gsm8k.stage_merger import (
     merge_stage2_question,
 )
 from hivemind_exp.hivemind_utils import SingleStageData, StageData
+from hivemind_exp.incremental_dataset import IncrementalDataset
+from hivemind_exp.stage_barrier import StageBarrier
+
+
+FETCH_GRACE = 1.0  # Seconds.
+
+
+def take_items(
+    outputs: dict[str, Any],
+    limit: int,
+    peer_sample_limit: int | None = None,
+    coverage: dict[str, int] | None = None,
+) -> list:
+    """
+    Up to `limit` (and `peer_sample_limit`) items of one peer's outputs. With
+    `coverage` (answers per question hash so far, updated in place), questions
+    others already answered come first.
+    """
+    items = list(outputs.items())
+    if coverage is not None:
+        # Stable, so ties keep the order the peer published them in.
+        items.sort(key=lambda item: -coverage.get(item[0], 0))
+    items = items[: min(limit, peer_sample_limit or limit)]
+    if coverage is not None:
+        for q_hash, _ in items:
+            coverage[q_hash] = coverage.get(q_hash, 0) + 1
+    return items
+
+
+def fetch_peer_outputs(
+    dht: DHT,
+    r: int,
+    s: int,
+    node_keys: Sequence[str],
+    sample_limit: int,
+    max_workers: int = 16,
+    timeout: float = 60,
+    peer_sample_limit: int | None = None,
+    coverage: dict[str, int] | None = None,
+    refresh: bool = False,
+    batch_size: int = 16,
+    logger=logging.getLogger(__name__),
+) -> tuple[dict[str, list], dict[str, float]]:
+    """
+    Fetches round r stage s outputs of `node_keys` in batches of `batch_size`
+    peers (one DHT traversal each), up to `max_workers` batches at a time.
+
+    Results are taken in node_keys order with the same sample counting as
+    fetching peers one by one, so what gets merged does not depend on which
+    lookup finishes first. Batches not fetched once sample_limit is passed are
+    cancelled; peers not found by the `timeout` deadline are skipped.
+
+    With `coverage` (answers per question hash so far, updated in place), a
+    peer's questions that others already answered are taken first.
+    `peer_sample_limit` caps the samples taken from any one peer. With
+    `refresh`, cached outputs are read from the DHT again.
+    Returns the items per peer and each fetched peer's lookup latency in
+    seconds (that of its batch).
+    """
+    peer_items: dict[str, list] = defaultdict(list)
+    latencies: dict[str, float] = {}
+    if not node_keys:
+        return peer_items, latencies
+
+    start_time = time.monotonic()
+    deadline = start_time + timeout
+
+    def fetch(batch):
+        start = time.monotonic()
+        try:
+            return get_outputs_many(
+                dht, batch, r, s, refresh=refresh, timeout=max(deadline - start, 0)
+            )
+        finally:
+            latencies.update(dict.fromkeys(batch, time.monotonic() - start))
+
+    batches = [node_keys[i : i + batch_size] for i in range(0, len(node_keys), batch_size)]
+    sample_count = 0
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="peer-outputs")
+    try:
+        futures = [(batch, pool.submit(fetch, batch)) for batch in batches]
+        for batch, future in futures:
+            if sample_count > sample_limit:
+                break
+            try:
+                # Batches return what they found by the deadline themselves;
+                # the grace period covers handing the results back.
+                outputs = future.result(
+                    timeout=max(deadline - time.monotonic(), 0) + FETCH_GRACE
+                )
+            except FutureTimeoutError:
+                logger.info(
+                    f"Stopped fetching round {r} stage {s} outputs after {timeout}s; "
+                    f"skipping {sum(len(b) for b, f in futures if not f.done())} pending peers"
+                )
+                break
+
+            for node_key in batch:
+                if sample_count > sample_limit:
+                    break
+                if node_key not in outputs:
+                    # Skip this node's answers for the current round and stage.
+                    logger.debug(
+                        f"Found rewards published for node: {node_key} but no outputs!"
+                    )
+                    continue
+
+                items = take_items(
+                    outputs[node_key],
+                    sample_limit + 1 - sample_count,
+                    peer_sample_limit,
+                    coverage,
+                )
+                peer_items[node_key].extend(items)
+                sample_count += len(items)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    latencies = dict(latencies)  # Lookups past the deadline may still finish.
+    if latencies:
+        ordered = sorted(latencies.values())
+        logger.info(
+            f"Fetched round {r} stage {s} outputs of {len(latencies)} peers in "
+            f"{time.monotonic() - start_time:.2f}s (median {ordered[len(ordered) // 2]:.2f}s, "
+            f"max {ordered[-1]:.2f}s per peer)"
+        )
+        logger.debug(f"Per-peer output latency: {latencies}")
+    return peer_items, latencies
+
+
+def select_items(
+    node_keys: Sequence[str],
+    outputs: dict[str, dict],
+    sample_limit: int,
+    peer_sample_limit: int | None = None,
+    coverage: dict[str, int] | None = None,
+) -> dict[str, list]:
+    """Takes items of already fetched `outputs` the way fetch_peer_outputs does."""
+    peer_items: dict[str, list] = defaultdict(list)
+    sample_count = 0
+    for node_key in node_keys:
+        if sample_count > sample_limit:
+            break
+        if node_key in outputs:
+            items = take_items(
+                outputs[node_key],
+                sample_limit + 1 - sample_count,
+                peer_sample_limit,
+                coverage,
+            )
+            peer_items[node_key].extend(items)
+            sample_count += len(items)
+    return peer_items
+
+
+class StagePrefetcher:
+    """
+    Fetches peers' round r stage s - 1 outputs while this node still trains
+    stage s - 1, so building the stage s dataset only fetches what changed.
+
+    Peers keep publishing until they finish a stage. Prefetched outputs are
+    used only for peers that have not published since (see get_dht_versions);
+    the others are fetched again when the dataset is built.
+    """
+
+    def __init__(
+        self,
+        dht: DHT,
+        node: HivemindNode,
+        fetch_workers: int = 16,
+        fetch_timeout: float = 60,
+        log_tag=None,
+    ):
+        self.dht = dht
+        self.node = node
+        self.fetch_workers = fetch_workers
+        self.fetch_timeout = fetch_timeout
+        self.logger = logging.getLogger(f"{__name__}:{log_tag or node.key}")
+        self.round_stage = None
+        self.outputs: dict[str, dict] = {}
+        self.versions: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _peer_versions(self, r: int, s: int) -> dict[str, float]:
+        versions = get_dht_versions(self.dht, key=rewards_key(r, s - 1), beam_size=100)
+        versions.pop(self.node.key, None)
+        return versions
+
+    def prefetch(self, r: int, s: int):
+        """Fetches outputs of peers that published since the last prefetch."""
+        with self._lock:
+            if self.round_stage != (r, s):
+                self.round_stage = (r, s)
+                self.outputs, self.versions = {}, {}
+
+            # Versions are read first, so outputs published in between are
+            # only ever fetched again, never missed.
+            versions = self._peer_versions(r, s)
+            stale = [k for k in sorted(versions) if self.versions.get(k) != versions[k]]
+            if not stale:
+                return
+            peer_items, _ = fetch_peer_outputs(
+                self.dht,
+                r,
+                s - 1,
+                stale,
+                sys.maxsize,
+                max_workers=self.fetch_workers,
+                timeout=self.fetch_timeout,
+                refresh=True,
+                logger=self.logger,
+            )
+            for node_key, items in peer_items.items():
+                self.outputs[node_key] = dict(items)
+                self.versions[node_key] = versions[node_key]
+            self.logger.debug(
+                f"Prefetched round {r} stage {s - 1} outputs of {len(peer_items)} peers; "
+                f"{len(self.outputs)} in total"
+            )
+
+    def fresh_outputs(self, r: int, s: int) -> dict[str, dict]:
+        """
+        Prefetched outputs of peers that have not published since. Waits for a
+        prefetch in progress.
+        """
+        with self._lock:
+            if self.round_stage != (r, s) or not self.outputs:
+                return {}
+            versions = self._peer_versions(r, s)
+            return {
+                k: outputs
+                for k, outputs in self.outputs.items()
+                if versions.get(k) == self.versions[k]
+            }
+
+
+def rank_peers(rewards: dict[str, Any], exclude=None) -> list[str]:
+    """Peers by published stage reward, best first; ties and unreadable rewards by key."""
+
+    def reward(node_key):
+        try:
+            return float(rewards[node_key])
+        except (TypeError, ValueError):
+            return float("-inf")
+
+    return sorted(
+        (k for k in rewards if k != exclude), key=lambda k: (-reward(k), k)
+    )
+
+
+def log_coverage_stats(logger, r, s, q_to_keyed_items: dict[str, dict[str, Any]]):
+    answers = [len(outputs) for outputs in q_to_keyed_items.values()]
+    if not answers:
+        return
+    per_peer = Counter(k for outputs in q_to_keyed_items.values() for k in outputs)
+    logger.info(
+        f"Merged round {r} stage {s} samples: {len(answers)} questions, "
+        f"{sum(n > 1 for n in answers)} with several answers, "
+        f"{sum(answers) / len(answers):.2f} answers per question, "
+        f"questions by answer count {dict(sorted(Counter(answers).items()))}; "
+        f"{len(per_peer)} peers, at most {max(per_peer.values())} samples from one"
+    )
+
+
+def expected_peers(dht: DHT, r: int, s: int) -> int | None:
+    """
+    Peers expected to publish round r stage s - 1: those that published the
+    stage before (or, for the first stage, the same stage last round).
+    """
+    if s >= 2:
+        reference_key = rewards_key(r, s - 2)
+    elif r > 0:
+        reference_key = rewards_key(r - 1, s - 1)
+    else:
+        return None
+    return len(get_dht_value(dht, key=reference_key, beam_size=100) or {}) or None
+
+
+def local_prev_items(dht: DHT, node: HivemindNode, r: int, s: int, logger) -> list:
+    try:
+        return list(get_outputs(dht, node.key, r, s - 1, node.get_stage_outputs).items())
+    except ValueError:
+        # Joined after the round has started.
+        logger.info(f"Could not retrieve local outputs for round {r} stage {s - 1}")
+        return []
+
+
+def group_by_question(prev_items: dict[str, list]) -> dict[str, dict[str, Any]]:
+    """Groups (q_hash, (timestamp, outputs)) items of each peer by question hash."""
+    q_to_keyed_items: dict[str, dict[str, Any]] = defaultdict(dict)
+    for node_key, items in prev_items.items():
+        for q_hash, (_, outputs) in items:
+            q_to_keyed_items[q_hash][node_key] = outputs
+    return q_to_keyed_items
+
+
+def final_stage_items(
+    dht: DHT, node: HivemindNode, r: int, logger, timeout: float = 60
+) -> dict[str, list]:
+    """
+    Round r final-stage (q_hash, (timestamp, outputs)) items by peer, without
+    waiting for a quorum: this node's own from memory, and those of peers that
+    published final-stage rewards by now. Peers' outputs already in the
+    outputs cache are not fetched again; the rest are looked up in one batch.
+    """
+    final_stage = 2
+    items = {node.key: local_prev_items(dht, node, r, final_stage + 1, logger)}
+    rewards = get_dht_value(dht, key=rewards_key(r, final_stage), beam_size=100)
+    if isinstance(rewards, dict):
+        peers = rank_peers(rewards, exclude=node.key)
+        for node_key, outputs in get_outputs_many(dht, peers, r, final_stage, timeout=timeout).items():
+            items[node_key] = list(outputs.items())
+    return items
 
 
 def merged_prev_stage_datasets(
@@ -32,12 +353,18 @@ def merged_prev_stage_datasets(
     dht_sample_limit = 200,
     check_interval: float = 5,
     wait_timeout: float = 10,
+    quorum: int | float = 0.75,
+    fetch_workers: int = 16,
+    fetch_timeout: float = 60,
+    peer_sample_limit: int | None = 20,
+    prefetcher: StagePrefetcher | None = None,
     log_tag=None,
 ):
     if not log_tag:
         log_tag = node.key
 
     logger = logging.getLogger(f"{__name__}:{log_tag}")
+    barrier = StageBarrier(quorum, timeout=wait_timeout, max_interval=check_interval)
 
     merged_qs = []
 
@@ -47,56 +374,76 @@ def merged_prev_stage_datasets(
             dht, key=rewards_key(r, s - 1), beam_size=100
         )
 
-    prev_rewards: dict[str, Any] | None = get_prev_rewards()
-    start_time = time.monotonic()
-    while not prev_rewards and time.monotonic() - start_time < wait_timeout:
+    expected = expected_peers(dht, r, s) if barrier.is_fraction else None
+
+    def on_retry(have, need, interval):
+        logger.info(
+            f"Have round {r} stage {s - 1} rewards from {have}/{need} peers; "
+            f"checking again in {interval:.1f}s"
+        )
+
+    result = barrier.wait(get_prev_rewards, expected, on_retry)
+    prev_rewards: dict[str, Any] | None = result.value
+    node.put_stage_barrier_wait(r, s, result.waited)
+    if not result.reached:
         logger.info(
-            f"Can't retrieve round {r} stage {s - 1} rewards; trying again in {check_interval}s "
+            f"Starting round {r} stage {s} after {result.waited:.1f}s with rewards "
+            f"from {len(prev_rewards or {})} peers; quorum not reached"
         )
-        time.sleep(check_interval)
-        prev_rewards = get_prev_rewards()
 
     # Add the current node's local samples first.
     prev_items: dict[str, list] = defaultdict(list)
-    try:
-        prev_node_outputs = get_outputs(dht, node.key, r, s - 1, node.get_stage_outputs)
-        for item in prev_node_outputs.items():
-            prev_items[node.key].append(item)
-    except ValueError:
-        # Joined after the round has started.
-        logger.info(f"Could not retrieve local outputs for round {r} stage {s - 1}")
+    prev_items[node.key].extend(local_prev_items(dht, node, r, s, logger))
 
-    # Add other nodes' samples iff rewards are available.
+    # Add other nodes' samples iff rewards are available. Best rewarded peers
+    # come first, and questions we already have answers for are preferred, so
+    # the sample budget goes to questions with several answers to compare.
     if prev_rewards:
-        node_keys = prev_rewards.keys()
-        dht_sample_count = 0
-        for node_key in node_keys:
-            if dht_sample_count > dht_sample_limit:
-                break
-
-            if node_key == node.key:
-                continue
-            try:
-                prev_node_outputs = get_outputs(dht, node_key, r, s - 1)
-                for item in prev_node_outputs.items():
-                    prev_items[node_key].append(item)
-
-                    dht_sample_count += 1
-                    if dht_sample_count > dht_sample_limit:
-                        break
-
-            except ValueError:
-                # Skip this node's answers for the current round and stage.
-                logger.debug(
-                    f"Found rewards published for node: {node_key} but no outputs!"
-                )
+        coverage: dict[str, int] = defaultdict(int)
+        for q_hash, _ in prev_items[node.key]:
+            coverage[q_hash] += 1
+        ranked = rank_peers(prev_rewards, exclude=node.key)
+        prefetched = prefetcher.fresh_outputs(r, s) if prefetcher else {}
+        if prefetched:
+            # Only fetch peers that were not prefetched or published since.
+            delta = [k for k in ranked if k not in prefetched]
+            fetched, _ = fetch_peer_outputs(
+                dht,
+                r,
+                s - 1,
+                delta,
+                dht_sample_limit,
+                max_workers=fetch_workers,
+                timeout=fetch_timeout,
+                refresh=True,
+                logger=logger,
+            )
+            logger.info(
+                f"Using prefetched round {r} stage {s - 1} outputs of {len(prefetched)} "
+                f"peers; fetched {len(fetched)} more"
+            )
+            outputs = prefetched | {k: dict(items) for k, items in fetched.items()}
+            peer_items = select_items(
+                ranked, outputs, dht_sample_limit, peer_sample_limit, coverage
+            )
+        else:
+            peer_items, _ = fetch_peer_outputs(
+                dht,
+                r,
+                s - 1,
+                ranked,
+                dht_sample_limit,
+                max_workers=fetch_workers,
+                timeout=fetch_timeout,
+                peer_sample_limit=peer_sample_limit,
+                coverage=coverage,
+                logger=logger,
+            )
+        for node_key, items in peer_items.items():
+            prev_items[node_key].extend(items)
 
-    # Group samples by question hash.
-    q_to_keyed_items: dict[str, dict[str, Any]] = defaultdict(dict)
-    for node_key, items in prev_items.items():
-        for item in items:
-            q_hash, (_, outputs) = item
-            q_to_keyed_items[q_hash][node_key] = outputs
+    q_to_keyed_items = group_by_question(prev_items)
+    log_coverage_stats(logger, r, s - 1, q_to_keyed_items)
 
     # Merge sample lists.
     for outputs in q_to_keyed_items.values():
@@ -106,14 +453,176 @@ def merged_prev_stage_datasets(
     return samples_fn(merged_qs)
 
 
+class _FetchClosed(Exception):
+    pass
+
+
+def incremental_prev_stage_datasets(
+    dht: DHT,
+    node: HivemindNode,
+    r: int,
+    s: int,
+    merge_fn,
+    samples_fn,
+    min_questions: int = 8,
+    dht_sample_limit=200,
+    check_interval: float = 5,
+    wait_timeout: float = 10,
+    quorum: int | float = 0.75,
+    fetch_workers: int = 16,
+    fetch_timeout: float = 60,
+    peer_sample_limit: int | None = 20,
+    prefetcher: StagePrefetcher | None = None,
+    log_tag=None,
+):
+    """
+    Like merged_prev_stage_datasets, but returns an IncrementalDataset as soon
+    as `min_questions` merged questions are ready (or fetching is done).
+
+    A background thread fetches the outputs of peers as their rewards appear,
+    until the quorum wait ends, and adds their questions to the dataset.
+    Questions a new peer also answered are merged again and replaced in place.
+    Close the dataset to stop the fetcher early.
+    """
+    if not log_tag:
+        log_tag = node.key
+
+    logger = logging.getLogger(f"{__name__}:{log_tag}")
+    barrier = StageBarrier(quorum, timeout=wait_timeout, max_interval=check_interval)
+    dataset = IncrementalDataset()
+
+    # Only touched by the fetcher thread.
+    prev_items: dict[str, list] = defaultdict(list)
+    coverage: dict[str, int] = defaultdict(int)
+    fetched = {node.key}
+    sample_count = 0
+
+    def add(peer_items: dict[str, list]):
+        touched = set()
+        for node_key, items in peer_items.items():
+            prev_items[node_key].extend(items)
+            touched.update(q_hash for q_hash, _ in items)
+        if not touched:
+            return
+        q_to_keyed_items = group_by_question(prev_items)
+        q_hashes = [q for q in q_to_keyed_items if q in touched]
+        train, _ = samples_fn([merge_fn(q_to_keyed_items[q]) for q in q_hashes])
+        if dataset.closed:
+            raise _FetchClosed()
+        added = dataset.upsert(zip(q_hashes, train.to_list()))
+        logger.debug(
+            f"Added {added} and updated {len(q_hashes) - added} round {r} stage {s} "
+            f"questions from {len(peer_items)} peers; {len(dataset)} in total"
+        )
+
+    def poll():
+        # Fetches peers whose rewards appeared since the last poll.
+        nonlocal sample_count
+        if dataset.closed:
+            raise _FetchClosed()
+        rewards = get_dht_value(dht, key=rewards_key(r, s - 1), beam_size=100)
+        new_peers = [k for k in rank_peers(rewards or {}) if k not in fetched]
+        if new_peers and sample_count <= dht_sample_limit:
+            peer_items, latencies = fetch_peer_outputs(
+                dht,
+                r,
+                s - 1,
+                new_peers,
+                dht_sample_limit - sample_count,
+                max_workers=fetch_workers,
+                timeout=fetch_timeout,
+                peer_sample_limit=peer_sample_limit,
+                coverage=coverage,
+                logger=logger,
+            )
+            fetched.update(latencies)
+            sample_count += sum(len(items) for items in peer_items.values())
+            add(peer_items)
+        return rewards
+
+    def on_retry(have, need, interval):
+        logger.info(
+            f"Have round {r} stage {s - 1} rewards from {have}/{need} peers; "
+            f"checking again in {interval:.1f}s"
+        )
+
+    def fetch():
+        nonlocal sample_count
+        try:
+            local_items = local_prev_items(dht, node, r, s, logger)
+            for q_hash, _ in local_items:
+                coverage[q_hash] += 1
+            add({node.key: local_items})
+            prefetched = prefetcher.fresh_outputs(r, s) if prefetcher else {}
+            if prefetched:
+                rewards = get_dht_value(dht, key=rewards_key(r, s - 1), beam_size=100)
+                peer_items = select_items(
+                    rank_peers(rewards or {}, exclude=node.key),
+                    prefetched,
+                    dht_sample_limit,
+                    peer_sample_limit,
+                    coverage,
+                )
+                fetched.update(prefetched)
+                sample_count += sum(len(items) for items in peer_items.values())
+                add(peer_items)
+            expected = expected_peers(dht, r, s) if barrier.is_fraction else None
+            result = barrier.wait(poll, expected, on_retry)
+            if not result.reached:
+                logger.info(
+                    f"Stopped waiting for round {r} stage {s - 1} rewards after "
+                    f"{result.waited:.1f}s with {len(result.value or {})} peers; "
+                    "quorum not reached"
+                )
+            log_coverage_stats(logger, r, s - 1, group_by_question(prev_items))
+        except _FetchClosed:
+            logger.debug(f"Stopped fetching round {r} stage {s - 1} outputs")
+        except Exception:
+            logger.exception(f"Failed fetching round {r} stage {s - 1} outputs")
+        finally:
+            dataset.finish()
+
+    start_time = time.monotonic()
+    threading.Thread(target=fetch, name=f"stage-{s}-outputs", daemon=True).start()
+    dataset.wait_ready(min_questions)
+    node.put_stage_barrier_wait(r, s, time.monotonic() - start_time)
+    if not len(dataset):
+        # Fails the same way as a full merge with nothing to merge.
+        return samples_fn([])
+
+    if not dataset.finished:
+        logger.info(
+            f"Starting round {r} stage {s} with {len(dataset)} merged questions after "
+            f"{node.stage_barrier_waits[(r, s)]:.1f}s; fetching the rest in the background"
+        )
+    return dataset, dataset
+
+
 def gsm8k_stage_data(
     dht: DHT,
     node: HivemindNode,
     initial_train_dataset,
     initial_test_dataset,
     check_interval: float = 5,
+    wait_timeout: float = 10,
+    quorum: int | float = 0.75,
+    min_questions: int | None = None,
+    prefetch: bool = False,
     log_tag=None,
 ):
+    # With prefetch, peers' outputs of a stage are fetched while this node
+    # still trains it, and building the next stage's dataset fetches the rest.
+    prefetcher = StagePrefetcher(dht, node, log_tag=log_tag) if prefetch else None
+
+    # With min_questions, stage 2/3 training starts once that many merged
+    # questions are ready, while the rest are fetched in the background.
+    if min_questions:
+        prev_stage_datasets = partial(
+            incremental_prev_stage_datasets, min_questions=min_questions
+        )
+    else:
+        prev_stage_datasets = merged_prev_stage_datasets
+
     def cumulative_reward_0(**kwargs):
         return stage1_rewards.hivemind_cumulative_reward(node, **kwargs)
 
@@ -124,56 +633,45 @@ def gsm8k_stage_data(
         return stage3_rewards.hivemind_cumulative_reward(node, **kwargs)
 
     def stage2_datasets_fn(r, s):
-        return merged_prev_stage_datasets(
+        return prev_stage_datasets(
             dht,
             node,
             r,
             s,
             merge_stage1_question,
-            get_stage2_samples,
+            partial(get_stage2_samples, round_num=r),
             check_interval=check_interval,
+            wait_timeout=wait_timeout,
+            quorum=quorum,
+            prefetcher=prefetcher,
             log_tag=log_tag,
         )
 
     def stage3_datasets_fn(r, s):
-        return merged_prev_stage_datasets(
+        return prev_stage_datasets(
             dht,
             node,
             r,
             s,
             merge_stage2_question,
-            get_stage3_samples,
+            partial(get_stage3_samples, round_num=r),
             check_interval=check_interval,
+            wait_timeout=wait_timeout,
+            quorum=quorum,
+            prefetcher=prefetcher,
             log_tag=log_tag,
         )
 
+    winner_scores = stage3_rewards.FinalOutputScores()
+
     def round_winners(limit=10) -> Sequence[str]:
-        final_stage_outputs, _ = merged_prev_stage_datasets(
-            dht,
-            node,
-            node.round_num,
-            3,
-            lambda x: x,
-            lambda v: (v, v),
-            check_interval=check_interval,
-            log_tag=log_tag,
-        )
-        rewards = defaultdict(float)
-        for outputs in final_stage_outputs:
-            for node_key, output in outputs.items():
-                prompts = [
-                    [
-                        {"role": "system", "content": output["question"]},
-                        {"role": "system", "content": output["stage3_prompt"]},
-                    ],
-                ]
-                final_answer = next(iter(output["final_agent_decision"].items()))[1]
-                completions = [[{"role": "assistant", "content": final_answer}]]
-                cumulative_reward_2(prompts=prompts, completions=completions, **output)
-                rewards[node_key] += sum(node.rewards)
-
-        rewards = sorted(list(rewards.items()), key=lambda x: x[1], reverse=True)
-        return [n for n, _ in rewards][:limit]
+        # Called once this node finished the round: scores the final-stage
+        # outputs published by then, with no barrier to wait on. Outputs
+        # scored by an earlier call this round are not scored again.
+        logger = logging.getLogger(f"{__name__}:{log_tag or node.key}")
+        items = final_stage_items(dht, node, node.round_num, logger)
+        winner_scores.update(node.round_num, group_by_question(items).values())
+        return winner_scores.winners(limit)
 
     return StageData(
         round_winner_fn=round_winners,
@@ -181,11 +679,7 @@ def gsm8k_stage_data(
             SingleStageData(
                 name="0",
                 reward_funcs=[
-                    stage1_rewards.xmlcount_reward_func,
-                    stage1_rewards.soft_format_reward_func,
-                    stage1_rewards.strict_format_reward_func,
-                    stage1_rewards.int_reward_func,
-                    stage1_rewards.correctness_reward_func,
+                    *stage1_rewards.REWARD_ENGINE.views(),
                     cumulative_reward_0,
                 ],
                 datasets_fn=lambda r, s: (initial_train_dataset, initial_test_dataset),  # type: ignore
@@ -193,28 +687,20 @@ def gsm8k_stage_data(
             SingleStageData(
                 name="1",
                 reward_funcs=[
-                    stage2_rewards.proper_id_reward_func,
-                    stage2_rewards.correctness_reward_func,
-                    stage2_rewards.strict_format_reward_func,
-                    stage2_rewards.soft_format_reward_func,
-                    stage2_rewards.xmlcount_reward_func,
+                    *stage2_rewards.REWARD_ENGINE.views(),
                     cumulative_reward_1,
                 ],
                 datasets_fn=stage2_datasets_fn,  # type: ignore
+                prefetch_fn=prefetcher.prefetch if prefetcher else None,
             ),
             SingleStageData(
                 name="2",
                 reward_funcs=[
-                    stage3_rewards.consensus_reward_func,
-                    stage3_rewards.concensus_correctness_reward_func,
-                    stage3_rewards.question_recreation_reward_func,
-                    stage3_rewards.final_correctness_reward_func,
-                    stage3_rewards.strict_format_reward_func,
-                    stage3_rewards.soft_format_reward_func,
-                    stage3_rewards.xmlcount_reward_func,
+                    *stage3_rewards.REWARD_ENGINE.views(),
                     cumulative_reward_2,
                 ],
                 datasets_fn=stage3_datasets_fn,  # type: ignore
+                prefetch_fn=prefetcher.prefetch if prefetcher else None,
             ),
         ],
     )
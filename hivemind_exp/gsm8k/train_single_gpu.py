@@ -3,11 +3,6 @@ import logging
 import colorlog
 from trl import GRPOConfig, ModelConfig, TrlParser
 
-from hivemind_exp.chain_utils import (
-    ModalSwarmCoordinator,
-    WalletSwarmCoordinator,
-    setup_web3,
-)
 from hivemind_exp.gsm8k.generate_prompts import get_stage1_samples
 from hivemind_exp.runner.gensyn.testnet_grpo_runner import (
     TestnetGRPOArguments,
@@ -30,9 +25,14 @@ def main():
     model_args, grpo_args, testnet_args, training_args = parser.parse_args_and_config()
 
     # Run main training loop.
+    # web3 is only imported for testnet runs.
     if org_id := testnet_args.modal_org_id:
+        from hivemind_exp.chain_utils import ModalSwarmCoordinator, setup_web3
+
         runner = TestnetGRPORunner(ModalSwarmCoordinator(org_id, web3=setup_web3()))
     elif priv_key := testnet_args.wallet_private_key:
+        from hivemind_exp.chain_utils import WalletSwarmCoordinator, setup_web3
+
         runner = TestnetGRPORunner(WalletSwarmCoordinator(priv_key, web3=setup_web3()))
     else:
         runner = GRPORunner()
@@ -1,8 +1,10 @@
 from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import Any, Callable, Sequence
+from typing import TYPE_CHECKING, Any, Callable, Sequence
 
-import torch
+if TYPE_CHECKING:
+    # Only for annotations; importing torch costs seconds at startup.
+    import torch
 
 
 @dataclass
@@ -20,6 +22,9 @@ class HivemindNode:
         default_factory=lambda: defaultdict(dict)
     )
 
+    # Seconds spent waiting for the previous stage, by (r, s); current round only.
+    stage_barrier_waits: dict[tuple[int, int], float] = field(default_factory=dict)
+
     # Reward outputs from the last training.
     rewards: Sequence[float | int] = field(default_factory=list)
 
@@ -28,6 +33,8 @@ class HivemindNode:
     stage_num: int = 0
 
     out_expiration: int = 60 * 60 * 4  # hours
+    # Publish outputs with outputs_codec; peers from before it can't read them.
+    compact_outputs: bool = False
 
     @staticmethod
     def coordinator(*args, **kwargs):
@@ -41,13 +48,18 @@ class HivemindNode:
     def put_stage_outputs(self, r, s, question, value: tuple[float, dict]):
         self.round_cache[(r, s)][question] = value
 
+    def put_stage_barrier_wait(self, r, s, waited: float):
+        for key in [k for k in self.stage_barrier_waits if k[0] < r]:
+            del self.stage_barrier_waits[key]
+        self.stage_barrier_waits[(r, s)] = waited
+
     def clear_stage_cache(self):
         self.round_cache.clear()
 
 
 # Takes round + stage.
 DatasetsFn = Callable[
-    [int, int], tuple[torch.utils.data.Dataset, torch.utils.data.Dataset]
+    [int, int], tuple["torch.utils.data.Dataset", "torch.utils.data.Dataset"]
 ]
 
 MergeFn = Callable[[list], dict[str, dict]]
@@ -59,6 +71,8 @@ class SingleStageData:
     name: str
     reward_funcs: list[Callable]
     datasets_fn: DatasetsFn  # For train / test datasets.
+    # Called with the same (round, stage) while the previous stage trains.
+    prefetch_fn: Callable[[int, int], None] | None = None
 
 
 @dataclass
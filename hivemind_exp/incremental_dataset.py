@@ -0,0 +1,110 @@
+import threading
+from typing import Hashable, Iterable
+
+import torch
+from torch.utils.data import Dataset, Sampler
+
+
+class IncrementalDataset(Dataset):
+    """
+    Map-style dataset that a background fetcher keeps adding rows to while
+    training reads from it.
+
+    Rows are keyed (e.g. by question hash); upserting an existing key replaces
+    that row in place, so indices stay stable as the dataset grows. Rows are
+    returned with every column seen so far, missing ones set to None.
+    """
+
+    def __init__(self):
+        self._rows: list[dict] = []
+        self._index: dict[Hashable, int] = {}
+        self._columns: dict[str, None] = {}
+        self._cond = threading.Condition()
+        self.finished = False  # No more rows will be added.
+        self.closed = False  # The consumer is done; the fetcher should stop.
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def __getitem__(self, idx: int) -> dict:
+        with self._cond:
+            row = self._rows[idx]
+            return {c: row.get(c) for c in self._columns}
+
+    def upsert(self, keyed_rows: Iterable[tuple[Hashable, dict]]) -> int:
+        """Adds or replaces rows by key. Returns how many rows are new."""
+        added = 0
+        with self._cond:
+            for key, row in keyed_rows:
+                self._columns.update(dict.fromkeys(row))
+                if key in self._index:
+                    self._rows[self._index[key]] = row
+                else:
+                    self._index[key] = len(self._rows)
+                    self._rows.append(row)
+                    added += 1
+            self._cond.notify_all()
+        return added
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self.finished = True
+            self._cond.notify_all()
+
+    def wait_ready(self, min_rows: int, timeout: float | None = None) -> bool:
+        """Waits until there are `min_rows` rows or no more will be added."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: len(self._rows) >= min_rows or self.finished, timeout
+            )
+
+    def sampler(self, repeat_count: int, seed: int | None = None) -> "IncrementalSampler":
+        return IncrementalSampler(self, repeat_count, seed)
+
+
+class IncrementalSampler(Sampler):
+    """
+    Drop-in for TRL's RepeatRandomSampler over an IncrementalDataset.
+
+    An epoch is as long as the dataset was when the sampler was created, but
+    every draw is made from the rows available at that moment, preferring rows
+    not drawn yet. Rows added during training are picked up by the next draw
+    instead of the next epoch. Each index is repeated `repeat_count` times.
+    """
+
+    def __init__(
+        self, data_source: IncrementalDataset, repeat_count: int, seed: int | None = None
+    ):
+        self.data_source = data_source
+        self.repeat_count = repeat_count
+        self.num_samples = len(data_source)
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+        self._drawn: set[int] = set()
+
+    def _draw(self) -> int:
+        size = len(self.data_source)
+        fresh = [i for i in range(size) if i not in self._drawn]
+        if not fresh:
+            self._drawn.clear()
+            fresh = list(range(size))
+        idx = fresh[int(torch.randint(len(fresh), (1,), generator=self.generator))]
+        self._drawn.add(idx)
+        return idx
+
+    def __iter__(self):
+        for _ in range(self.num_samples):
+            idx = self._draw()
+            for _ in range(self.repeat_count):
+                yield idx
+
+    def __len__(self):
+        return self.num_samples * self.repeat_count
@@ -0,0 +1,177 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+OUTPUTS_TTL = 120.0  # Seconds; peers may still be publishing when a stage starts.
+OUTPUTS_CACHE_BYTES = 256 * 1024 * 1024
+BLOB_CACHE_BYTES = 64 * 1024 * 1024
+
+OutputsKey = tuple[str, int, int]  # Node key, round, stage.
+
+
+def approx_size(obj) -> int:
+    """Rough in-memory size of stage outputs, dominated by their strings."""
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(approx_size(v) for v in obj)
+    return 8
+
+
+class OutputsCache:
+    """
+    Stage outputs fetched from the DHT, keyed by (node key, round, stage).
+
+    Entries expire `ttl` seconds after they were fetched, so outputs read while
+    a peer was still publishing are fetched again. Past `max_bytes` (see
+    approx_size) the least recently used entries are evicted. advance() drops
+    entries that a new round or stage makes stale.
+    """
+
+    def __init__(
+        self,
+        ttl: float = OUTPUTS_TTL,
+        max_bytes: int = OUTPUTS_CACHE_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries: OrderedDict[OutputsKey, tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: OutputsKey) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl:
+                self._pop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: OutputsKey, value: Any):
+        size = approx_size(value)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (self.clock(), size, value)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[OutputsKey], bool] = lambda key: True):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._pop(key)
+
+    def advance(self, round_num: int, stage: int):
+        """
+        Called when training moves to `round_num`/`stage`. Drops other rounds,
+        and this round's previous and later stages, which may have been
+        fetched before every peer had finished them.
+        """
+        self.invalidate(lambda key: key[1] != round_num or key[2] >= stage - 1)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+    def _pop(self, key: OutputsKey):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class BlobCache:
+    """
+    Texts published under dht_utils.blob_key(), by digest. Being content
+    addressed they never go stale, so entries are only evicted, least
+    recently used first, past `max_bytes`. Each entry also keeps the
+    expiration time of the DHT copy, if known, so publishers can tell
+    whether it outlives their references.
+    """
+
+    def __init__(self, max_bytes: int = BLOB_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[0]
+
+    def expiration(self, digest: str) -> float:
+        """Expiration time of the DHT copy; -inf if unknown or not cached."""
+        with self._lock:
+            entry = self._entries.get(digest)
+            return entry[1] if entry else float("-inf")
+
+    def put(self, digest: str, text: str, expiration: float = float("-inf")):
+        size = len(text)
+        with self._lock:
+            if digest in self._entries:
+                expiration = max(expiration, self._pop(digest)[1])
+            if size > self.max_bytes:
+                return
+            self._entries[digest] = (text, expiration)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _pop(self, digest: str) -> tuple[str, float]:
+        entry = self._entries.pop(digest)
+        self.size -= len(entry[0])
+        return entry
+
+
+outputs_cache = OutputsCache()
+blob_cache = BlobCache()
@@ -0,0 +1,157 @@
+"""
+Wire format for stage outputs published to the DHT.
+
+A published value is `(timestamp, outputs)`. Encoded, it is a 4-byte header
+(magic + version) followed by the msgpack'd value, compressed with zlib
+using a preset dictionary of the field names and prompt scaffolding that
+every output repeats. Values that are not encoded (published by older peers)
+decode to themselves.
+
+From version 2, long texts that every peer publishes (the question, the
+prompt trained on) can be replaced by a BlobRef to a copy published once
+under dht_utils.blob_key(); see extract_blobs() and expand_blobs().
+"""
+
+import hashlib
+import zlib
+from dataclasses import dataclass
+from typing import Any
+
+import msgpack
+
+MAGIC = b"RLO"
+VERSION = 2
+COMPRESS_LEVEL = 6
+MAX_DECODED_BYTES = 4 * 1024 * 1024  # Far above real outputs; bounds what a peer can make us inflate.
+
+BLOB_REF_EXT = 1  # msgpack extension type of a BlobRef.
+BLOB_FIELDS = ("question", "stage2_prompt", "stage3_prompt")
+BLOB_MIN_CHARS = 64  # Shorter texts are smaller inline than as a reference.
+
+# Preset dictionaries by version. Changing one changes the wire format: add a
+# new version instead and keep the old ones for decoding. zlib favours matches
+# near the end, so the most common strings come last.
+DICTIONARIES = {
+    1: "".join(
+        [
+            "<summarize_feedback>\n</summarize_feedback>\n<majority>\n</majority>\n",
+            "<question>\n</question>\n<compare>\n</compare>\n<explain>\n</explain>\n",
+            "<identify>\nStudent #\n</identify>\nNone",
+            "After comparing these answers, the following feedback was given about "
+            "which answer is best: \n<criticism>Criticism #</criticism> was \n",
+            "The question we were given is: ",
+            "The following answers to this question were suggested: \n",
+            "final_agent_decision stage3_prompt agent_opinion stage2_prompt ",
+            "agent_answers answer question",
+            "\n\n\n<student>Student #</student> said \n<think>\n</think>\n<answer>\n</answer>",
+        ]
+    ).encode(),
+}
+DICTIONARIES[2] = DICTIONARIES[1]  # Adds BlobRef.
+
+
+@dataclass(frozen=True)
+class BlobRef:
+    digest: str  # blob_digest() of the text.
+
+
+def blob_digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def extract_blobs(
+    outputs: dict, fields=BLOB_FIELDS, min_chars=BLOB_MIN_CHARS
+) -> tuple[dict, dict[str, str]]:
+    """
+    Replaces the long texts in `outputs` fields with BlobRefs. Returns the
+    new outputs and the replaced texts by digest.
+    """
+    outputs = dict(outputs)
+    blobs = {}
+    for field in fields:
+        text = outputs.get(field)
+        if isinstance(text, str) and len(text) >= min_chars:
+            digest = blob_digest(text)
+            blobs[digest] = text
+            outputs[field] = BlobRef(digest)
+    return outputs, blobs
+
+
+def blob_refs(outputs: dict[str, tuple[float, dict]]) -> set[str]:
+    """Digests referenced by decoded outputs, Q: (timestamp, outputs)."""
+    return {
+        v.digest
+        for _, fields in outputs.values()
+        for v in fields.values()
+        if isinstance(v, BlobRef)
+    }
+
+
+def expand_blobs(
+    outputs: dict[str, tuple[float, dict]], texts: dict[str, str]
+) -> dict[str, tuple[float, dict]]:
+    """
+    Replaces BlobRefs in decoded outputs with `texts`. Entries referencing a
+    text not in `texts` are left out.
+    """
+    result = {}
+    for q, (ts, fields) in outputs.items():
+        refs = [v.digest for v in fields.values() if isinstance(v, BlobRef)]
+        if not refs:
+            result[q] = (ts, fields)
+        elif all(d in texts for d in refs):
+            result[q] = (
+                ts,
+                {k: texts[v.digest] if isinstance(v, BlobRef) else v for k, v in fields.items()},
+            )
+    return result
+
+
+def _pack_ext(obj):
+    if isinstance(obj, BlobRef):
+        return msgpack.ExtType(BLOB_REF_EXT, bytes.fromhex(obj.digest))
+    raise TypeError(f"cannot encode {type(obj).__name__} in stage outputs")
+
+
+def _unpack_ext(code: int, data: bytes):
+    if code == BLOB_REF_EXT:
+        return BlobRef(data.hex())
+    return msgpack.ExtType(code, data)
+
+
+def is_encoded(value: Any) -> bool:
+    return isinstance(value, bytes) and value[: len(MAGIC)] == MAGIC
+
+
+def encode_outputs(value: tuple[float, dict], version: int = VERSION) -> bytes:
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=DICTIONARIES[version])
+    packed = msgpack.packb(value, use_bin_type=True, default=_pack_ext)
+    return MAGIC + bytes([version]) + compressor.compress(packed) + compressor.flush()
+
+
+def decode_outputs(value: Any) -> Any:
+    """
+    Decodes an encode_outputs() value; anything else is returned unchanged.
+    Raises ValueError for versions newer than this peer knows, and for
+    malformed, truncated or oversized values.
+    """
+    if not is_encoded(value):
+        return value
+    if len(value) <= len(MAGIC):
+        raise ValueError("truncated stage outputs")
+    version = value[len(MAGIC)]
+    if version not in DICTIONARIES:
+        raise ValueError(f"unknown stage outputs encoding version {version}")
+    try:
+        decompressor = zlib.decompressobj(zdict=DICTIONARIES[version])
+        packed = decompressor.decompress(value[len(MAGIC) + 1 :], MAX_DECODED_BYTES)
+        if not decompressor.eof:
+            raise ValueError("truncated or oversized stage outputs")
+        ts, outputs = msgpack.unpackb(packed, raw=False, ext_hook=_unpack_ext)
+    except ValueError:
+        raise
+    except Exception as e:  # zlib.error, msgpack's errors, a malformed value.
+        raise ValueError(f"malformed stage outputs: {e}") from e
+    if not isinstance(outputs, dict):
+        raise ValueError("malformed stage outputs")
+    return ts, outputs
@@ -1,18 +1,20 @@
 import logging
 from dataclasses import dataclass
 from functools import partial
-from typing import Callable, Tuple
+from typing import TYPE_CHECKING, Callable, Tuple
 
 import hivemind
 from datasets import Dataset
 from trl import GRPOConfig, ModelConfig
 
-from hivemind_exp.chain_utils import (
-    SwarmCoordinator,
-)
+from hivemind_exp.dht_metrics import InstrumentedDHT
 from hivemind_exp.runner.grpo_runner import GRPOArguments, GRPORunner
 from hivemind_exp.trainer.gensyn.testnet_grpo_trainer import TestnetGRPOTrainer
 
+if TYPE_CHECKING:
+    # web3 is only needed once a coordinator is built, see train_single_gpu.
+    from hivemind_exp.chain_utils import SwarmCoordinator
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,7 +25,7 @@ class TestnetGRPOArguments:
     modal_org_id: str | None = None # Modal organization ID.
 
 class TestnetGRPORunner(GRPORunner):
-    def __init__(self, coordinator: SwarmCoordinator) -> None:
+    def __init__(self, coordinator: "SwarmCoordinator") -> None:
         self.coordinator = coordinator
 
     def get_initial_peers(self) -> list[str]:
@@ -36,7 +38,9 @@ class TestnetGRPORunner(GRPORunner):
     def setup_dht(self, grpo_args):
         initial_peers = grpo_args.initial_peers
 
-        dht = hivemind.DHT(start=True, startup_timeout=30, **self._dht_kwargs(grpo_args))
+        dht = InstrumentedDHT(
+            hivemind.DHT(start=True, startup_timeout=30, **self._dht_kwargs(grpo_args))
+        )
         logger.info(f"🐝 Joining swarm with initial_peers = {initial_peers}")
 
         peer_id = str(dht.peer_id)
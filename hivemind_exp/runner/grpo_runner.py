@@ -10,6 +10,13 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 from trl import GRPOConfig, ModelConfig
 from peft import LoraConfig, get_peft_model
 
+from hivemind_exp.dht_metrics import InstrumentedDHT
+from hivemind_exp.gsm8k.generate_prompts import set_prompt_budget
+from hivemind_exp.gsm8k.reward_executor import (
+    ProcessPoolRewardExecutor,
+    set_reward_executor,
+)
+from hivemind_exp.gsm8k.sample_logger import set_sample_rates
 from hivemind_exp.gsm8k.stage_utils import gsm8k_stage_data
 from hivemind_exp.hivemind_utils import HivemindNode
 from hivemind_exp.name_utils import get_name_from_peer_id
@@ -25,6 +32,11 @@ class GRPOArguments:
     host_maddr: str | None = None
     identity_path: str | None = None
     max_rounds: int = 100
+    stage_quorum: float = 0.75  # Peer count if > 1, else fraction of the last stage's peers, to wait for.
+    stage_wait_timeout: float = 10  # Seconds; training starts with what is available after.
+    stage_min_questions: int = 0  # Start stages 2/3 once this many questions are merged, fetching the rest in the background; 0 waits for all.
+    stage_prefetch: bool = False  # Fetch peers' stage outputs from halfway through training that stage.
+    compact_outputs: bool = False  # Publish stage outputs msgpack'd, compressed and with shared texts by reference; peers from before outputs_codec can't read them, so only once the swarm has upgraded.
 
     # Model arguments
     dataset_id_or_path: str = "openai/gsm8k"
@@ -41,6 +53,14 @@ class GRPOArguments:
     peft_dropout: float = 0.05 # Вместо lora_dropout
     peft_modules: list[str] = field(default_factory=lambda: ["q_proj", "k_proj", "v_proj", "o_proj", "up_proj", "down_proj", "gate_proj"])  # Вместо target_modules
 
+    # Reward arguments
+    reward_workers: int = 0  # Worker processes per reward function; 0 scores in-process.
+    sample_rates: list[float] = field(default_factory=lambda: [0.01, 0.01, 0.01])  # Per stage
+
+    # Prompt arguments
+    prompt_token_budgets: list[int] = field(default_factory=lambda: [0, 0])  # Answer/critique tokens in stage 2, 3 prompts; 0 takes the top 15.
+    fit_prompt_length: bool = False  # Pack stage 2, 3 answers/critiques into what max_prompt_length leaves after the system prompt and header.
+
     #Hugging Face Hub arguments
     hf_token: str | None = None
 
@@ -129,7 +149,7 @@ class GRPORunner:
 
     def setup_dht(self, grpo_args):
         initial_peers = grpo_args.initial_peers
-        dht = hivemind.DHT(start=True, **self._dht_kwargs(grpo_args))
+        dht = InstrumentedDHT(hivemind.DHT(start=True, **self._dht_kwargs(grpo_args)))
         if initial_peers:
             logger.info(f"🐝 Joining swarm with initial_peers = {initial_peers}")
         else:
@@ -199,8 +219,28 @@ class GRPORunner:
             node = HivemindNode(model_name_or_path, str(dht.peer_id))
         else:
             node = HivemindNode.coordinator(model_name_or_path, str(dht.peer_id))
+        node.compact_outputs = grpo_args.compact_outputs
 
-        stage_data = gsm8k_stage_data(dht, node, train_dataset, test_dataset)
+        set_sample_rates(dict(enumerate(grpo_args.sample_rates, start=1)))
+        set_prompt_budget(
+            tokenizer,
+            dict(zip((2, 3), grpo_args.prompt_token_budgets)),
+            training_args.max_prompt_length if grpo_args.fit_prompt_length else 0,
+        )
+        if grpo_args.reward_workers > 0:
+            set_reward_executor(ProcessPoolRewardExecutor(grpo_args.reward_workers))
+
+        quorum = grpo_args.stage_quorum
+        stage_data = gsm8k_stage_data(
+            dht,
+            node,
+            train_dataset,
+            test_dataset,
+            wait_timeout=grpo_args.stage_wait_timeout,
+            quorum=int(quorum) if quorum > 1 else quorum,
+            min_questions=grpo_args.stage_min_questions,
+            prefetch=grpo_args.stage_prefetch,
+        )
         stage_data.max_rounds = grpo_args.max_rounds
         trainer = trainer_factory_fn(
             dht=dht,
@@ -218,4 +258,7 @@ class GRPORunner:
         logger.info(
             f"Starting training {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} for {training_args.num_train_epochs} epochs"
         )
-        trainer.train()
+        try:
+            trainer.train()
+        finally:
+            set_reward_executor(None)
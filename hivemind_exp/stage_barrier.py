@@ -0,0 +1,79 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass
+class BarrierResult:
+    value: Any  # Last value polled; None if nothing was published in time.
+    waited: float  # Seconds spent waiting.
+    reached: bool  # Whether the quorum was met before the deadline.
+
+
+class StageBarrier:
+    """
+    Waits until enough peers have published a stage's results.
+
+    `quorum` is either a peer count (int >= 1) or a fraction (0, 1] of the
+    `expected` peer count passed to wait(). Without an expected count, a
+    fractional quorum needs a single peer. Polls start at `min_interval` and
+    back off by `backoff` up to `max_interval`. At the `timeout` deadline the
+    barrier gives up and returns whatever was published so far.
+    """
+
+    def __init__(
+        self,
+        quorum: int | float = 0.75,
+        timeout: float = 30,
+        min_interval: float = 0.5,
+        max_interval: float = 5,
+        backoff: float = 2,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        assert quorum > 0
+        self.quorum = quorum
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self.sleep = sleep
+
+    @property
+    def is_fraction(self) -> bool:
+        return not isinstance(self.quorum, int) and self.quorum <= 1
+
+    def required(self, expected: int | None) -> int:
+        if not self.is_fraction:
+            return int(self.quorum)
+        if not expected:
+            return 1
+        return max(1, math.ceil(self.quorum * expected))
+
+    def wait(
+        self,
+        poll_fn: Callable[[], dict | None],
+        expected: int | None = None,
+        on_retry: Callable[[int, int, float], None] | None = None,
+    ) -> BarrierResult:
+        """
+        Polls `poll_fn` (a map keyed by peer, or None) until it has a quorum.
+        on_retry(have, need, interval) is called before each backoff sleep.
+        """
+        need = self.required(expected)
+        start = self.clock()
+        deadline = start + self.timeout
+        interval = self.min_interval
+        while True:
+            value = poll_fn()
+            have = len(value) if value else 0
+            now = self.clock()
+            if have >= need or now >= deadline:
+                return BarrierResult(value, now - start, have >= need)
+            interval = min(interval, deadline - now)
+            if on_retry:
+                on_retry(have, need, interval)
+            self.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
@@ -0,0 +1,87 @@
+import random
+import re
+
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.tests.fake_data import STAGE_1_OUTPUTS, STAGE_2_OUTPUTS
+
+
+# Reference split/regex implementations the parser replaces.
+def legacy_extract(text, tag):
+    return text.split(f"<{tag}>")[-1].split(f"</{tag}>")[0].strip()
+
+
+def legacy_count_xml(text, tags, last):
+    count = 0.0
+    for tag in tags:
+        if text.count(f"<{tag}>\n") == 1:
+            count += 0.125
+        if text.count(f"\n</{tag}>\n") == 1:
+            count += 0.125
+    if text.count(f"\n<{last}>\n") == 1:
+        count += 0.125
+        count -= len(text.split(f"\n</{last}>\n")[-1]) * 0.001
+    if text.count(f"\n</{last}>") == 1:
+        count += 0.125
+        count -= (len(text.split(f"\n</{last}>")[-1]) - 1) * 0.001
+    return count
+
+
+STAGES = [
+    (stage1_rewards, ("think",), "answer"),
+    (stage2_rewards, ("compare", "explain"), "identify"),
+    (stage3_rewards, ("summarize_feedback", "majority", "question", "think"), "answer"),
+]
+
+
+def random_completion(rng: random.Random, tags):
+    pieces = []
+    for _ in range(rng.randint(0, 12)):
+        tag = rng.choice(tags)
+        pieces.append(
+            rng.choice(["", "\n"])
+            + rng.choice([f"<{tag}>", f"</{tag}>", "42", " junk ", "<", ">"])
+            + rng.choice(["", "\n", "\n\n"])
+        )
+    return "".join(pieces)
+
+
+def fake_texts():
+    texts = []
+    for outputs, field in ((STAGE_1_OUTPUTS, "agent_answers"), (STAGE_2_OUTPUTS, "agent_opinion")):
+        for o in outputs.values():
+            texts += o[field].values()
+    return texts
+
+
+@pytest.mark.parametrize("module,tags,last", STAGES)
+def test_parser_matches_legacy(module, tags, last):
+    rng = random.Random(0)
+    all_tags = tags + (last,)
+    texts = fake_texts() + [random_completion(rng, all_tags) for _ in range(2000)]
+    for text in texts:
+        parsed = module.parse(text)
+        assert parsed.xml_count == legacy_count_xml(text, tags, last), repr(text)
+        assert parsed.strict == bool(re.match(module.XML_SCHEMA.strict.pattern, text))
+        assert parsed.soft == bool(re.match(module.XML_SCHEMA.soft.pattern, text))
+        for tag in all_tags:
+            assert parsed.extract(tag) == legacy_extract(text, tag), repr(text)
+            assert parsed.extract_all(tag) == [
+                s.split(f"</{tag}>")[0].strip() for s in text.split(f"<{tag}>")[1:]
+            ]
+
+
+def test_overlapping_newlines():
+    # str.count does not count "\n</think>\n" twice when the newline is shared.
+    text = "<think>\n1\n</think>\n</think>\n<answer>\n2\n</answer>\n"
+    assert stage1_rewards.count_xml(text) == legacy_count_xml(text, ("think",), "answer")
+
+
+def test_reward_funcs_unchanged():
+    completions = [[{"content": "<think>\nx\n</think>\n<answer>\n95\n</answer>\n"}]]
+    assert stage1_rewards.strict_format_reward_func(completions) == [0.5]
+    assert stage1_rewards.int_reward_func(completions) == [0.5]
+    assert stage1_rewards.xmlcount_reward_func(completions) == [0.5]
@@ -0,0 +1,112 @@
+import asyncio
+import copy
+import logging
+
+import pytest
+from hivemind.utils import ValueWithExpiration
+
+from hivemind_exp.dht_metrics import DHTMetrics, InstrumentedDHT, key_family
+from hivemind_exp.dht_utils import (
+    OUTPUTS_KEY_PREFIX,
+    REWARDS_KEY,
+    get_dht_value,
+    get_dht_values,
+    outputs_key,
+    rewards_key,
+)
+
+
+class Ticks:
+    """A clock that advances `step` seconds every time it is read."""
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+class FakeDHT:
+    def __init__(self):
+        self.values = {}
+        self.peer_id = "peer"
+
+    def get(self, key, latest=False, **kwargs):
+        if key == "broken":
+            raise TimeoutError()
+        if key not in self.values:
+            return None
+        return ValueWithExpiration(self.values[key], 0)
+
+    def store(self, key, value, expiration_time, subkey=None, **kwargs):
+        self.values[key] = value
+        return True
+
+    async def get_many(self, keys, **kwargs):
+        futures = {}
+        for key in keys:
+            futures[key] = asyncio.get_running_loop().create_future()
+            futures[key].set_result(self.get(key))
+        return futures
+
+    def run_coroutine(self, coro, return_future=False):
+        return asyncio.run(coro(self, self))
+
+
+def test_key_family():
+    assert key_family(rewards_key(1, 2)) == REWARDS_KEY
+    assert key_family(outputs_key("node", 1, 2)) == OUTPUTS_KEY_PREFIX
+    assert key_family("something_else") == "other"
+
+
+def test_records_gets_stores_and_batches():
+    metrics = DHTMetrics(clock=Ticks(0.003))  # Every call takes 3 ms.
+    dht = InstrumentedDHT(FakeDHT(), metrics)
+    assert dht.peer_id == "peer"
+
+    dht.store(rewards_key(0, 0), "x" * 100, 0)
+    assert get_dht_value(dht, key=rewards_key(0, 0), beam_size=100) == "x" * 100
+    assert get_dht_value(dht, key=rewards_key(0, 1), beam_size=100) is None
+    with pytest.raises(TimeoutError):
+        dht.get("broken")
+    keys = [outputs_key(n, 0, 0) for n in ("a", "b", "c")]
+    dht.store(keys[0], "y" * 10, 0)
+    assert get_dht_values(dht, keys, beam_size=20)[keys[0]] == "y" * 10
+
+    rollup = metrics.rollup(reset=True)
+    assert rollup["store"][REWARDS_KEY]["bytes"] == 100
+    gets = rollup["get"][REWARDS_KEY]
+    assert (gets["count"], gets["empty"], gets["empty_rate"]) == (2, 1, 0.5)
+    assert (gets["bytes"], gets["beam_sizes"]) == (100, {100: 2})
+    assert gets["p50_ms"] == 5  # 3 ms falls in the 2-5 ms bucket.
+    assert rollup["get"]["other"]["errors"] == 1
+    batch = rollup["get_many"][OUTPUTS_KEY_PREFIX]
+    assert (batch["count"], batch["empty"], batch["bytes"]) == (3, 2, 10)
+    assert batch["beam_sizes"] == {20: 3}
+    assert metrics.rollup() == {}
+
+
+def test_log_lines_are_structured(caplog):
+    metrics = DHTMetrics(clock=Ticks(60.0))
+    dht = InstrumentedDHT(FakeDHT(), metrics)
+    dht.get(rewards_key(0, 0))
+
+    with caplog.at_level(logging.INFO):
+        metrics.log(logging.getLogger("test"))
+    (record,) = caplog.records
+    assert record.dht_op == "get"
+    assert record.key_family == REWARDS_KEY
+    assert record.empty_rate == 1.0
+    assert record.p95_ms == record.max_ms == 60000  # Past the last bucket.
+
+
+def test_wrapper_copies_without_recursing():
+    dht = InstrumentedDHT(FakeDHT(), DHTMetrics())
+    clone = copy.copy(dht)
+    assert clone.dht is dht.dht and clone.peer_id == "peer"
+    with pytest.raises(AttributeError):
+        InstrumentedDHT.__new__(InstrumentedDHT).peer_id
+    with pytest.raises(AttributeError):
+        dht.__getstate_missing__
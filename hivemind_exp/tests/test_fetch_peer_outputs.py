@@ -0,0 +1,150 @@
+import itertools
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import hivemind_exp.gsm8k.stage_utils as stage_utils
+from hivemind_exp.gsm8k.stage_utils import fetch_peer_outputs
+
+PEERS = [f"peer{i}" for i in range(30)]
+
+
+def fake_outputs(node_key):
+    i = int(node_key[4:])
+    if i % 7 == 3:
+        raise ValueError("no outputs")
+    return {f"q{i}_{j}": (0.0, {"answer": node_key}) for j in range(i % 4 + 1)}
+
+
+def sequential(node_keys, limit):
+    # The one-peer-at-a-time loop fetch_peer_outputs replaced.
+    items, count = {}, 0
+    for node_key in node_keys:
+        if count > limit:
+            break
+        try:
+            outputs = fake_outputs(node_key)
+        except ValueError:
+            continue
+        for item in outputs.items():
+            items.setdefault(node_key, []).append(item)
+            count += 1
+            if count > limit:
+                break
+    return items
+
+
+def patch_get_outputs(monkeypatch, delay=lambda key: random.uniform(0, 0.02)):
+    calls = []
+    lock = threading.Lock()
+
+    def get_outputs_many(dht, node_keys, r, s, refresh=False, timeout=None):
+        with lock:
+            calls.extend(node_keys)
+        delays = {k: delay(k) for k in node_keys}
+        time.sleep(min(max(delays.values()), timeout))
+        results = {}
+        for node_key in node_keys:
+            try:
+                if delays[node_key] <= timeout:
+                    results[node_key] = fake_outputs(node_key)
+            except ValueError:
+                pass
+        return results
+
+    monkeypatch.setattr(stage_utils, "get_outputs_many", get_outputs_many)
+    return calls
+
+
+def test_matches_sequential(monkeypatch):
+    patch_get_outputs(monkeypatch)
+    for limit, batch_size in itertools.product((0, 5, 17, 200), (1, 4, 16)):
+        items, latencies = fetch_peer_outputs(
+            None, 0, 0, PEERS, limit, max_workers=8, batch_size=batch_size
+        )
+        assert dict(items) == sequential(PEERS, limit)
+        assert list(items) == list(sequential(PEERS, limit))
+        assert set(items) <= set(latencies)
+
+
+def test_stops_at_sample_limit(monkeypatch):
+    calls = patch_get_outputs(monkeypatch, delay=lambda key: 0.05)
+    fetch_peer_outputs(None, 0, 0, PEERS, 2, max_workers=2, batch_size=4)
+    assert len(calls) < len(PEERS)
+
+
+def test_deadline_skips_slow_peers(monkeypatch):
+    patch_get_outputs(monkeypatch, delay=lambda key: 1.0 if key == "peer2" else 0)
+    start = time.monotonic()
+    items, _ = fetch_peer_outputs(None, 0, 0, PEERS, 200, max_workers=4, timeout=0.2)
+    assert time.monotonic() - start < 0.9
+    # Peers found in time are kept, even those after the slow one.
+    assert "peer2" not in items
+    assert list(items) == list(sequential([k for k in PEERS if k != "peer2"], 200))
+
+
+def test_rank_peers():
+    rewards = {"b": 1.0, "a": 1.0, "me": 9.0, "c": 3.5, "d": None}
+    assert stage_utils.rank_peers(rewards, exclude="me") == ["c", "a", "b", "d"]
+
+
+def test_coverage_favours_answered_questions(monkeypatch):
+    # Two verbose peers answer 60 questions of their own; the rest answer the
+    # same 10 questions the local node has.
+    outputs = {
+        f"v{i}": {f"v{i}_{j}": (0.0, {}) for j in range(60)} for i in range(2)
+    } | {f"p{i}": {f"q{(i + j) % 20}": (0.0, {}) for j in range(10)} for i in range(20)}
+    monkeypatch.setattr(
+        stage_utils,
+        "get_outputs_many",
+        lambda dht, node_keys, r, s, refresh=False, timeout=None: {
+            k: outputs[k] for k in node_keys
+        },
+    )
+    rewards = {"v0": 9.0, "v1": 8.0} | {f"p{i}": 1.0 for i in range(20)}
+
+    def multi_answer_questions(keys, **kwargs):
+        items, _ = fetch_peer_outputs(None, 0, 0, keys, 100, **kwargs)
+        counts = {f"q{j}": 1 for j in range(10)}
+        for peer_items in items.values():
+            for q, _ in peer_items:
+                counts[q] = counts.get(q, 0) + 1
+        return sum(n > 1 for n in counts.values()), sum(map(len, items.values()))
+
+    before, before_total = multi_answer_questions(list(rewards))
+    coverage = {f"q{j}": 1 for j in range(10)}
+    after, after_total = multi_answer_questions(
+        stage_utils.rank_peers(rewards), peer_sample_limit=8, coverage=coverage
+    )
+    assert after > before
+    assert after_total <= before_total
+    assert coverage["q0"] > 1
+
+
+def test_peer_sample_limit(monkeypatch):
+    patch_get_outputs(monkeypatch, delay=lambda key: 0)
+    items, _ = fetch_peer_outputs(None, 0, 0, PEERS, 200, peer_sample_limit=2)
+    assert max(len(v) for v in items.values()) == 2
+
+
+def test_final_stage_items_do_not_wait(monkeypatch):
+    calls = patch_get_outputs(monkeypatch, delay=lambda key: 0)
+    node = SimpleNamespace(key="me")
+    monkeypatch.setattr(stage_utils, "StageBarrier", None)  # Never waits for a quorum.
+    monkeypatch.setattr(
+        stage_utils, "local_prev_items", lambda dht, node, r, s, logger: [("q", (0.0, {}))]
+    )
+    rewards = {"me": 3.0, "peer1": 1.0, "peer2": 2.0, "peer3": 0.5}
+    monkeypatch.setattr(stage_utils, "get_dht_value", lambda dht, key, beam_size: rewards)
+
+    items = stage_utils.final_stage_items(None, node, 0, logger=None)
+    assert calls == ["peer2", "peer1", "peer3"]  # One batch, this node excluded.
+    assert items == {
+        "me": [("q", (0.0, {}))],
+        "peer1": list(fake_outputs("peer1").items()),
+        "peer2": list(fake_outputs("peer2").items()),
+    }  # peer3 published no outputs.
+
+    monkeypatch.setattr(stage_utils, "get_dht_value", lambda dht, key, beam_size: None)
+    assert stage_utils.final_stage_items(None, node, 0, logger=None) == {"me": [("q", (0.0, {}))]}
@@ -28,3 +28,148 @@ def test_get_stage3_samples_missing_agents():
     del s1["agent_opinion"][CK]
     del s2["agent_opinion"]["0"]
     get_stage3_samples([s1, s2])
+
+
+def test_pick_k_cols_matches_full_sort():
+    answers = [a for o in STAGE_1_OUTPUTS.values() for a in o["agent_answers"].values()]
+    answers.append("<answer>\n95\n</answer>")
+    texts = {str(i): answers[i % len(answers)] for i in range(0, 40, 3)}
+    datum = next(
+        stage_generator(
+            [{"question": STAGE_1_MERGED["question"], "answer": "95", "agent_answers": texts}]
+        )
+    )
+
+    totals = stage1_rewards.top_k_cumulative_reward(
+        [[{"content": datum["question"]}]],
+        [[{"content": t}] for t in texts.values()],
+        ["95"] * len(texts),
+    )
+    tiebreakers = (hashlib.md5(f"agent_answers_{a}".encode()).hexdigest() for a in texts)
+    expected = sorted(zip(totals, tiebreakers, texts))
+    for k in (0, 5, 15, 40):
+        assert pick_k_cols(datum, 2, default_k=k) == tuple(
+            a for *_, a in expected[max(len(expected) - k, 0) :]
+        )
+
+
+def test_stage_datasets_are_sparse_and_in_memory():
+    s1 = copy.deepcopy(STAGE_1_MERGED)
+    s2 = copy.deepcopy(s1)
+    del s2["agent_answers"]["0"]
+    dataset, _ = get_stage2_samples([s1, s2])
+    assert dataset.cache_files == []
+    assert not any(c.startswith("agent_answers_") for c in dataset.column_names)
+
+    assert agent_texts(dataset[0], "agent_answers") == s1["agent_answers"]
+    assert agent_texts(dataset[1], "agent_answers") == s2["agent_answers"]
+    prompt = dataset[1]["prompt"][-1]["content"]
+    assert prompt.count("<student>") == len(s2["agent_answers"])
+
+
+def test_prompt_fragments_rendered_once_per_round():
+    fragments = PromptFragmentCache()
+    datum = next(stage_generator([STAGE_1_MERGED]))
+    uncached = generate_stage2_user_prompt(datum)
+
+    assert generate_stage2_user_prompt(datum, 0, fragments) == uncached
+    misses = fragments.misses
+    assert misses == len(STAGE_1_MERGED["agent_answers"]) + 1
+    assert generate_stage2_user_prompt(datum, 0, fragments) == uncached
+    assert (fragments.hits, fragments.misses) == (1, misses)
+
+    # Dropping the first agent renumbers every other student.
+    sparse = copy.deepcopy(STAGE_1_MERGED)
+    del sparse["agent_answers"][min(sparse["agent_answers"])]
+    sparse = next(stage_generator([sparse]))
+    assert generate_stage2_user_prompt(sparse, 0, fragments) == generate_stage2_user_prompt(sparse)
+    assert fragments.misses == 2 * misses - 1
+
+    # A new round starts from scratch.
+    generate_stage2_user_prompt(datum, 1, fragments)
+    assert fragments.misses == 3 * misses - 1
+    assert fragments.round_num == 1
+
+
+def test_prompt_fragments_follow_republished_answers():
+    fragments = PromptFragmentCache()
+    datum = next(stage_generator([STAGE_1_MERGED]))
+    generate_stage2_user_prompt(datum, 0, fragments)
+    misses = fragments.misses
+
+    # A peer republishes a different answer mid-round: only its fragment and the prompt re-render.
+    datum = copy.deepcopy(datum)
+    datum["agent_answers"][0]["text"] += " (revised)"
+    prompt = generate_stage2_user_prompt(datum, 0, fragments)
+    assert prompt == generate_stage2_user_prompt(datum)
+    assert "(revised)" in prompt
+    assert fragments.misses == misses + 2
+
+
+def test_stage3_prompt_reuses_stage2_rendering():
+    fragments = PromptFragmentCache()
+    stage2_prompt = generate_stage2_user_prompt(
+        next(stage_generator([STAGE_1_MERGED])), 0, fragments
+    )
+    datum = next(stage_generator([STAGE_2_MERGED]))
+    assert generate_stage3_user_prompt(datum, 0, fragments) == generate_stage3_user_prompt(datum)
+
+    datum["stage2_prompt"] = None
+    prompt = generate_stage3_user_prompt(datum, 0, fragments)
+    assert prompt.startswith(stage2_prompt + "  \n")
+
+
+class WhitespaceTokenizer:
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": text.split()}
+
+
+def test_pick_k_cols_packs_token_budget():
+    texts = {
+        "a": "<answer>\n95\n</answer>",
+        "b": "<think>\n" + "x " * 50 + "\n</think>\n<answer>\n95\n</answer>\n",
+        "c": "<answer>\n7\n</answer>",
+    }
+    datum = next(
+        stage_generator(
+            [{"question": STAGE_1_MERGED["question"], "answer": "95", "agent_answers": texts}]
+        )
+    )
+    ranked = pick_k_cols(datum, 2)
+    assert ranked == ("c", "a", "b")
+
+    tokenizer = WhitespaceTokenizer()
+    overhead = len(FRAGMENT_TEMPLATES[2].split())
+    budget = PromptBudget(tokenizer, {2: 2 * (3 + overhead)})
+    # "b" ranks first but does not fit; the next best answers that do are packed.
+    assert pick_k_cols(datum, 2, budget=budget) == ("c", "a")
+    assert pick_k_cols(datum, 2, default_k=1, budget=budget) == ("a",)
+    assert budget.stats[2] == {"prompts": 2, "truncated": 1, "answers": 3, "tokens": 3 * (3 + overhead)}
+
+    budget.log_stats(2)
+    assert 2 not in budget.stats
+    assert not PromptBudget(tokenizer, {2: 0}).limits(2)
+    assert not PromptBudget(None, {2: 100}).limits(2)
+
+
+def test_prompt_budget_fits_max_prompt_length():
+    texts = {"a": "<answer>\n95\n</answer>", "b": "<answer>\n7\n</answer>"}
+    datum = next(
+        stage_generator(
+            [{"question": STAGE_1_MERGED["question"], "answer": "95", "agent_answers": texts}]
+        )
+    )
+    tokenizer = WhitespaceTokenizer()
+    header = "The question we were given is: " + datum["question"]
+    fixed = len(STAGE2_SYSTEM_PROMPT.split()) + len(header.split())
+    per_answer = 3 + len(FRAGMENT_TEMPLATES[2].split())
+
+    # What the system prompt and header leave of the prompt holds one answer...
+    budget = PromptBudget(tokenizer, max_prompt_length=fixed + per_answer)
+    assert budget.limits(2) and budget.budget(2, header) == per_answer
+    assert len(pick_k_cols(datum, 2, budget=budget, header=header)) == 1
+    # ...a longer header (e.g. a stage-2 prompt in stage 3) leaves less room...
+    assert pick_k_cols(datum, 2, budget=budget, header=header + " x") == ()
+    # ...and explicit budgets still cap it.
+    budget = PromptBudget(tokenizer, {2: per_answer}, max_prompt_length=fixed + 2 * per_answer)
+    assert budget.budget(2, header) == per_answer
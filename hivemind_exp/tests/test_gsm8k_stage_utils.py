@@ -13,6 +13,7 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 from trl import GRPOConfig
 
 from hivemind_exp.dht_utils import ROUND_STAGE_NUMBER_KEY, outputs_key
+from hivemind_exp.gsm8k.generate_prompts import agent_texts
 from hivemind_exp.gsm8k.stage_utils import (
     HivemindNode,
     get_stage2_samples,
@@ -24,6 +25,7 @@ from hivemind_exp.gsm8k.stage_utils import (
     rewards_key,
 )
 from hivemind_exp.hivemind_utils import SingleStageData
+from hivemind_exp.outputs_codec import decode_outputs
 from hivemind_exp.tests.fake_data import (
     CK,
     QUESTION,
@@ -63,12 +65,11 @@ def wrap_datasets_fn(stage: SingleStageData, check):
     stage.datasets_fn = wrapped
 
 
-def check_dataset(prefix: str, min_count: int, dataset: Dataset):
-    c = 0
-    for feature in dataset.features:
-        if feature.startswith(prefix):
-            c += 1
-    assert c >= min_count
+def check_dataset(field: str, min_count: int, dataset: Dataset):
+    agents = set()
+    for row in dataset:
+        agents |= agent_texts(row, field).keys()
+    assert len(agents) >= min_count
 
 
 def create_dht_and_trainer(tmp_path, node, min_peers=1, initial_peers=[]):
@@ -196,24 +197,20 @@ def test_merged_prev_stage_datasets(
     cf, nf = merge_coord()[0][0], merge_node()[0][0]
 
     # Local.
-    assert cf[f"{group_field}_{CK}"] == coord_expected
-    assert f"{group_field}_{node.key}" not in cf
+    assert agent_texts(cf, group_field) == {CK: coord_expected}
 
     # Local.
-    assert f"{group_field}_{CK}" not in nf
-    assert nf[f"{group_field}_{node.key}"] == node_expected
+    assert agent_texts(nf, group_field) == {node.key: node_expected}
 
     ## Check merged outputs with visible rewards!
     store_dummy_rewards(dht, [coord.key, node.key], 0, stage)
     cf, nf = merge_coord()[0][0], merge_node()[0][0]
 
     # Local.
-    assert cf[f"{group_field}_{CK}"] == coord_expected
-    assert f"{group_field}_{node.key}" not in cf
+    assert agent_texts(cf, group_field) == {CK: coord_expected}
 
     # Local + DHT.
-    assert nf[f"{group_field}_{CK}"] == node_expected
-    assert nf[f"{group_field}_{node.key}"] == node_expected
+    assert agent_texts(nf, group_field) == {CK: node_expected, node.key: node_expected}
 
 
 def test_gsm8k_stage_data(tmp_path):
@@ -244,7 +241,7 @@ def test_gsm8k_stage_data(tmp_path):
 
     def check_outputs(outputs: dict[str, tuple] | None, output_checks={}):
         assert outputs
-        qo = outputs[QUESTION][1]
+        qo = decode_outputs(outputs[QUESTION])[1]
         assert qo["question"] == QUESTION
         assert qo["answer"] == "42"
         for k, check in output_checks.items():
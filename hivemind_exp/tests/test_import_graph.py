@@ -0,0 +1,10 @@
+import pytest
+
+from hivemind_exp.benchmarks.import_time import TARGETS, import_profile
+
+
+@pytest.mark.parametrize("module", list(TARGETS))
+def test_no_heavy_imports(module):
+    _, forbidden = TARGETS[module]
+    _, loaded = import_profile(module)
+    assert not {m.split(".")[0] for m in loaded} & set(forbidden)
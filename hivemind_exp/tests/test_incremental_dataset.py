@@ -0,0 +1,139 @@
+import threading
+
+import pytest
+from datasets import Dataset
+
+import hivemind_exp.gsm8k.stage_utils as stage_utils
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.incremental_dataset import IncrementalDataset
+
+
+def test_upsert_and_columns():
+    dataset = IncrementalDataset()
+    assert dataset.upsert([("a", {"q": 1}), ("b", {"q": 2})]) == 2
+    assert dataset.upsert([("a", {"q": 3, "extra": "x"})]) == 0
+    assert len(dataset) == 2
+    assert dataset[0] == {"q": 3, "extra": "x"}
+    assert dataset[1] == {"q": 2, "extra": None}
+    assert [row["q"] for row in dataset] == [3, 2]
+
+
+def test_wait_ready():
+    dataset = IncrementalDataset()
+    assert not dataset.wait_ready(1, timeout=0.01)
+    threading.Timer(0.05, dataset.upsert, [[("a", {})]]).start()
+    assert dataset.wait_ready(1, timeout=5)
+    threading.Timer(0.05, dataset.finish).start()
+    assert dataset.wait_ready(10, timeout=5)
+
+
+def test_sampler_draws_rows_added_during_epoch():
+    dataset = IncrementalDataset()
+    dataset.upsert((i, {"i": i}) for i in range(2))
+    sampler = dataset.sampler(repeat_count=3, seed=0)
+    assert len(sampler) == 6
+
+    it = iter(sampler)
+    first = [next(it) for _ in range(6)]
+    assert sorted(first) == [0, 0, 0, 1, 1, 1]
+    assert first[:3] == [first[0]] * 3
+
+    # Only the new rows are fresh, so later epochs draw them first.
+    dataset.upsert((i, {"i": i}) for i in range(2, 6))
+    drawn = [i for _ in range(2) for i in list(sampler)[::3]]
+    assert sorted(drawn) == [2, 3, 4, 5]
+
+
+def prev_stage(monkeypatch, peers, local=("q0", "q1"), **kwargs):
+    # Peer i answers questions q{i} and q{i + 10}; each rewards poll shows one more peer.
+    published = []
+
+    def get_dht_value(dht, key, beam_size=None):
+        if len(published) < len(peers):
+            published.append(peers[len(published)])
+        return {k: 1.0 for k in published}
+
+    def get_outputs(dht, node_key, r, s, get_cached_fn=None, refresh=False):
+        if node_key == "local":
+            return {q: (0.0, "local") for q in local}
+        i = int(node_key[4:])
+        return {f"q{i}": (0.0, node_key), f"q{i + 10}": (0.0, node_key)}
+
+    def get_outputs_many(dht, node_keys, r, s, refresh=False, timeout=None):
+        return {k: get_outputs(dht, k, r, s) for k in node_keys}
+
+    def samples_fn(values):
+        if not values:
+            raise ValueError("No samples")
+        rows = Dataset.from_list(values)
+        return rows, rows
+
+    monkeypatch.setattr(stage_utils, "get_dht_value", get_dht_value)
+    monkeypatch.setattr(stage_utils, "get_outputs", get_outputs)
+    monkeypatch.setattr(stage_utils, "get_outputs_many", get_outputs_many)
+    node = HivemindNode("test", "local")
+    train, test = stage_utils.incremental_prev_stage_datasets(
+        None,
+        node,
+        0,
+        1,
+        lambda outputs: {"answers": sorted(outputs.values())},
+        samples_fn,
+        **{"check_interval": 0.05, "quorum": len(peers) or 1, "wait_timeout": 5, **kwargs},
+    )
+    assert train is test
+    return node, train
+
+
+def test_stage_barrier_waits_keep_current_round():
+    node = HivemindNode("test", "local")
+    node.put_stage_barrier_wait(0, 1, 1.0)
+    node.put_stage_barrier_wait(0, 2, 2.0)
+    node.put_stage_barrier_wait(1, 1, 3.0)
+    assert node.stage_barrier_waits == {(1, 1): 3.0}
+
+
+def test_incremental_prev_stage_datasets(monkeypatch):
+    peers = [f"peer{i}" for i in range(5)]
+    node, dataset = prev_stage(monkeypatch, peers, min_questions=2)
+    assert (0, 1) in node.stage_barrier_waits
+    assert len(dataset) >= 2
+    assert not dataset.finished
+
+    assert dataset.wait_ready(100, timeout=10)
+    answers = [row["answers"] for row in dataset]
+    assert len(answers) == 10  # q0-q4 and q10-q14.
+    # Questions the local node answered were merged again with peer answers.
+    assert answers[:2] == [["local", "peer0"], ["local", "peer1"]]
+
+
+def test_stops_when_closed(monkeypatch):
+    peers = [f"peer{i}" for i in range(100)]
+    _, dataset = prev_stage(monkeypatch, peers, min_questions=1)
+    dataset.close()
+    size = len(dataset)
+    assert dataset.finished
+    assert size < 100
+
+
+def test_no_questions(monkeypatch):
+    with pytest.raises(ValueError):
+        prev_stage(monkeypatch, [], local=(), min_questions=1, wait_timeout=0.2)
+
+
+class FakePrefetcher:
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def fresh_outputs(self, r, s):
+        return self.outputs
+
+
+def test_prefetched_peers_are_not_fetched_again(monkeypatch):
+    peers = [f"peer{i}" for i in range(3)]
+    prefetcher = FakePrefetcher({"peer0": {"q0": (0.0, "peer0 early")}})
+    _, dataset = prev_stage(monkeypatch, peers, min_questions=1, prefetcher=prefetcher)
+    assert dataset.wait_ready(100, timeout=10)
+    answers = [row["answers"] for row in dataset]
+    assert answers[0] == ["local", "peer0 early"]
+    assert ["peer1"] in answers and ["peer0"] not in answers
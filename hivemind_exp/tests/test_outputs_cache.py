@@ -0,0 +1,236 @@
+import asyncio
+import threading
+
+from hivemind.utils import ValueWithExpiration
+
+from hivemind_exp.dht_utils import (
+    BLOB_EXPIRATION_SLACK,
+    blob_key,
+    get_outputs,
+    get_outputs_many,
+    outputs_key,
+    publish_blobs,
+    publish_blobs_async,
+)
+from hivemind_exp.outputs_cache import (
+    BlobCache,
+    OutputsCache,
+    approx_size,
+    blob_cache,
+    outputs_cache,
+)
+from hivemind_exp.outputs_codec import encode_outputs, extract_blobs
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDHT:
+    def __init__(self):
+        self.values = {}
+        self.expirations = {}
+        self.gets = 0
+        self.stores = []
+        self.batches = []
+        self.slow = set()  # Keys whose lookup never completes.
+
+    def get(self, key, **kwargs):
+        self.gets += 1
+        if key not in self.values:
+            return None
+        value = self.values[key]
+        if isinstance(value, dict):
+            value = {k: ValueWithExpiration(v, 0) for k, v in value.items()}
+        return ValueWithExpiration(value, self.expirations.get(key, 0))
+
+    def store(self, key, value, expiration_time, **kwargs):
+        self.stores.append(key)
+        self.values[key] = value
+        self.expirations[key] = expiration_time
+
+    async def get_many(self, keys, return_futures=False, **kwargs):
+        self.batches.append(list(keys))
+        futures = {}
+        for key in keys:
+            futures[key] = asyncio.get_running_loop().create_future()
+            if key not in self.slow:
+                futures[key].set_result(self.get(key))
+        return futures
+
+    def run_coroutine(self, coro):
+        return asyncio.run(coro(self, self))
+
+
+def test_ttl_and_counters():
+    clock = Clock()
+    cache = OutputsCache(ttl=10, clock=clock)
+    cache.put(("a", 0, 0), {"q": "x"})
+    assert cache.get(("a", 0, 0)) == {"q": "x"}
+    clock.now = 11
+    assert cache.get(("a", 0, 0)) is None
+    assert cache.get(("b", 0, 0)) is None
+    assert cache.stats() == {
+        "entries": 0,
+        "bytes": 0,
+        "hits": 1,
+        "misses": 2,
+        "expirations": 1,
+        "evictions": 0,
+    }
+
+
+def test_byte_budget_evicts_least_recently_used():
+    value = {"q": "x" * 100}
+    cache = OutputsCache(max_bytes=3 * approx_size(value))
+    for node in "abc":
+        cache.put((node, 0, 0), value)
+    cache.get(("a", 0, 0))
+    cache.put(("d", 0, 0), value)
+    assert cache.get(("b", 0, 0)) is None
+    assert all(cache.get((n, 0, 0)) for n in "acd")
+    assert cache.evictions == 1
+    assert cache.size == 3 * approx_size(value)
+
+    cache.put(("e", 0, 0), {"q": "x" * 1000})  # Larger than the whole budget.
+    assert cache.get(("e", 0, 0)) is None
+
+
+def test_advance_drops_stale_rounds_and_stages():
+    cache = OutputsCache()
+    for key in [("a", 0, 0), ("a", 1, 0), ("a", 1, 1), ("a", 1, 2)]:
+        cache.put(key, {"q": "x"})
+    cache.advance(1, 2)
+    assert [k for k in [("a", 0, 0), ("a", 1, 0), ("a", 1, 1), ("a", 1, 2)] if cache.get(k)] == [
+        ("a", 1, 0)
+    ]
+
+
+def test_get_outputs_caches_dht_reads_only():
+    outputs_cache.clear()
+    dht = FakeDHT()
+    dht.values[outputs_key("peer", 5, 0)] = {"q" * 32: (0.0, {"answer": "1"})}
+
+    expected = {"q" * 32: (0.0, {"answer": "1"})}
+    assert get_outputs(dht, "peer", 5, 0) == expected
+    assert get_outputs(dht, "peer", 5, 0) == expected
+    assert dht.gets == 1
+
+    # Late outputs are picked up on refresh.
+    dht.values[outputs_key("peer", 5, 0)]["r" * 32] = (1.0, {"answer": "2"})
+    assert len(get_outputs(dht, "peer", 5, 0, refresh=True)) == 2
+    assert dht.gets == 2
+
+    # Local outputs are always read fresh and never cached.
+    local = {"s" * 32: (0.0, {})}
+    assert get_outputs(dht, "me", 5, 0, lambda r, s: local) == local
+    local["t" * 32] = (0.0, {})
+    assert len(get_outputs(dht, "me", 5, 0, lambda r, s: local)) == 2
+    outputs_cache.clear()
+
+
+def test_get_outputs_many_batches_uncached_peers():
+    outputs_cache.clear()
+    dht = FakeDHT()
+    for peer in ("a", "b", "slow"):
+        dht.values[outputs_key(peer, 5, 0)] = {"q" * 32: (0.0, {"answer": peer})}
+    dht.slow.add(outputs_key("slow", 5, 0))
+
+    get_outputs(dht, "a", 5, 0)
+    outputs = get_outputs_many(dht, ["a", "b", "slow", "none", "b"], 5, 0, timeout=0.05)
+    assert list(outputs) == ["a", "b"]
+    assert outputs["b"] == {"q" * 32: (0.0, {"answer": "b"})}
+    assert dht.batches == [[outputs_key(p, 5, 0) for p in ("b", "slow", "none")]]
+
+    # Found peers are cached like get_outputs; missing ones are looked up again.
+    get_outputs_many(dht, ["a", "b", "none"], 5, 0)
+    assert dht.batches[1:] == [[outputs_key("none", 5, 0)]]
+    outputs_cache.clear()
+
+
+def test_blob_cache_keeps_latest_expiration():
+    cache = BlobCache(max_bytes=10)
+    cache.put("a", "xxxx", 5.0)
+    cache.put("a", "xxxx")
+    assert cache.get("a") == "xxxx"
+    assert cache.expiration("a") == 5.0
+    assert cache.expiration("b") == float("-inf")
+    cache.put("b", "yyyy")
+    cache.put("c", "zzzz")
+    assert cache.get("a") is None
+    assert cache.size == 8
+
+
+def test_blobs_are_published_once_and_resolved():
+    outputs_cache.clear()
+    blob_cache.clear()
+    dht = FakeDHT()
+    prompt = "The question we were given is: " + "x" * 100
+    fields, blobs = extract_blobs({"question": "short", "stage2_prompt": prompt})
+    assert fields["question"] == "short"
+    assert list(blobs.values()) == [prompt]
+    (digest,) = blobs
+
+    # First writer wins: a copy living long enough is not stored again.
+    dht.values[blob_key(digest)] = prompt
+    dht.expirations[blob_key(digest)] = 100.0
+    publish_blobs(dht, blobs, 50.0)
+    publish_blobs(dht, blobs, 100.0)
+    assert dht.stores == []
+    # Newer outputs would outlive it, so it is republished with some slack.
+    publish_blobs(dht, blobs, 200.0)
+    publish_blobs(dht, blobs, 210.0)
+    assert dht.stores == [blob_key(digest)]
+    assert dht.expirations[blob_key(digest)] == 200.0 + BLOB_EXPIRATION_SLACK
+
+    value = (1.0, fields)
+    dht.values[outputs_key("a", 0, 1)] = {"q" * 32: encode_outputs(value)}
+    dht.values[outputs_key("b", 0, 1)] = {"q" * 32: encode_outputs(value)}
+    expected = {"q" * 32: (1.0, {"question": "short", "stage2_prompt": prompt})}
+    blob_cache.clear()
+    assert get_outputs_many(dht, ["a", "b"], 0, 1) == {"a": expected, "b": expected}
+    assert dht.batches[-1] == [blob_key(digest)]  # One lookup for both peers.
+    assert get_outputs(dht, "a", 0, 1, refresh=True) == expected
+    assert dht.batches[-1] == [blob_key(digest)]  # Cached since.
+
+    # Outputs whose texts are missing or don't match their digest are left out.
+    dht.values[blob_key(digest)] = "tampered"
+    blob_cache.clear()
+    assert get_outputs(dht, "a", 0, 1, refresh=True) == {}
+    assert get_outputs_many(dht, ["a", "b"], 0, 1, refresh=True) == {}
+    # Partially resolved outputs are not cached: once the text is found, they are complete.
+    dht.values[blob_key(digest)] = prompt
+    assert get_outputs_many(dht, ["a", "b"], 0, 1) == {"a": expected, "b": expected}
+    assert get_outputs(dht, "a", 0, 1) == expected
+    outputs_cache.clear()
+    blob_cache.clear()
+
+
+class BlockingDHT(FakeDHT):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def run_coroutine(self, coro):
+        self.release.wait()
+        return super().run_coroutine(coro)
+
+
+def test_blobs_are_published_in_the_background():
+    blob_cache.clear()
+    dht = BlockingDHT()
+    _, blobs = extract_blobs({"stage2_prompt": "The question we were given is: " + "y" * 100})
+
+    # Returns while the lookup of existing copies is still waiting on the DHT.
+    future = publish_blobs_async(dht, blobs, 50.0)
+    assert not future.done()
+    assert dht.stores == []
+
+    dht.release.set()
+    future.result(timeout=5)
+    assert dht.stores == [blob_key(d) for d in blobs]
+    blob_cache.clear()
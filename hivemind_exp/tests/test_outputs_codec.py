@@ -0,0 +1,82 @@
+import zlib
+
+import msgpack
+import pytest
+from hivemind.utils.serializer import MSGPackSerializer
+
+from hivemind_exp.dht_utils import hash_keys
+from hivemind_exp.outputs_codec import (
+    DICTIONARIES,
+    MAGIC,
+    MAX_DECODED_BYTES,
+    BlobRef,
+    blob_refs,
+    decode_outputs,
+    encode_outputs,
+    expand_blobs,
+    extract_blobs,
+    is_encoded,
+)
+from hivemind_exp.tests.fake_data import QUESTION, QUESTION_HASH, STAGE_3_OUTPUTS
+
+
+def test_round_trip_is_smaller():
+    value = (1.5, STAGE_3_OUTPUTS["GENSYN"])
+    data = encode_outputs(value)
+    assert is_encoded(data)
+    assert decode_outputs(data) == value
+    # Still a value hivemind can store, and much smaller than the raw one.
+    assert MSGPackSerializer.loads(MSGPackSerializer.dumps(data)) == data
+    assert len(data) < len(MSGPackSerializer.dumps(value)) / 2
+
+
+def test_legacy_values_pass_through():
+    value = (1.5, {"question": QUESTION})
+    assert decode_outputs(value) is value
+    assert decode_outputs(b"not encoded") == b"not encoded"
+
+
+def test_hash_keys_decodes_mixed_peers():
+    value = (1.5, {"question": QUESTION})
+    newer = MAGIC + bytes([255]) + b"?"
+    with pytest.raises(ValueError):
+        decode_outputs(newer)
+
+    outputs = hash_keys({QUESTION: value, "b" * 32: encode_outputs(value), "c" * 32: newer})
+    assert outputs == {QUESTION_HASH: value, "b" * 32: value}
+
+
+def test_blob_refs_round_trip():
+    outputs = STAGE_3_OUTPUTS["GENSYN"]
+    fields, blobs = extract_blobs(outputs)
+    assert set(blobs.values()) == {outputs["question"], outputs["stage3_prompt"]}
+    assert fields["answer"] == outputs["answer"]
+    assert isinstance(fields["question"], BlobRef)
+
+    decoded = {"q": decode_outputs(encode_outputs((1.5, fields)))}
+    assert blob_refs(decoded) == set(blobs)
+    assert expand_blobs(decoded, blobs) == {"q": (1.5, outputs)}
+    assert expand_blobs(decoded, {}) == {}
+
+
+def compress(data, version=2):
+    compressor = zlib.compressobj(zdict=DICTIONARIES[version])
+    return MAGIC + bytes([version]) + compressor.compress(data) + compressor.flush()
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        MAGIC,
+        encode_outputs((1.5, {"question": QUESTION}))[:-4],  # Truncated.
+        MAGIC + bytes([2]) + b"not zlib",
+        compress(b"\xc1"),  # Not msgpack.
+        compress(msgpack.packb([1.5, "not a dict"])),
+        compress(msgpack.packb([1.5])),
+        compress(msgpack.packb([1.5, {"x": "x" * MAX_DECODED_BYTES}])),  # Too large.
+    ],
+)
+def test_malformed_values_raise_value_error(value):
+    with pytest.raises(ValueError):
+        decode_outputs(value)
+    assert hash_keys({"q" * 32: value}) == {}
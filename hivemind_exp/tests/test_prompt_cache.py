@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.prompt_cache import NO_CORRECT_ANSWER
+from hivemind_exp.tests.fake_data import CK, STAGE_2_MERGED, STAGE_3_OUTPUTS
+
+STAGE2_PROMPT = STAGE_2_MERGED["stage2_prompt"]
+STAGE3_PROMPT = STAGE_3_OUTPUTS[CK]["stage3_prompt"]
+
+CHOICES = ["Student #0", "Student #1", "Student #7", "None", "All are wrong", "?"]
+ANSWERS = [["95", "95"], ["95", "7"], ["7", "95"], ["7", "7"]]
+
+
+# Reference per-call scoring the prompt cache replaces.
+def legacy_choice_reward(r, agent_answers, answer):
+    cur_reward = 0
+    if r in agent_answers:
+        if stage1_rewards.extract_xml_answer(agent_answers[r]) == answer[0]:
+            cur_reward += 1.0
+        if stage1_rewards.extract_xml_answer(agent_answers[r]).isdigit():
+            cur_reward += 0.5
+        pattern = r"^<think>\n.*?\n</think>\n<answer>\n.*?\n</answer>\n$"
+        if re.match(pattern, agent_answers[r]):
+            cur_reward += 0.5
+        pattern = r"<think>.*?</think>\s*<answer>.*?</answer>"
+        if re.match(pattern, agent_answers[r]):
+            cur_reward += 0.5
+        cur_reward += stage1_rewards.count_xml(agent_answers[r])
+    elif r in NO_CORRECT_ANSWER:
+        agent_as = [
+            stage1_rewards.extract_xml_answer(agent_answers[id]) for id in agent_answers
+        ]
+        if all(r == a for r, a in zip(agent_as, answer)):
+            cur_reward += 10
+    return cur_reward
+
+
+def batch(prompt, tag):
+    completions = [[{"content": f"<{tag}>\n{c}\n</{tag}>\n"}] for c in CHOICES]
+    return [[{"role": "user", "content": prompt}]] * len(CHOICES), completions
+
+
+@pytest.mark.parametrize("answer", ANSWERS)
+def test_stage2_correctness_matches_legacy(answer):
+    prompts, completions = batch(STAGE2_PROMPT, "identify")
+    agent_answers = stage2_rewards.extract_answers(STAGE2_PROMPT)
+    expected = [2.0 * legacy_choice_reward(c, agent_answers, answer) for c in CHOICES]
+    assert (
+        stage2_rewards.correctness_reward_func(prompts, completions, answer) == expected
+    )
+
+
+@pytest.mark.parametrize("answer", ANSWERS)
+def test_stage3_correctness_matches_legacy(answer):
+    prompts, completions = batch(STAGE3_PROMPT, "majority")
+    agent_answers = stage3_rewards.extract_answers(STAGE3_PROMPT)
+    expected = [2.0 * legacy_choice_reward(c, agent_answers, answer) for c in CHOICES]
+    assert (
+        stage3_rewards.concensus_correctness_reward_func(prompts, completions, answer)
+        == expected
+    )
+
+
+def test_stage3_record():
+    record = stage3_rewards.parse_prompt(STAGE3_PROMPT)
+    choices = stage3_rewards.extract_xml_choices(STAGE3_PROMPT)
+    assert record.critic_choices == tuple(choices)
+    assert record.majority == tuple(stage3_rewards.swarm_majority(choices))
+    assert record.question == stage3_rewards.extract_original_question(STAGE3_PROMPT)
+    assert list(record.students) == ["Student #0", "Student #1"]
+
+
+def test_prompt_parsed_once_per_group():
+    stage2_rewards.parse_prompt.cache_clear()
+    prompts, completions = batch(STAGE2_PROMPT, "identify")
+    stage2_rewards.proper_id_reward_func(prompts, completions, ["95"])
+    stage2_rewards.correctness_reward_func(prompts, completions, ["95"])
+    info = stage2_rewards.parse_prompt.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
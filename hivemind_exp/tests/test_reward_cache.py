@@ -0,0 +1,108 @@
+import threading
+
+import pytest
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.reward_cache import (
+    MAX_CACHED_BATCHES,
+    BatchRewardCache,
+    batch_memoized,
+    batch_reward_cache,
+    clear_batch_cache,
+)
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.tests.fake_data import CK
+
+STAGE1_FUNCS = [
+    stage1_rewards.xmlcount_reward_func,
+    stage1_rewards.soft_format_reward_func,
+    stage1_rewards.strict_format_reward_func,
+    stage1_rewards.int_reward_func,
+    stage1_rewards.correctness_reward_func,
+]
+
+
+def make_batch():
+    prompts = [[{"role": "user", "content": "1 + 1?"}]] * 2
+    completions = [
+        [{"content": "<think>\nsum\n</think>\n<answer>\n2\n</answer>\n"}],
+        [{"content": "<answer>3</answer>"}],
+    ]
+    return prompts, completions, ["2", "2"]
+
+
+def test_cumulative_reuses_component_scores():
+    clear_batch_cache()
+    prompts, completions, answer = make_batch()
+    node = HivemindNode("test", CK)
+
+    expected = [
+        fn(prompts=prompts, completions=completions, answer=answer)
+        for fn in STAGE1_FUNCS
+    ]
+    hits = batch_reward_cache.hits
+    stage1_rewards.hivemind_cumulative_reward(
+        node, prompts=prompts, completions=completions, answer=answer
+    )
+    assert batch_reward_cache.hits - hits == len(STAGE1_FUNCS)
+    assert node.rewards == pytest.approx([sum(t) for t in zip(*expected)])
+
+
+def test_new_batch_or_weighting_recomputes():
+    calls = []
+
+    @batch_memoized
+    def reward_func(completions, weighting=1.0, **kwargs):
+        calls.append(weighting)
+        return [weighting for _ in completions]
+
+    _, completions, _ = make_batch()
+    assert reward_func(completions) == [1.0, 1.0]
+    assert reward_func(completions=completions) == [1.0, 1.0]
+    assert reward_func(completions, weighting=2.0) == [2.0, 2.0]
+    assert reward_func(list(completions)) == [1.0, 1.0]  # Equal, but a new batch.
+    assert calls == [1.0, 2.0, 1.0]
+
+    clear_batch_cache()
+    reward_func(completions)
+    assert calls == [1.0, 2.0, 1.0, 1.0]
+
+
+def test_cache_is_bounded():
+    cache = BatchRewardCache(max_batches=2)
+    batches = [[[{"content": str(i)}]] for i in range(3)]
+    for b in batches:
+        cache.put(b, "key", [0.0])
+    assert cache.get(batches[0], "key") is None
+    assert cache.get(batches[2], "key") == [0.0]
+
+
+def test_background_batches_do_not_evict_training_batch():
+    calls = []
+
+    @batch_memoized
+    def reward_func(completions, weighting=1.0, **kwargs):
+        calls.append(threading.current_thread().name)
+        return [weighting for _ in completions]
+
+    _, completions, _ = make_batch()
+    scored, resumed = threading.Event(), threading.Event()
+
+    def background():
+        # Ranks more batches than the cache holds while a training step is in flight.
+        scored.wait(5)
+        for i in range(MAX_CACHED_BATCHES + 1):
+            reward_func([[{"content": str(i)}]])
+        resumed.set()
+
+    thread = threading.Thread(target=background, name="background")
+    thread.start()
+    reward_func(completions)
+    scored.set()
+    assert resumed.wait(5)
+    assert reward_func(completions) == [1.0, 1.0]
+    thread.join(5)
+    assert calls.count("background") == MAX_CACHED_BATCHES + 1
+    assert calls.count(threading.current_thread().name) == 1
+
+    clear_batch_cache()
@@ -0,0 +1,109 @@
+import numpy as np
+
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.reward_cache import clear_batch_cache
+from hivemind_exp.gsm8k.reward_engine import RewardEngine, rank
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.tests.fake_data import CK, STAGE_1_OUTPUTS, STAGE_3_OUTPUTS
+
+
+def make_batch():
+    answers = STAGE_1_OUTPUTS[CK]["agent_answers"]
+    prompts = [[{"role": "user", "content": STAGE_1_OUTPUTS[CK]["question"]}]]
+    completions = [[{"content": a}] for a in answers.values()]
+    return prompts * len(completions), completions, ["95"] * len(completions)
+
+
+def test_views_match_component_funcs():
+    clear_batch_cache()
+    prompts, completions, answer = make_batch()
+    engine = stage1_rewards.REWARD_ENGINE
+    for fn, view in zip(engine.reward_funcs, engine.views()):
+        assert view.__name__ == fn.__name__
+        assert view(prompts=prompts, completions=completions, answer=answer) == fn(
+            prompts=prompts, completions=list(completions), answer=answer
+        )
+
+
+def test_cumulative_reward_uses_totals():
+    clear_batch_cache()
+    prompts, completions, answer = make_batch()
+    node = HivemindNode("test", CK)
+    engine = stage1_rewards.REWARD_ENGINE
+    totals = engine.totals(prompts, completions, answer=answer)
+
+    stage1_rewards.hivemind_cumulative_reward(
+        node, prompts=prompts, completions=completions, answer=answer
+    )
+    assert node.rewards == totals.tolist()
+    best = completions[engine.best(prompts, completions, answer=answer)][0]["content"]
+    assert node.outputs["agent_answers"] == {CK: best}
+
+
+def test_weights():
+    def ones(completions, **kwargs):
+        return [1.0 for _ in completions]
+
+    def index(completions, **kwargs):
+        return [float(i) for i in range(len(completions))]
+
+    engine = RewardEngine([ones, index], weights=[2.0, -1.0])
+    completions = [[{"content": ""}]] * 3
+    np.testing.assert_allclose(engine.totals(None, completions), [2.0, 1.0, 0.0])
+    assert engine.best(None, completions) == 0
+
+
+def test_rank_breaks_ties():
+    order = rank(
+        np.array([1.0, 2.0, 1.0, 1.0]),
+        np.array(["ff", "00", "0a", "0a"]),
+        np.array(["a", "b", "d", "c"]),
+    )
+    assert order.tolist() == [3, 2, 0, 1]
+
+
+
+def test_final_output_scores():
+    output = STAGE_3_OUTPUTS[CK]
+    decision = output["final_agent_decision"][CK]
+    wrong = decision.replace("<majority>\nStudent #1", "<majority>\nStudent #0")
+    wrong = wrong.replace("<answer>\n95", "<answer>\n90")
+    other_prompt = {**output, "stage3_prompt": output["stage3_prompt"] + " "}
+    outputs = [
+        {
+            "a": {**output, "final_agent_decision": {"a": wrong}},
+            "b": output,
+            "c": {**other_prompt, "final_agent_decision": {"c": decision}},
+        },
+    ]
+    calls = []
+
+    class CountingEngine(RewardEngine):
+        def totals(self, prompts, completions, **kwargs):
+            calls.append(len(completions))
+            return super().totals(prompts, completions, **kwargs)
+
+    node = HivemindNode("test", CK)
+    scores = stage3_rewards.FinalOutputScores(
+        CountingEngine(stage3_rewards.REWARD_ENGINE.reward_funcs)
+    )
+    assert scores.update(0, outputs) == 3
+    assert sorted(calls) == [1, 2]  # One batch per stage 3 prompt.
+    assert node.outputs == {} and node.rewards == []
+
+    clear_batch_cache()
+    prompts = [[{"role": "system", "content": output["stage3_prompt"]}]]
+    expected = stage3_rewards.REWARD_ENGINE.totals(
+        prompts, [[{"role": "assistant", "content": decision}]], answer=["95"]
+    )
+    totals = scores.totals()
+    assert totals["b"] == float(expected[0])
+    assert totals["a"] < totals["b"]
+    assert totals["c"] == totals["b"]
+    assert scores.winners() == ["b", "c", "a"]  # Ties by key.
+    assert scores.winners(1) == ["b"]
+
+    # Outputs already scored this round are skipped; a new round starts over.
+    assert scores.update(0, outputs) == 0
+    assert scores.update(1, outputs[:1]) == 3
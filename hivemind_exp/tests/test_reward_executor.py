@@ -0,0 +1,139 @@
+import copy
+import time
+
+import numpy as np
+import pytest
+
+import hivemind_exp.gsm8k.sample_logger as sample_logger
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+import hivemind_exp.gsm8k.stage2_rewards as stage2_rewards
+from hivemind_exp.gsm8k.generate_prompts import get_stage2_samples
+from hivemind_exp.gsm8k.reward_cache import clear_batch_cache
+from hivemind_exp.gsm8k.reward_executor import (
+    ProcessPoolRewardExecutor,
+    get_reward_executor,
+    set_reward_executor,
+)
+from hivemind_exp.gsm8k.sample_logger import SampleLogWriter
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.tests.fake_data import CK, STAGE_1_MERGED, STAGE_1_OUTPUTS
+
+
+def make_batch():
+    answers = list(STAGE_1_OUTPUTS[CK]["agent_answers"].values())
+    answers.append("<think>\nguess\n</think>\n<answer>\n7\n</answer>\n")
+    prompts = [[{"role": "user", "content": STAGE_1_OUTPUTS[CK]["question"]}]]
+    completions = [[{"content": a}] for a in answers]
+    return prompts * len(completions), completions, ["95"] * len(completions)
+
+
+def make_multi_group_batch():
+    # Two stage 2 questions: the second one is missing a student.
+    merged = copy.deepcopy(STAGE_1_MERGED)
+    sparse = copy.deepcopy(merged)
+    del sparse["agent_answers"]["0"]
+    dataset, _ = get_stage2_samples([merged, sparse])
+    completions = [
+        [{"content": f"<compare>\n</compare>\n<identify>\nStudent #{i}\n</identify>\n"}]
+        for i in (1, 3)
+    ]
+    prompts = [row["prompt"] for row in dataset for _ in completions]
+    answer = [row["answer"] for row in dataset for _ in completions]
+    return prompts, completions * 2, answer
+
+
+@pytest.fixture(scope="module")
+def executor():
+    # fork keeps the test fast; training uses spawn.
+    executor = ProcessPoolRewardExecutor(workers_per_func=2, mp_context="fork")
+    yield executor
+    executor.shutdown()
+
+
+def test_map_matches_in_process(executor):
+    prompts, completions, answer = make_batch()
+    funcs = stage1_rewards.REWARD_ENGINE.reward_funcs
+    columns = executor.map(funcs, prompts, completions, answer=answer, weighting=1.0)
+    assert columns == [
+        fn(prompts=prompts, completions=completions, answer=answer, weighting=1.0)
+        for fn in funcs
+    ]
+
+
+def first_answer_reward(prompts, completions, answer, **kwargs):
+    # Like the stage reward functions, scores the whole call against answer[0].
+    return [float(answer[0])] * len(completions)
+
+
+def test_chunks_keep_prompt_groups(executor):
+    prompts, completions, _ = make_batch()
+    answer = ["1"] + ["2"] * (len(completions) - 1)
+    (scores,) = executor.map([first_answer_reward], prompts, completions, answer=answer)
+    assert scores == [float(a) for a in answer]
+    chunks = executor._chunks(["p"] * 4, 4, {"answer": ["1", "2", "2", "2"]})
+    assert chunks == [slice(0, 1), slice(1, 2), slice(2, 4)]
+    assert executor._chunks([], 0, {}) == []
+
+
+def test_multi_group_batch_matches_in_process(executor):
+    prompts, completions, answer = make_multi_group_batch()
+    engine = stage2_rewards.REWARD_ENGINE
+    clear_batch_cache()
+    expected = engine.score(prompts, completions, answer=answer, logging=False)
+    # Each group is scored against its own prompt: Student #3 only exists in the first.
+    proper_id = engine.reward_funcs.index(stage2_rewards.proper_id_reward_func)
+    assert expected[:, proper_id].tolist() == [2.0, 2.0, 2.0, 0.0]
+
+    set_reward_executor(executor)
+    try:
+        clear_batch_cache()
+        np.testing.assert_array_equal(
+            engine.score(prompts, completions, answer=answer, logging=False), expected
+        )
+    finally:
+        set_reward_executor(None)
+        clear_batch_cache()
+
+
+class SlowSampleLogWriter(SampleLogWriter):
+    def _write(self, path, data):
+        time.sleep(0.2)  # Still writing when the pool shuts down.
+        super()._write(path, data)
+
+
+def test_workers_write_samples_on_shutdown(monkeypatch, tmp_path):
+    monkeypatch.setattr(sample_logger, "sample_writer", SlowSampleLogWriter(root=str(tmp_path)))
+    monkeypatch.setitem(sample_logger._sample_rates, stage1_rewards.STAGE, 1.0)
+    executor = ProcessPoolRewardExecutor(workers_per_func=1, mp_context="fork")
+    prompts, completions, answer = make_batch()
+    executor.map(
+        [stage1_rewards.correctness_reward_func], prompts, completions, answer=answer, logging=True
+    )
+    executor.shutdown()
+    path = tmp_path / stage1_rewards.SAMPLES_DIR / "correctness_samples.txt"
+    assert "Answer:\n95" in path.read_text()
+
+
+def test_engine_uses_executor(executor):
+    prompts, completions, answer = make_batch()
+    engine = stage1_rewards.REWARD_ENGINE
+    clear_batch_cache()
+    expected = engine.score(prompts, completions, answer=answer)
+
+    set_reward_executor(executor)
+    try:
+        clear_batch_cache()
+        np.testing.assert_array_equal(
+            engine.score(prompts, completions, answer=answer), expected
+        )
+
+        node = HivemindNode("test", CK)
+        stage1_rewards.hivemind_cumulative_reward(
+            node, prompts=prompts, completions=completions, answer=answer
+        )
+        assert node.rewards == (expected @ engine.weights).tolist()
+        assert node.outputs["agent_answers"]
+    finally:
+        set_reward_executor(None)
+        clear_batch_cache()
+    assert get_reward_executor() is None
@@ -0,0 +1,67 @@
+import os
+
+import hivemind_exp.gsm8k.sample_logger as sample_logger
+import hivemind_exp.gsm8k.stage1_rewards as stage1_rewards
+from hivemind_exp.gsm8k.sample_logger import (
+    SampleLogWriter,
+    set_sample_rates,
+    should_sample,
+)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_writes_in_submission_order(tmp_path):
+    writer = SampleLogWriter(root=str(tmp_path))
+    for i in range(100):
+        writer.submit("host", "a.txt" if i % 2 else "b.txt", f"{i},")
+    writer.flush()
+
+    assert read(tmp_path / "host" / "a.txt") == "".join(f"{i}," for i in range(1, 100, 2))
+    assert read(tmp_path / "host" / "b.txt") == "".join(f"{i}," for i in range(0, 100, 2))
+    writer.close()
+
+
+def test_rotation(tmp_path):
+    writer = SampleLogWriter(root=str(tmp_path), max_bytes=10, backup_count=2)
+    for text in ["aaaaaaaa", "bbbbbbbb", "cccccccc", "dddddddd"]:
+        writer.submit("host", "s.txt", text)
+        writer.flush()
+    writer.close()
+
+    path = tmp_path / "host" / "s.txt"
+    assert read(path) == "dddddddd"
+    assert read(f"{path}.1") == "cccccccc"
+    assert read(f"{path}.2") == "bbbbbbbb"
+    assert not os.path.exists(f"{path}.3")
+
+
+def test_full_queue_drops(tmp_path):
+    writer = SampleLogWriter(root=str(tmp_path), max_queued=1)
+    writer._thread = object()  # Pretend started so nothing drains the queue.
+    writer.submit("host", "s.txt", "kept")
+    writer.submit("host", "s.txt", "dropped")
+    assert writer.dropped == 1
+
+
+def test_stage_rates(monkeypatch, tmp_path):
+    monkeypatch.setattr(sample_logger, "_sample_rates", {})
+    set_sample_rates({1: 1.0, 2: 0.0})
+    assert should_sample(1)
+    assert not should_sample(2)
+
+    writer = SampleLogWriter(root=str(tmp_path))
+    monkeypatch.setattr(sample_logger, "sample_writer", writer)
+    completions = [[{"content": "<answer>\n2\n</answer>\n"}]]
+    prompts = [[{"role": "user", "content": "1 + 1?"}]]
+    stage1_rewards.correctness_reward_func(
+        prompts, completions, ["2"], logging=True
+    )
+    writer.flush()
+    writer.close()
+
+    text = read(tmp_path / stage1_rewards.SAMPLES_DIR / "correctness_samples.txt")
+    assert text.startswith("-" * 20 + "Question:\n1 + 1?")
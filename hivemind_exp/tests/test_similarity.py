@@ -0,0 +1,83 @@
+import random
+from difflib import SequenceMatcher
+
+import numpy as np
+import pytest
+
+import hivemind_exp.gsm8k.stage3_rewards as stage3_rewards
+from hivemind_exp.gsm8k.similarity import (
+    SIMILARITY_BACKEND_ENV,
+    difflib_similarity,
+    get_similarity_backend,
+    ngram_similarity,
+)
+from hivemind_exp.tests.fake_data import QUESTION, STAGE_2_MERGED
+
+ORIGINAL = STAGE_2_MERGED["question"]
+OTHER = (
+    "Natalia sold clips to 48 of her friends in April, and then she sold half as "
+    "many clips in May. How many clips did Natalia sell altogether in April and May?"
+)
+
+
+def recreations():
+    """What stage 3 <question> blocks look like: copies, partial copies, rewordings."""
+    rng = random.Random(0)
+    words = ORIGINAL.split()
+    return [
+        ORIGINAL,
+        ORIGINAL.lower(),
+        ORIGINAL.replace("Carl", "John").replace("85", "90"),
+        " ".join(words[: len(words) // 2]),
+        " ".join(w for w in words if rng.random() > 0.2),
+        " ".join(w for w in words if rng.random() > 0.5),
+        " ".join(rng.sample(words, len(words))),
+        "Carl needs an 85 average over four tests; he scored 80, 75 and 90. "
+        "What does he need on the last test?",
+        ORIGINAL + " " + OTHER,
+        OTHER,
+        QUESTION,
+        "the answer is 95",
+        "",
+    ]
+
+
+def test_difflib_backend_matches_sequence_matcher():
+    candidates = recreations()
+    assert difflib_similarity(candidates, ORIGINAL) == [
+        SequenceMatcher(None, c, ORIGINAL).ratio() for c in candidates
+    ]
+
+
+def test_ngram_backend_calibration():
+    candidates = recreations()
+    exact = np.array(difflib_similarity(candidates, ORIGINAL))
+    fast = np.array(ngram_similarity(candidates, ORIGINAL))
+
+    assert fast[0] == 1.0
+    assert ngram_similarity([""], "") == [1.0]
+    assert np.corrcoef(exact, fast)[0, 1] > 0.95
+    assert np.abs(exact - fast).mean() < 0.1
+    assert np.abs(exact - fast).max() < 0.3
+
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.delenv(SIMILARITY_BACKEND_ENV, raising=False)
+    assert get_similarity_backend() is difflib_similarity
+    monkeypatch.setenv(SIMILARITY_BACKEND_ENV, "ngram")
+    assert get_similarity_backend() is ngram_similarity
+    with pytest.raises(ValueError):
+        get_similarity_backend("levenshtein")
+
+
+def test_question_recreation_reward_uses_backend(monkeypatch):
+    prompts = [[{"role": "user", "content": STAGE_2_MERGED["stage2_prompt"]}]] * 2
+    recreated = [ORIGINAL, OTHER]
+    completions = [[{"content": f"<question>\n{q}\n</question>\n"}] for q in recreated]
+
+    for name, backend in (("difflib", difflib_similarity), ("ngram", ngram_similarity)):
+        monkeypatch.setenv(SIMILARITY_BACKEND_ENV, name)
+        rewards = stage3_rewards.question_recreation_reward_func(
+            prompts, list(completions), weighting=0.5
+        )
+        assert rewards == [0.5 * r for r in backend(recreated, ORIGINAL)]
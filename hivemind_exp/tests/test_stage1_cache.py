@@ -0,0 +1,107 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from datasets import Dataset, DatasetDict
+
+import hivemind_exp.gsm8k.generate_prompts as generate_prompts
+import hivemind_exp.gsm8k.stage1_cache as stage1_cache
+from hivemind_exp.gsm8k.stage1_cache import STAGE1_CACHE_ENV, STAGE1_REFRESH_ENV
+
+GSM8K = DatasetDict(
+    {
+        "train": Dataset.from_dict(
+            {"question": ["1 + 1?", "2 + 3?"], "answer": ["1 + 1\n#### 2", "#### 5"]}
+        ),
+        "test": Dataset.from_dict({"question": ["4 - 1?"], "answer": ["#### 3"]}),
+    }
+)
+
+
+class FakeHfApi:
+    """Resolves every revision to `sha`; raises as if offline when it is None."""
+
+    sha = "a" * 40
+    calls = 0
+
+    def dataset_info(self, dataset_id, revision=None, timeout=None):
+        FakeHfApi.calls += 1
+        if FakeHfApi.sha is None:
+            raise ConnectionError("offline")
+        return SimpleNamespace(sha=FakeHfApi.sha)
+
+
+@pytest.fixture
+def loads(monkeypatch, tmp_path):
+    monkeypatch.setenv(STAGE1_CACHE_ENV, str(tmp_path))
+    monkeypatch.delenv("PROMPT_GENERATOR_ROLE", raising=False)
+    monkeypatch.delenv(STAGE1_REFRESH_ENV, raising=False)
+    monkeypatch.setattr(stage1_cache, "HfApi", FakeHfApi)
+    monkeypatch.setattr(FakeHfApi, "sha", "a" * 40)
+    monkeypatch.setattr(FakeHfApi, "calls", 0)
+    calls = []
+
+    def load_dataset(*args, **kwargs):
+        calls.append((args, kwargs))
+        return GSM8K
+
+    monkeypatch.setattr(generate_prompts, "load_dataset", load_dataset)
+    return calls
+
+
+def cached_keys(root):
+    return [d for d in os.listdir(root) if d != "refs"]
+
+
+def test_warm_start_skips_loading(loads, tmp_path):
+    train, test = generate_prompts.get_stage1_samples()
+    assert len(loads) == 1
+    assert loads[0][1]["revision"] == "a" * 40  # The resolved commit, not the branch.
+    assert train["answer"] == ["2", "5"]
+    assert test[0]["prompt"][-1] == {"role": "user", "content": "4 - 1?"}
+    assert len(cached_keys(tmp_path)) == 1
+
+    warm_train, warm_test = generate_prompts.get_stage1_samples()
+    assert len(loads) == 1
+    assert FakeHfApi.calls == 1  # Warm starts use the recorded commit.
+    assert warm_train.to_list() == train.to_list()
+    assert warm_test.to_list() == test.to_list()
+    assert warm_train.cache_files
+
+
+def test_key_covers_prompt_and_commit(loads, monkeypatch, tmp_path):
+    generate_prompts.get_stage1_samples()
+    monkeypatch.setenv("PROMPT_GENERATOR_ROLE", "PIRATE")
+    train, _ = generate_prompts.get_stage1_samples()
+    assert train[0]["prompt"][0]["content"].startswith(generate_prompts.PROMPT_ROLES["PIRATE"])
+    # The branch moved on: only picked up when asked to refresh.
+    monkeypatch.setattr(FakeHfApi, "sha", "b" * 40)
+    generate_prompts.get_stage1_samples()
+    assert len(loads) == 2
+    monkeypatch.setenv(STAGE1_REFRESH_ENV, "1")
+    generate_prompts.get_stage1_samples()
+    assert len(loads) == 3
+    assert loads[2][1]["revision"] == "b" * 40
+    assert len(cached_keys(tmp_path)) == 3
+
+
+def test_offline_uses_last_resolved_commit(loads, monkeypatch, tmp_path):
+    generate_prompts.get_stage1_samples()
+    monkeypatch.setattr(FakeHfApi, "sha", None)
+    generate_prompts.get_stage1_samples()
+    assert len(loads) == 1
+
+    # Never resolved: loaded by branch, but not cached under it.
+    monkeypatch.setenv(STAGE1_CACHE_ENV, str(tmp_path / "other"))
+    generate_prompts.get_stage1_samples()
+    assert len(loads) == 2
+    assert loads[1][1]["revision"] == "main"
+    assert not os.path.exists(tmp_path / "other")
+
+
+def test_cache_disabled(loads, monkeypatch, tmp_path):
+    monkeypatch.setenv(STAGE1_CACHE_ENV, "")
+    generate_prompts.get_stage1_samples()
+    generate_prompts.get_stage1_samples()
+    assert len(loads) == 2
+    assert os.listdir(tmp_path) == []
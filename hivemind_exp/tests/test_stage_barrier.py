@@ -0,0 +1,69 @@
+import pytest
+
+from hivemind_exp.stage_barrier import StageBarrier
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def publishing(fake, times):
+    # Peer i has published once fake.now >= times[i].
+    return lambda: {f"peer{i}": 1.0 for i, t in enumerate(times) if fake.now >= t} or None
+
+
+@pytest.mark.parametrize(
+    "quorum, expected, need",
+    [(3, None, 3), (0.5, 10, 5), (0.75, 10, 8), (0.75, None, 1), (1.0, 4, 4), (0.01, 4, 1)],
+)
+def test_required(quorum, expected, need):
+    assert StageBarrier(quorum).required(expected) == need
+
+
+def test_returns_once_quorum_published():
+    fake = FakeTime()
+    barrier = StageBarrier(0.5, timeout=60, clock=fake.clock, sleep=fake.sleep)
+    result = barrier.wait(publishing(fake, [0, 1.2, 3, 100]), expected=4)
+    assert result.reached
+    assert len(result.value) == 2
+    assert fake.sleeps == [0.5, 1.0]
+    assert result.waited == 1.5
+
+
+def test_immediate_when_already_published():
+    fake = FakeTime()
+    barrier = StageBarrier(2, clock=fake.clock, sleep=fake.sleep)
+    result = barrier.wait(publishing(fake, [0, 0, 0]))
+    assert (result.reached, result.waited, fake.sleeps) == (True, 0, [])
+
+
+def test_deadline_returns_what_is_available():
+    fake = FakeTime()
+    barrier = StageBarrier(
+        1.0, timeout=10, max_interval=4, clock=fake.clock, sleep=fake.sleep
+    )
+    retries = []
+    result = barrier.wait(
+        publishing(fake, [2, 50]), expected=2, on_retry=lambda *a: retries.append(a)
+    )
+    assert not result.reached
+    assert list(result.value) == ["peer0"]
+    assert result.waited == 10
+    assert fake.sleeps == [0.5, 1, 2, 4, 2.5]
+    assert retries[0] == (0, 2, 0.5)
+
+
+def test_nothing_published():
+    fake = FakeTime()
+    barrier = StageBarrier(timeout=3, clock=fake.clock, sleep=fake.sleep)
+    result = barrier.wait(lambda: None)
+    assert result.value is None and not result.reached
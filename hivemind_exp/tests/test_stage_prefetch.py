@@ -0,0 +1,110 @@
+import threading
+from types import SimpleNamespace
+
+import hivemind_exp.gsm8k.stage_utils as stage_utils
+from hivemind_exp.gsm8k.stage_utils import StagePrefetcher, merged_prev_stage_datasets
+from hivemind_exp.hivemind_utils import HivemindNode
+from hivemind_exp.trainer.hivemind_grpo_trainer import PrefetchCallback
+
+
+class FakeSwarm:
+    """Peers' published stage outputs, and the version of their reward entry."""
+
+    def __init__(self, monkeypatch, num_peers=4):
+        self.outputs = {
+            f"peer{i}": {f"q{j}": (0.0, f"peer{i}") for j in range(i + 1)}
+            for i in range(num_peers)
+        }
+        self.versions = {k: 1.0 for k in self.outputs}
+        self.fetches = []
+        monkeypatch.setattr(stage_utils, "get_outputs", self.get_outputs)
+        monkeypatch.setattr(stage_utils, "get_outputs_many", self.get_outputs_many)
+        monkeypatch.setattr(stage_utils, "get_dht_value", self.get_dht_value)
+        monkeypatch.setattr(stage_utils, "get_dht_versions", self.get_dht_versions)
+
+    def publish(self, node_key, q):
+        self.outputs[node_key][q] = (0.0, node_key)
+        self.versions[node_key] += 1
+
+    def get_outputs(self, dht, node_key, r, s, get_cached_fn=None, refresh=False):
+        return {}  # Nothing published locally.
+
+    def get_outputs_many(self, dht, node_keys, r, s, refresh=False, timeout=None):
+        self.fetches.extend(node_keys)
+        return {k: dict(self.outputs[k]) for k in node_keys}
+
+    def get_dht_value(self, dht, key, beam_size=None):
+        return {k: 1.0 for k in self.versions}
+
+    def get_dht_versions(self, dht, key, beam_size=None):
+        return dict(self.versions)
+
+
+def merge(prefetcher=None):
+    node = HivemindNode("test", "local")
+    merged, _ = merged_prev_stage_datasets(
+        None,
+        node,
+        0,
+        1,
+        lambda outputs: sorted(outputs.values()),
+        lambda v: (v, v),
+        quorum=1,
+        prefetcher=prefetcher,
+    )
+    return sorted(merged)
+
+
+def test_prefetch_fetches_republished_peers_only(monkeypatch):
+    swarm = FakeSwarm(monkeypatch)
+    prefetcher = StagePrefetcher(None, HivemindNode("test", "local"))
+    prefetcher.prefetch(0, 1)
+    assert sorted(swarm.fetches) == sorted(swarm.outputs)
+
+    swarm.fetches.clear()
+    swarm.publish("peer1", "q9")
+    prefetcher.prefetch(0, 1)
+    assert swarm.fetches == ["peer1"]
+    assert "q9" in prefetcher.outputs["peer1"]
+
+    swarm.publish("peer2", "q9")
+    assert sorted(prefetcher.fresh_outputs(0, 1)) == ["peer0", "peer1", "peer3"]
+    assert prefetcher.fresh_outputs(0, 2) == {}
+
+
+def test_merge_with_prefetch_matches_full_fetch(monkeypatch):
+    swarm = FakeSwarm(monkeypatch)
+    prefetcher = StagePrefetcher(None, HivemindNode("test", "local"))
+    prefetcher.prefetch(0, 1)
+    swarm.publish("peer3", "q9")
+    swarm.fetches.clear()
+
+    prefetched = merge(prefetcher)
+    assert swarm.fetches == ["peer3"]
+    assert prefetched == merge()
+    assert ["peer3"] in prefetched
+
+
+def test_prefetch_callback():
+    calls = []
+    done = threading.Event()
+
+    def prefetch():
+        calls.append(1)
+        done.set()
+
+    callback = PrefetchCallback(prefetch, logger=None, interval=0.01)
+    callback.on_step_end(None, SimpleNamespace(global_step=4, max_steps=10), None)
+    assert callback.thread is None
+    callback.on_step_end(None, SimpleNamespace(global_step=5, max_steps=10), None)
+    assert done.wait(5)
+    callback.on_train_end(None, None, None)
+    assert not callback.thread.is_alive()  # Joined.
+    assert calls
+
+
+def test_prefetch_callback_stops_before_starting():
+    callback = PrefetchCallback(lambda: None, logger=None, interval=0.01)
+    callback.stop()  # Training failed before the prefetch started.
+    callback.on_step_end(None, SimpleNamespace(global_step=5, max_steps=10), None)
+    assert callback.thread is None
@@ -1,31 +1,92 @@
+import functools
 import gc
 import hashlib
 import logging
+import threading
 import time
 import traceback
-from typing import Any
+from typing import Any, Callable
 
 import datasets
 import torch
 from hivemind.dht import DHT
 from hivemind.utils import get_dht_time
+from transformers import TrainerCallback
 from trl import GRPOConfig, GRPOTrainer
 
 from hivemind_exp.debug_utils import print_system_info
+from hivemind_exp.dht_metrics import dht_metrics
 from hivemind_exp.dht_utils import (
     ROUND_STAGE_NUMBER_KEY,
     get_dht_value,
     get_round_and_stage,
     leaderboard_key,
     node_outputs_key,
+    publish_blobs_async,
     rewards_key,
 )
+from hivemind_exp.gsm8k.reward_cache import clear_batch_cache
 from hivemind_exp.hivemind_utils import HivemindNode, StageData
+from hivemind_exp.incremental_dataset import IncrementalDataset
+from hivemind_exp.outputs_cache import outputs_cache
+from hivemind_exp.outputs_codec import encode_outputs, extract_blobs
 from hivemind_exp.name_utils import get_name_from_peer_id
 
 
 MAX_TRAIN_FAILS = 5
 CADENCE_OF_UPDATE_STEPS = 4
+PREFETCH_START = 0.5  # Fraction of a stage's steps after which the next stage prefetches.
+PREFETCH_INTERVAL = 30  # Seconds between prefetches until the stage ends.
+
+
+class PrefetchCallback(TrainerCallback):
+    """
+    Calls prefetch_fn in a background thread, from PREFETCH_START of training
+    until it ends, every PREFETCH_INTERVAL seconds.
+    """
+
+    def __init__(
+        self,
+        prefetch_fn: Callable[[], None],
+        logger,
+        start=PREFETCH_START,
+        interval=PREFETCH_INTERVAL,
+    ):
+        self.prefetch_fn = prefetch_fn
+        self.logger = logger
+        self.start = start
+        self.interval = interval
+        self.thread = None
+        self._stop = threading.Event()
+
+    def _run(self):
+        while True:
+            try:
+                self.prefetch_fn()
+            except Exception:
+                self.logger.exception("Prefetching next stage outputs failed")
+            if self._stop.wait(self.interval):
+                return
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if (
+            self.thread is None
+            and not self._stop.is_set()
+            and state.global_step >= state.max_steps * self.start
+        ):
+            self.thread = threading.Thread(
+                target=self._run, name="stage-prefetch", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        """Stops prefetching, waiting for a prefetch in progress to finish."""
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.stop()
 
 
 class HivemindGRPOTrainer:
@@ -62,6 +123,12 @@ class HivemindGRPOTrainer:
             
             super().__init__(processing_class=tokenizer, **kwargs)
 
+        def _get_train_sampler(self):
+            # Stage datasets still being fetched grow while training.
+            if isinstance(self.train_dataset, IncrementalDataset):
+                return self.train_dataset.sampler(self.num_generations, seed=self.args.seed)
+            return super()._get_train_sampler()
+
         def publish_leaderboard(self):
             r, s = self.node.round_num, self.node.stage_num
             curr_rewards: dict[str, Any] | None = get_dht_value(
@@ -147,6 +214,8 @@ class HivemindGRPOTrainer:
                     self.logger.info("=" * 30)
             
             loss = super().compute_loss(model, inputs, *args, **kwargs)
+            # Component rewards were memoized for this step's completions.
+            clear_batch_cache()
             # Reward function must save node.outputs + node.rewards!
             # This is only here to publish to the DHT at the right time.
             # Only publish to DHT every N steps
@@ -155,11 +224,19 @@ class HivemindGRPOTrainer:
                 q_hash = hashlib.md5(question.encode()).hexdigest()
 
                 value = (time.time(), self.node.outputs)
+                expiration_time = get_dht_time() + self.node.out_expiration
+                published = value
+                if self.node.compact_outputs:
+                    # Shared texts are published once and referenced,
+                    # without holding up training on the lookup.
+                    outputs, blobs = extract_blobs(self.node.outputs)
+                    publish_blobs_async(self.dht, blobs, expiration_time)
+                    published = encode_outputs((value[0], outputs))
                 self.dht.store(
                     key=node_outputs_key(self.node),
                     subkey=q_hash,
-                    value=value,
-                    expiration_time=get_dht_time() + self.node.out_expiration,
+                    value=published,
+                    expiration_time=expiration_time,
                 )
                 self.node.put_stage_outputs(
                     self.node.round_num, self.node.stage_num, q_hash, value
@@ -227,6 +304,8 @@ class HivemindGRPOTrainer:
         for i, stage in enumerate(self.stage_data.stages[start_stage:]):
             stage_num = start_stage + i
             self.node.stage_num = stage_num
+            self.logger.debug(f"Peer outputs cache: {outputs_cache.stats()}")
+            outputs_cache.advance(round_num, stage_num)
 
             if is_coordinator:
                 self.dht.store(
@@ -270,11 +349,31 @@ class HivemindGRPOTrainer:
                 "reward_funcs": stage.reward_funcs,
                 "train_dataset": train_dataset,
                 "eval_dataset": test_dataset,
+                "callbacks": [],
             }
+            prefetch = None
+            if stage_num + 1 < len(self.stage_data.stages):
+                next_stage = self.stage_data.stages[stage_num + 1]
+                if next_stage.prefetch_fn:
+                    prefetch = PrefetchCallback(
+                        functools.partial(
+                            next_stage.prefetch_fn, round_num, stage_num + 1
+                        ),
+                        self.logger,
+                    )
+                    kwargs["callbacks"].append(prefetch)
             trainer = HivemindGRPOTrainer.PublishingGRPOTrainer(
                 self.node, self.dht, self.tokenizer, self.logger, **kwargs
             )
-            self.train_and_save(trainer, train_dataset)
+            try:
+                self.train_and_save(trainer, train_dataset)
+            finally:
+                # on_train_end does not fire if training raises; don't
+                # prefetch for this stage once the next one has started.
+                if prefetch is not None:
+                    prefetch.stop()
+            if isinstance(train_dataset, IncrementalDataset):
+                train_dataset.close()
             
             # Print LoRA summary after training
             if hasattr(self.model, "is_peft_model") and self.model.is_peft_model:
@@ -312,6 +411,7 @@ class HivemindGRPOTrainer:
             self.logger.info(
                 f"📉 Finished training round: {round_num} stage: {stage_num}"
             )
+            dht_metrics.log(self.logger)
 
         # Push to HF hub if desired
         # TODO: Come back and add additional logic checking if they've provided access token+HF username
@@ -394,6 +494,9 @@ class HivemindGRPOTrainer:
         # Log and save metrics
         metrics = train_result.metrics
         metrics["train_samples"] = len(train_dataset)
+        stage_key = (self.node.round_num, self.node.stage_num)
+        if stage_key in self.node.stage_barrier_waits:
+            metrics["stage_barrier_wait"] = self.node.stage_barrier_waits[stage_key]
         trainer.log_metrics("train", metrics)
         trainer.save_metrics("train", metrics)
         trainer.save_state()
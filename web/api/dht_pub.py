@@ -8,12 +8,16 @@ import uuid
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
-
-from hivemind.dht import DHT
-
-from hivemind_exp.chain_utils import ModalSwarmCoordinator
-from hivemind_exp.dht_utils import get_dht_value, outputs_key, rewards_key
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from hivemind_exp.dht_utils import (
+    get_dht_value,
+    get_dht_values,
+    hash_keys,
+    outputs_key,
+    resolve_blobs,
+    rewards_key,
+)
 from hivemind_exp.name_utils import get_name_from_peer_id
 
 from .gossip_utils import stage1_message, stage2_message, stage3_message
@@ -25,6 +29,11 @@ from .kinesis import (
     RewardsMessageData,
 )
 
+if TYPE_CHECKING:
+    from hivemind.dht import DHT
+
+    from hivemind_exp.chain_utils import ModalSwarmCoordinator
+
 
 class BaseDHTPublisher(ABC):
     """
@@ -34,11 +43,11 @@ class BaseDHTPublisher(ABC):
 
     def __init__(
         self,
-        dht: DHT,
+        dht: "DHT",
         kinesis_client: Kinesis,
         logger: logging.Logger,
         poll_interval_seconds: int = 300,  # 5 minutes default
-        coordinator: Optional[ModalSwarmCoordinator] = None,
+        coordinator: Optional["ModalSwarmCoordinator"] = None,
     ):
         """
         Initialize the DHT publisher.
@@ -112,7 +121,20 @@ class BaseDHTPublisher(ABC):
     ) -> dict[str, Any] | None:
         outputs_key_str = outputs_key(node_key, round_num, stage_num)
         outputs_data = get_dht_value(self.dht, key=outputs_key_str)
-        return outputs_data
+        if not outputs_data:
+            return outputs_data
+        return resolve_blobs(self.dht, {None: hash_keys(outputs_data)})[None]
+
+    def _get_outputs_data_many(
+        self, node_round_stages: list[tuple[str, int, int]]
+    ) -> dict[tuple[str, int, int], dict[str, Any] | None]:
+        """Looks up the outputs of many (node key, round, stage) in one DHT batch."""
+        keys = {nrs: outputs_key(*nrs) for nrs in node_round_stages}
+        values = get_dht_values(self.dht, list(keys.values()))
+        outputs = resolve_blobs(
+            self.dht, {key: hash_keys(value) for key, value in values.items() if value}
+        )
+        return {nrs: outputs.get(key) for nrs, key in keys.items()}
 
     def _get_peer_name_from_id(self, peer_id: str) -> str:
         return get_name_from_peer_id(peer_id) or peer_id
@@ -151,7 +173,7 @@ class RewardsDHTPublisher(BaseDHTPublisher):
 
     def __init__(
         self,
-        dht: DHT,
+        dht: "DHT",
         kinesis_client,
         logger=None,
         poll_interval_seconds: int = 300,
@@ -346,7 +368,7 @@ class GossipDHTPublisher(BaseDHTPublisher):
 
     def __init__(
         self,
-        dht: DHT,
+        dht: "DHT",
         kinesis_client,
         logger=None,
         poll_interval_seconds: int = 300,
@@ -389,47 +411,60 @@ class GossipDHTPublisher(BaseDHTPublisher):
             # Update the last polled time
             self.last_polled = datetime.now(timezone.utc)
 
-            for r, s, node_key in itertools.product(
-                reversed(range(start_round, new_round + 1)),  # Most recent first
-                reversed(range(0, 3)),
-                nodes,
-            ):
-                if r == new_round and s > new_stage:
-                    continue
-                if node_gossip_count[node_key] > node_gossip_limit:
+            round_stages = [
+                (r, s)
+                for r, s in itertools.product(
+                    reversed(range(start_round, new_round + 1)),  # Most recent first
+                    reversed(range(0, 3)),
+                )
+                if not (r == new_round and s > new_stage)
+            ]
+            limit_reached = False
+            for r, s in round_stages:
+                # Stop before fetching a batch whose first node is already over its limit.
+                if limit_reached or node_gossip_count[nodes[0]] > node_gossip_limit:
                     break
 
-                outputs = self._get_outputs_data(node_key, r, s)
-                if outputs is None:
-                    continue
-
-                sorted_outputs = sorted(list(outputs.items()), key=lambda t: t[1][0])
-
-                for q_hash, (ts, outputs) in sorted_outputs:
-                    # Generate a unique-ish ID for each message
-                    gossip_id = hashlib.md5(
-                        f"{node_key}_{r}_{s}_{q_hash}".encode()
-                    ).hexdigest()
-
-                    message = f"Cannot render output for unknown stage {s}"
-                    if s < len(STAGE_MESSAGE_FNS):
-                        message = STAGE_MESSAGE_FNS[s](node_key, outputs["question"], ts, outputs)
-
-                    round_gossip.append(
-                        (
-                            ts,
-                            {
-                                "id": gossip_id,
-                                "message": message,
-                                "node": get_name_from_peer_id(node_key),
-                                "nodeId": node_key,
-                            },
-                        )
-                    )
-                    node_gossip_count[node_key] += 1
+                # One batched lookup per (round, stage), so older stages are
+                # only fetched while the message target isn't met.
+                stage_outputs = self._get_outputs_data_many([(node_key, r, s) for node_key in nodes])
+
+                for node_key in nodes:
                     if node_gossip_count[node_key] > node_gossip_limit:
+                        limit_reached = True
                         break
 
+                    outputs = stage_outputs.get((node_key, r, s))
+                    if outputs is None:
+                        continue
+
+                    sorted_outputs = sorted(list(outputs.items()), key=lambda t: t[1][0])
+
+                    for q_hash, (ts, outputs) in sorted_outputs:
+                        # Generate a unique-ish ID for each message
+                        gossip_id = hashlib.md5(
+                            f"{node_key}_{r}_{s}_{q_hash}".encode()
+                        ).hexdigest()
+
+                        message = f"Cannot render output for unknown stage {s}"
+                        if s < len(STAGE_MESSAGE_FNS):
+                            message = STAGE_MESSAGE_FNS[s](node_key, outputs["question"], ts, outputs)
+
+                        round_gossip.append(
+                            (
+                                ts,
+                                {
+                                    "id": gossip_id,
+                                    "message": message,
+                                    "node": get_name_from_peer_id(node_key),
+                                    "nodeId": node_key,
+                                },
+                            )
+                        )
+                        node_gossip_count[node_key] += 1
+                        if node_gossip_count[node_key] > node_gossip_limit:
+                            break
+
             self._publish_gossip(round_gossip)
 
         except Exception as e:
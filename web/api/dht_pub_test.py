@@ -410,8 +410,8 @@ class TestGossipDHTPublisher:
         rewards_data = {"peer_id_1": 0.5, "peer_id_2": 0.3}
         self.publisher._get_rewards_data = MagicMock(return_value=rewards_data)
 
-        # Mock the _get_outputs_data method to return None (no outputs)
-        self.publisher._get_outputs_data = MagicMock(return_value=None)
+        # Mock the _get_outputs_data_many method to return no outputs
+        self.publisher._get_outputs_data_many = MagicMock(return_value={})
 
         # Mock the _publish_gossip method
         self.mock_kinesis.put_gossip = MagicMock()
@@ -440,6 +440,30 @@ class TestGossipDHTPublisher:
         # Check that last_polled was updated
         assert self.publisher.last_polled is not None
 
+    @patch("web.api.dht_pub.get_name_from_peer_id", return_value="name")
+    @patch("web.api.dht_pub.stage1_message", return_value="message")
+    @patch("web.api.dht_pub.stage2_message", return_value="message")
+    def test_poll_once_stops_fetching_at_message_target(self, *_):
+        """Test that older rounds/stages aren't fetched once every node hit its limit."""
+        self.coordinator.get_round_and_stage.return_value = (1, 1)
+        nodes = [f"peer_id_{i}" for i in range(20)]
+        self.publisher._get_rewards_data = MagicMock(return_value=dict.fromkeys(nodes, 0.5))
+
+        # 11 messages per node is over the 200 / 20 limit.
+        def get_outputs(node_round_stages):
+            outputs = {f"q{i}": (float(i), {"question": "q"}) for i in range(11)}
+            return {nrs: outputs for nrs in node_round_stages}
+
+        self.publisher._get_outputs_data_many = MagicMock(side_effect=get_outputs)
+        self.publisher._poll_once()
+
+        # Only the current (round, stage) batch is fetched, one key per node.
+        self.publisher._get_outputs_data_many.assert_called_once()
+        (node_round_stages,) = self.publisher._get_outputs_data_many.call_args.args
+        assert sorted(node_round_stages) == sorted((n, 1, 1) for n in nodes)
+        (gossip,) = self.mock_kinesis.put_gossip.call_args.args
+        assert len(gossip.data) == 20 * 11
+
     def test_poll_once_error(self, caplog):
         """Test polling when there's an error."""
         # Set the caplog level to capture ERROR messages
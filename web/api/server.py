@@ -14,7 +14,6 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from pythonjsonlogger import jsonlogger
 
-from hivemind_exp.chain_utils import ModalSwarmCoordinator, setup_web3
 from hivemind_exp.dht_utils import *
 from hivemind_exp.name_utils import *
 
@@ -286,6 +285,8 @@ def populate_cache():
 
 
 def main(args):
+    from hivemind_exp.chain_utils import ModalSwarmCoordinator, setup_web3
+
     coordinator = ModalSwarmCoordinator(
         "", web3=setup_web3()
     )  # Only allows contract calls
@@ -333,53 +333,75 @@ class Cache:
             node_gossip_limit = max(1, MESSAGE_TARGET / len(nodes))
 
             start_round = max(0, curr_round - 3)
-            for r, s, node_key in itertools.product(
-                reversed(range(start_round, curr_round + 1)),  # Most recent first
-                reversed(range(0, 3)),
-                nodes,
-            ):
+            round_stages = [
+                (r, s)
+                for r, s in itertools.product(
+                    reversed(range(start_round, curr_round + 1)),  # Most recent first
+                    reversed(range(0, 3)),
+                )
+                if not (r == curr_round and s > curr_stage)
+            ]
+            limit_reached = False
+            for r, s in round_stages:
                 # Check if we've exceeded 10 seconds
                 # Adding this as a stop gap to make sure the gossip collection doesn't stop other data from being polled.
-                if (datetime.now() - start_time).total_seconds() > 10:
+                remaining = 10 - (datetime.now() - start_time).total_seconds()
+                if remaining <= 0:
                     self.logger.warning(">>> gossip collection timed out after 10s")
                     break
+                # Stop before fetching a batch whose first node is already over its limit.
+                if limit_reached or node_gossip_count[nodes[0]] > node_gossip_limit:
+                    break
 
-                if r == curr_round and s > curr_stage:
-                    continue
+                # One batched lookup per (round, stage), so older stages are
+                # only fetched while the message target isn't met.
+                stage_outputs = get_dht_values(
+                    self.dht,
+                    [outputs_key(node_key, r, s) for node_key in nodes],
+                    beam_size=100,
+                    timeout=remaining,
+                )
+                stage_outputs = resolve_blobs(
+                    self.dht,
+                    {key: hash_keys(outputs) for key, outputs in stage_outputs.items() if outputs},
+                    timeout=max(10 - (datetime.now() - start_time).total_seconds(), 0),
+                )
 
-                if node_gossip_count[node_key] > node_gossip_limit:
-                    break
+                for node_key in nodes:
+                    if node_gossip_count[node_key] > node_gossip_limit:
+                        limit_reached = True
+                        break
 
-                if outputs := self._get_dht_value(key=outputs_key(node_key, r, s)):
-                    sorted_outputs = sorted(
-                        list(outputs.items()), key=lambda t: t[1][0]
-                    )
-                    for q_hash, (ts, outputs) in sorted_outputs:
-                        # Generate a unique-ish ID for each message
-                        gossip_id = hashlib.md5(
-                            f"{node_key}_{r}_{s}_{q_hash}".encode()
-                        ).hexdigest()
-
-                        if s < len(STAGE_MESSAGE_FNS):
-                            message = STAGE_MESSAGE_FNS[s](
-                                node_key, outputs["question"], ts, outputs
-                            )
-                        else:
-                            message = f"Cannot render output for unknown stage {s}"
-                        round_gossip.append(
-                            (
-                                ts,
-                                {
-                                    "id": gossip_id,
-                                    "message": message,
-                                    "node": get_name_from_peer_id(node_key),
-                                    "nodeId": node_key,
-                                },
-                            )
+                    if outputs := stage_outputs.get(outputs_key(node_key, r, s)):
+                        sorted_outputs = sorted(
+                            list(outputs.items()), key=lambda t: t[1][0]
                         )
-                        node_gossip_count[node_key] += 1
-                        if node_gossip_count[node_key] > node_gossip_limit:
-                            break
+                        for q_hash, (ts, outputs) in sorted_outputs:
+                            # Generate a unique-ish ID for each message
+                            gossip_id = hashlib.md5(
+                                f"{node_key}_{r}_{s}_{q_hash}".encode()
+                            ).hexdigest()
+
+                            if s < len(STAGE_MESSAGE_FNS):
+                                message = STAGE_MESSAGE_FNS[s](
+                                    node_key, outputs["question"], ts, outputs
+                                )
+                            else:
+                                message = f"Cannot render output for unknown stage {s}"
+                            round_gossip.append(
+                                (
+                                    ts,
+                                    {
+                                        "id": gossip_id,
+                                        "message": message,
+                                        "node": get_name_from_peer_id(node_key),
+                                        "nodeId": node_key,
+                                    },
+                                )
+                            )
+                            node_gossip_count[node_key] += 1
+                            if node_gossip_count[node_key] > node_gossip_limit:
+                                break
 
         except Exception as e:
             self.logger.warning("could not get gossip: %s", e)